@@ -0,0 +1,416 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+An asyncio based backend of douban spider. It requires Python 3.5 or
+later. Pages are parsed with the same visitors as :Spider:, and data is
+written with the same :Sqlite3Host:.
+"""
+import ssl
+import sys
+import logging
+import threading
+import asyncio
+from urllib.parse import urlparse, urljoin
+
+from douban import Movie, Celebrity, UrlParseException, extractrecord
+from httpclient import HttpStatusException
+from frontier import CrawlFrontier
+from celebritycache import CelebrityCache
+
+class AsyncSpider(object):
+    """
+    Fetch data with non-blocking HTTP requests and save it to database.
+    It has the same start()/stop()/set_complete_callback() contract as
+    :Spider:, but a single background thread keeps up to concurrency
+    requests in flight.
+
+    Both http and https are fetched. HTTPS through proxy goes by a
+    CONNECT tunnel, which needs Python 3.11 or later.
+    """
+    MAX_REDIRECTS = 5
+    DEFAULT_PORTS = {'http': 80, 'https': 443}
+
+    def __init__(self, db_host, max_movies = 0, concurrency = 100, \
+                 timeout_secs = 5, proxy = None, rate_limiter = None, \
+                 frontier_strategy = "fifo", parse_pool = None, \
+                 ssl_context = None):
+        """
+        AsyncSpider.__init__(self, db_host, max_movies = 0,
+                             concurrency = 100, timeout_secs = 5,
+                             proxy = None, rate_limiter = None,
+                             frontier_strategy = "fifo",
+                             parse_pool = None, ssl_context = None)
+
+        The concurrency limits number of HTTP requests in flight. The
+        proxy is an optional (host, port) tuple of HTTP proxy. An
+        optional :HostRateLimiter: throttles requests to each host. The
+        frontier_strategy is passed to :CrawlFrontier:.
+
+        Pages are parsed in event loop thread, unless a started
+        :ParsePool: is given. Then the loop only waits for records.
+
+        The ssl_context verifies HTTPS servers. None means default
+        context of ssl module.
+        """
+        self.__frontier = CrawlFrontier(db_host, frontier_strategy)
+        self.__celebrities = CelebrityCache(db_host)
+        self.__seeds = []
+        self.__index = {
+            'parsed_movies': 0,
+            "parsed_celebrities": 0
+        }
+        self.__db_host = db_host
+        self.__max_movies = max_movies
+        self.__concurrency = concurrency
+        self.__timeout = timeout_secs
+        self.__proxy = proxy
+        self.__rate_limiter = rate_limiter
+        self.__parse_pool = parse_pool
+        self.__ssl_context = ssl_context
+        self.__lock = threading.Lock()
+        self.__started = False
+        self.__loop = None
+        self.__stop_event = None
+        self.__background = threading.Thread(target=self.__worker_thread)
+        self.__complete_callbacks = []
+
+    def set_movie_seed(self, seed_movie_douban_id):
+        self.__seeds.append(seed_movie_douban_id)
+
+    def set_complete_callback(self, complete_callback):
+        with self.__lock:
+            self.__complete_callbacks.append(complete_callback)
+
+    def start(self):
+        """
+        AsyncSpider.start(self)
+
+        Start background thread running event loop, write all fetched
+        data to database.
+        """
+        with self.__lock:
+            if self.__started is True:
+                return
+            self.__started = True
+            self.__background.start()
+
+    def stop(self):
+        """
+        AsyncSpider.stop(self)
+
+        Ask background thread to stop. Movies in flight are cancelled
+        and saved as partial movies. When it's done, complete callbacks
+        are called once.
+        """
+        with self.__lock:
+            if self.__started is False:
+                logging.warn("Already stopped. No need to do it twice.")
+                return
+            logging.info("Calling async spider.stop().")
+            self.__started = False
+            if self.__loop is not None:
+                self.__loop.call_soon_threadsafe(self.__stop_event.set)
+
+    def __worker_thread(self):
+        logging.info("AsyncWorker: starts.")
+        loop = asyncio.new_event_loop()
+        try:
+            with self.__lock:
+                self.__loop = loop
+                self.__stop_event = asyncio.Event(**self.__loop_arg(loop))
+                if self.__started is False:
+                    # Stopped before we start.
+                    self.__stop_event.set()
+            if not self.__worker_init_database():
+                return
+            loop.run_until_complete(self.__main_loop())
+            self.__worker_save_pending_items()
+        except Exception as e:
+            import traceback
+            tb = traceback.format_exc()
+            logging.error("FATAL: Exception from async worker: %s" % tb)
+        finally:
+            try:
+                self.__db_host.stop()
+            except Exception as e:
+                logging.error("Failure when stopping database.")
+            with self.__lock:
+                self.__loop = None
+                self.__started = False
+            loop.close()
+            self.__invoke_callback()
+            logging.info("AsyncWorker: Complete. Bye.")
+
+    def __loop_arg(self, loop):
+        # The loop parameter was removed from asyncio primitives in
+        # Python 3.10, when they get loop from running context.
+        if sys.version_info < (3, 10):
+            return {'loop': loop}
+        return {}
+
+    def __worker_init_database(self):
+        try:
+            self.__db_host.start()
+            self.__frontier.load()
+            self.__frontier.extend(self.__seeds)
+            self.__celebrities.load()
+            logging.info("Database initialized successfully.")
+        except Exception as e:
+            logging.error("FATAL: Database is wrong. Can't continue.")
+            return False
+        return True
+
+    async def __main_loop(self):
+        semaphore = asyncio.Semaphore(self.__concurrency, \
+                                      **self.__loop_arg(self.__loop))
+        in_flight = {}
+        stop_waiter = asyncio.ensure_future(self.__stop_event.wait())
+        while not self.__stop_event.is_set():
+            # Schedule as many movies as we can. Each movie task holds
+            # semaphore only when a request is really in flight.
+            while len(in_flight) < self.__concurrency and \
+                    self.__frontier.pending_count() != 0:
+                if self.__max_movies > 0:
+                    scheduled = self.__index["parsed_movies"] + \
+                                len(in_flight)
+                    if scheduled >= self.__max_movies:
+                        break
+                movie_id = self.__frontier.pop()
+                if movie_id is None:
+                    # Only failed movies waiting for retry.
+                    break
+                task = asyncio.ensure_future( \
+                        self.__fetch_movie(semaphore, movie_id))
+                in_flight[task] = movie_id
+            # Wake up when a failed movie is due for retry, too.
+            retry_wait = self.__frontier.retry_wait_secs()
+            if len(in_flight) == 0:
+                if retry_wait is None or self.__max_movies > 0 and \
+                        self.__index["parsed_movies"] >= self.__max_movies:
+                    break
+            done, pending = await asyncio.wait( \
+                    list(in_flight.keys()) + [stop_waiter], \
+                    timeout=retry_wait, \
+                    return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task is stop_waiter:
+                    continue
+                movie_id = in_flight.pop(task)
+                new_movie = task.result()
+                if new_movie is None:
+                    # Fails. Keep it in list and try it after a delay,
+                    # unless it fails too many times.
+                    if self.__frontier.fail(movie_id):
+                        logging.info("Movie %s will be retried.", movie_id)
+                    else:
+                        logging.error("Movie %s is dropped until next run.", \
+                                      movie_id)
+                else:
+                    self.__keep_movie(new_movie)
+        if len(in_flight) != 0:
+            logging.info("AsyncWorker: Cancel %d movies." % len(in_flight))
+            for task in in_flight:
+                task.cancel()
+            await asyncio.wait(list(in_flight.keys()))
+            for task, movie_id in in_flight.items():
+                self.__frontier.retry(movie_id)
+        stop_waiter.cancel()
+        logging.info("AsyncWorker: Main loop completes.")
+
+    async def __fetch_movie(self, semaphore, movie_id):
+        new_movie = Movie(movie_id)
+        try:
+            new_movie.load_record(await self.__extract(semaphore, \
+                                                       new_movie.url(), \
+                                                       "movie"))
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logging.error("Movie %s fails: %r", movie_id, e)
+            return None
+        logging.info("Movie %s fetched." % movie_id)
+        # All tasks share this thread, so never wait in cache. A
+        # celebrity being fetched by another task is left to it.
+        await asyncio.gather(*[self.__fetch_celebrity(semaphore, each) \
+                               for each in new_movie.celebrities() \
+                               if self.__celebrities.resolve(each, \
+                                                             wait = False)])
+        return new_movie
+
+    async def __fetch_celebrity(self, semaphore, celebrity):
+        celebrity_id = celebrity.douban_id()
+        failed = True
+        try:
+            search_url = celebrity.search_url()
+            if search_url is not None:
+                record = await self.__extract(semaphore, search_url, "search")
+                if not celebrity.load_search_record(record):
+                    failed = False
+                    return
+            celebrity.load_record(await self.__extract(semaphore, \
+                                                       celebrity.url(), \
+                                                       "celebrity"))
+            failed = False
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logging.error("Celebrity %s fails: %r", celebrity_id, e)
+        finally:
+            self.__celebrities.fetched(celebrity, celebrity_id, failed)
+
+    def __keep_movie(self, new_movie):
+        self.__celebrities.save_aliases()
+        unseen_celebrities = 0
+        for each_celebrity in new_movie.celebrities():
+            if self.__celebrities.owns(each_celebrity):
+                self.__db_host.save(each_celebrity)
+                self.__celebrities.saved(each_celebrity)
+                unseen_celebrities += 1
+        self.__index["parsed_celebrities"] += unseen_celebrities
+        self.__frontier.extend(new_movie.related_movie_ids(), \
+                               referrer = new_movie.douban_id(), \
+                               unseen_celebrities = unseen_celebrities)
+        self.__db_host.save(new_movie)
+        logging.info("Movie: %s saved" % new_movie.douban_id())
+        self.__frontier.movie_done(new_movie.douban_id())
+        self.__index["parsed_movies"] += 1
+
+    async def __extract(self, semaphore, url, kind):
+        body, charset = await self.__get(semaphore, url)
+        if self.__parse_pool is None:
+            return extractrecord(kind, body, charset)
+        # Pool blocks caller until record is ready. Wait for it in a
+        # thread of default executor.
+        return await self.__loop.run_in_executor(None, \
+                self.__parse_pool.extract, kind, body, charset)
+
+    async def __get(self, semaphore, url):
+        async with semaphore:
+            return await asyncio.wait_for(self.__get_follow(url), \
+                                          self.__timeout)
+
+    async def __get_follow(self, url):
+        for i in range(AsyncSpider.MAX_REDIRECTS):
+            status, headers, body = await self.__limited_request(url)
+            if status in (301, 302, 303, 307, 308) and "location" in headers:
+                url = urljoin(url, headers["location"])
+                continue
+            if status != 200:
+                raise HttpStatusException(url, status)
+            charset = "utf-8"
+            for param in headers.get("content-type", "").split(";"):
+                param = param.strip()
+                if param.lower().startswith("charset="):
+                    charset = param[len("charset="):].strip('"')
+            return body, charset
+        raise HttpStatusException(url, status)
+
+    async def __limited_request(self, url):
+        if self.__rate_limiter is None:
+            return await self.__request(url)
+        host = urlparse(url).netloc
+        wait_secs = self.__rate_limiter.reserve(host)
+        if wait_secs > 0:
+            await asyncio.sleep(wait_secs)
+        status, headers, body = await self.__request(url)
+        self.__rate_limiter.report(host, status)
+        return status, headers, body
+
+    async def __request(self, url):
+        parsed = urlparse(url)
+        if parsed.scheme not in AsyncSpider.DEFAULT_PORTS or \
+                not parsed.hostname:
+            raise UrlParseException(url)
+        host = parsed.hostname
+        port = parsed.port or AsyncSpider.DEFAULT_PORTS[parsed.scheme]
+        path = parsed.path or "/"
+        if parsed.query:
+            path += "?" + parsed.query
+        context = None
+        if parsed.scheme == "https":
+            context = self.__ssl_context or ssl.create_default_context()
+        if self.__proxy is None:
+            reader, writer = await asyncio.open_connection(host, port, \
+                    ssl = context, \
+                    server_hostname = host if context else None)
+        elif context is None:
+            # Proxy requires full URL in request line.
+            reader, writer = await asyncio.open_connection(*self.__proxy)
+            path = url
+        else:
+            if not hasattr(asyncio.StreamWriter, "start_tls"):
+                logging.error("AsyncWorker: HTTPS through proxy needs "
+                              "Python 3.11: %s", url)
+                raise UrlParseException(url)
+            reader, writer = await asyncio.open_connection(*self.__proxy)
+        try:
+            if context is not None and self.__proxy is not None:
+                request = "CONNECT %s:%d HTTP/1.1\r\nHost: %s:%d\r\n\r\n" \
+                        % (host, port, host, port)
+                writer.write(request.encode("ascii"))
+                status, headers = await self.__read_head(reader)
+                if status != 200:
+                    raise HttpStatusException(url, status)
+                await writer.start_tls(context, server_hostname = host)
+            request = ("GET %s HTTP/1.1\r\n"
+                       "Host: %s\r\n"
+                       "User-Agent: Mozilla/5.0\r\n"
+                       "Connection: close\r\n\r\n") % (path, parsed.netloc)
+            writer.write(request.encode("ascii"))
+            status, headers = await self.__read_head(reader)
+            if headers.get("transfer-encoding", "").lower() == "chunked":
+                chunks = []
+                while True:
+                    size = int((await reader.readline()).split(b";")[0], 16)
+                    if size == 0:
+                        break
+                    chunks.append(await reader.readexactly(size))
+                    await reader.readline()
+                body = b"".join(chunks)
+            elif "content-length" in headers:
+                body = await reader.readexactly(int(headers["content-length"]))
+            else:
+                body = await reader.read()
+            return status, headers, body
+        finally:
+            writer.close()
+
+    async def __read_head(self, reader):
+        status_line = await reader.readline()
+        status = int(status_line.split()[1])
+        headers = {}
+        while True:
+            line = await reader.readline()
+            line = line.decode("latin-1").strip()
+            if not line:
+                break
+            name, _, value = line.partition(":")
+            headers[name.strip().lower()] = value.strip()
+        return status, headers
+
+    def __worker_save_pending_items(self):
+        try:
+            pending_movies = self.__frontier.pending_count() + \
+                             self.__frontier.dropped_movie_count()
+            logging.info("AsyncWorker: %d movies parsed." % \
+                    self.__index["parsed_movies"])
+            logging.info("AsyncWorker: %d celebrities parsed." % \
+                    self.__index["parsed_celebrities"])
+            if pending_movies > 0:
+                logging.info("AsyncWorker: %d movies pending." % pending_movies)
+            # Pending movies are saved by frontier already.
+            self.__celebrities.save_aliases()
+            self.__db_host.commit()
+            logging.info("Pending items saved to disk.")
+        except Exception as e:
+            logging.error("Failure when saving pending items.")
+            return False
+        return True
+
+    def __invoke_callback(self):
+        try:
+            for each_callback in self.__complete_callbacks:
+                if each_callback is not None:
+                    each_callback()
+        except Exception as e:
+            logging.error("Callback is not invoked successfully.")
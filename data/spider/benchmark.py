@@ -0,0 +1,850 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Benchmarks of douban spider. All of them run offline against
+:DoubanStandin:, a local server with canned Douban pages, or
+:ReplayStandin: replaying a corpus of recorded pages.
+"""
+import io
+import os
+import re
+import sys
+import json
+import time
+import sqlite3
+import logging
+import platform
+import tempfile
+import threading
+
+from douban import Sqlite3Host, Spider, Movie, Celebrity, \
+                   MoviePageVisitor, CelebrityPageVisitor, \
+                   CelebritySearchPageVisitor, set_parse_pool, \
+                   set_page_cache
+from pipeline import ParsePool
+from frontier import CrawlFrontier
+from standin import DoubanStandin, ReplayStandin
+from corpus import PageCorpus, CorpusRecorder
+from crawllog import JsonFormatter, SamplingFilter, QueueLogHandler
+
+# Corpus shipped with spider, recorded from stand-in server.
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), \
+                        "fixtures", "douban_pages.jsonl.gz")
+# Suite results of the corpus above, written by --output. Record it again
+# with --repeat 10 when a change is meant to move the numbers.
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), \
+                        "fixtures", "benchmark_baseline.json")
+
+def run_spider(spider, timeout_secs):
+    """
+    run_spider(spider, timeout_secs) -> seconds elapsed
+
+    Start given spider and wait for completion. Spider is stopped if it
+    does not complete in timeout_secs.
+    """
+    done = threading.Event()
+    spider.set_complete_callback(done.set)
+    begin = time.time()
+    spider.start()
+    if not done.wait(timeout_secs):
+        spider.stop()
+        done.wait()
+    return time.time() - begin
+
+def bench_crawl(backend, standin, movies, workers, concurrency, \
+                timeout_secs, parse_pool = None, seed = "1"):
+    """
+    bench_crawl(backend, standin, movies, workers, concurrency,
+                timeout_secs, parse_pool = None, seed = "1")
+        -> dict of results
+
+    Crawl given number of movies from stand-in server with given
+    backend, "threaded" or "async", and report pages per second. Pages
+    are parsed by parse_pool if it's given.
+    """
+    db_path = tempfile.mktemp(prefix="bench_", suffix=".db")
+    db = Sqlite3Host(db_path)
+    if backend == "threaded":
+        spider = Spider(db, max_movies = movies, fetch_gap_in_secs = 0, \
+                        fetch_workers = workers)
+    elif backend == "async":
+        from asyncspider import AsyncSpider
+        spider = AsyncSpider(db, max_movies = movies, \
+                             concurrency = concurrency, \
+                             proxy = standin.address(), \
+                             parse_pool = parse_pool)
+    else:
+        raise Exception("Unknown backend: %s" % backend)
+    spider.set_movie_seed(seed)
+    pages_before = standin.served_pages()
+    bytes_before = standin.served_bytes()
+    elapsed = run_spider(spider, timeout_secs)
+    pages = standin.served_pages() - pages_before
+    received = standin.served_bytes() - bytes_before
+    remove_db(db_path)
+    return {'backend': backend,
+            'pages': pages,
+            'seconds': elapsed,
+            'pages_per_sec': pages / elapsed,
+            'bytes_per_sec': received / elapsed}
+
+def remove_db(db_path):
+    for suffix in ("", "-wal", "-shm", "-journal"):
+        if os.path.exists(db_path + suffix):
+            os.remove(db_path + suffix)
+
+def record_corpus(movies, seed, workers = 1, fetch_gap_in_secs = 0, \
+                  timeout_secs = 600):
+    """
+    record_corpus(movies, seed, workers = 1, fetch_gap_in_secs = 0,
+                  timeout_secs = 600) -> :PageCorpus:
+
+    Crawl given number of movies from seed movie Id, and record every
+    page fetched. Pages come from where http_proxy environment variable
+    points to, a stand-in server or Douban itself.
+    """
+    corpus = PageCorpus(seed, movies)
+    db_path = tempfile.mktemp(prefix="record_", suffix=".db")
+    set_page_cache(CorpusRecorder(corpus))
+    try:
+        spider = Spider(Sqlite3Host(db_path), max_movies = movies, \
+                        fetch_gap_in_secs = fetch_gap_in_secs, \
+                        fetch_workers = workers)
+        spider.set_movie_seed(seed)
+        run_spider(spider, timeout_secs)
+    finally:
+        set_page_cache(None)
+        remove_db(db_path)
+    return corpus
+
+def best_of(function, repeat):
+    """
+    best_of(function, repeat) -> seconds
+
+    Call function repeat times, and return the shortest time it takes.
+    Slower runs are mostly noise of other processes.
+    """
+    best = None
+    for i in range(repeat):
+        begin = time.time()
+        function()
+        elapsed = max(time.time() - begin, 1e-9)
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+# Text of calibration loop, made once.
+_CALIBRATION_TEXT = " ".join("<a href=\"/%x/\">%d</a>" % (i * 7919, i) \
+                             for i in range(2000))
+
+def calibration_loop():
+    """
+    calibration_loop()
+
+    A fixed millisecond of regex, string and dict work, like parsing a
+    page.
+    """
+    links = re.findall(r'href="([^"]*)"', _CALIBRATION_TEXT)
+    return dict((each, each.strip("/").upper()) for each in links)
+
+def calibrate(seconds):
+    """
+    calibrate(seconds) -> loops per second
+
+    Run calibration_loop() for given seconds, and return how many times
+    it runs per second.
+    """
+    loops = 0
+    begin = time.time()
+    while True:
+        calibration_loop()
+        loops += 1
+        elapsed = time.time() - begin
+        if elapsed >= seconds:
+            return loops / elapsed
+
+def calibrated_best_of(function, repeat):
+    """
+    calibrated_best_of(function, repeat) -> (seconds, loops)
+
+    Like best_of(), and calibrate() for as long as each call takes, right
+    after it. Return the shortest call in seconds, and the median call in
+    loops, times calibration_loop() runs in it. Speed of this machine
+    changes within a second, and loops hold from run to run where
+    seconds don't.
+    """
+    best = None
+    loops = []
+    for i in range(repeat):
+        begin = time.time()
+        function()
+        elapsed = max(time.time() - begin, 1e-9)
+        if best is None or elapsed < best:
+            best = elapsed
+        loops.append(elapsed * calibrate(elapsed))
+    loops.sort()
+    return best, loops[len(loops) // 2]
+
+def bench_visitors(corpus, rounds = 1, repeat = 3):
+    """
+    bench_visitors(corpus, rounds = 1, repeat = 3) -> dict of results
+
+    Parse pages of corpus with each visitor for given rounds, and report
+    pages per second, by name of visitor and mode.
+    """
+    cases = (("parse.movie.full", "movie", \
+              lambda content: MoviePageVisitor(content)),
+             ("parse.movie.selective", "movie", \
+              lambda content: MoviePageVisitor(content, selective = True)),
+             ("parse.celebrity", "celebrity", CelebrityPageVisitor),
+             ("parse.search", "search", CelebritySearchPageVisitor))
+    results = {}
+    for name, kind, visitor in cases:
+        pages = corpus.pages(kind)
+        if len(pages) == 0:
+            continue
+        def parse_all():
+            for i in range(rounds):
+                for each in pages:
+                    visitor(each)
+        elapsed, loops = calibrated_best_of(parse_all, repeat)
+        parsed = len(pages) * rounds
+        results[name] = {'value': parsed / elapsed,
+                         'normalized': parsed / loops,
+                         'unit': "pages/s",
+                         'pages': parsed,
+                         'seconds': elapsed,
+                         'chars_per_sec': \
+                                 sum(len(each) for each in pages) * \
+                                 rounds / elapsed}
+    return results
+
+def corpus_objects(corpus):
+    """
+    corpus_objects(corpus) -> list of :Celebrity: and :Movie:
+
+    Parse movies of corpus with their celebrities, in the order spiders
+    save them. Each celebrity comes once.
+    """
+    objects = []
+    seen = set()
+    for url in corpus.urls("movie"):
+        movie = Movie(Movie.parse_movie_id(url))
+        movie.parse(corpus.page(url))
+        for each in movie.celebrities():
+            search_url = each.search_url()
+            if search_url is not None:
+                content = corpus.page(search_url)
+                if content is None or not each.parse_search_page(content):
+                    continue
+            if each.douban_id() in seen:
+                continue
+            content = corpus.page(each.url())
+            if content is None:
+                continue
+            each.parse(content)
+            seen.add(each.douban_id())
+            objects.append(each)
+        objects.append(movie)
+    return objects
+
+def bench_store(corpus, repeat = 3):
+    """
+    bench_store(corpus, repeat = 3) -> dict of results
+
+    Save movies and celebrities of corpus to a new database, with a
+    transaction per save(), in batches, and with save_list(). Report
+    rows written per second.
+    """
+    objects = corpus_objects(corpus)
+    def save_each(db):
+        for each in objects:
+            db.save(each)
+    def save_batched(db):
+        for each in objects:
+            db.save(each)
+        db.commit()
+    cases = (("store.save", 0, save_each),
+             ("store.save_batched", 200, save_batched),
+             ("store.save_list", 0, lambda db: db.save_list(objects)))
+    results = {}
+    for name, batch_size, save in cases:
+        db_path = tempfile.mktemp(prefix="bench_", suffix=".db")
+        def run():
+            remove_db(db_path)
+            db = Sqlite3Host(db_path, batch_size = batch_size)
+            db.start()
+            save(db)
+            db.stop()
+        elapsed = best_of(run, repeat)
+        conn = sqlite3.connect(db_path)
+        tables = [row[0] for row in conn.execute( \
+                "select name from sqlite_master where type = 'table'")]
+        rows = sum(conn.execute("select count(*) from %s" % each) \
+                   .fetchone()[0] for each in tables)
+        conn.close()
+        remove_db(db_path)
+        results[name] = {'value': rows / elapsed,
+                         'unit': "rows/s",
+                         'rows': rows,
+                         'objects': len(objects),
+                         'seconds': elapsed}
+    return results
+
+def bench_replay(corpus, backends, movies, workers, concurrency, \
+                 latency_secs, timeout_secs, parse_pool = None, \
+                 repeat = 1):
+    """
+    bench_replay(corpus, backends, movies, workers, concurrency,
+                 latency_secs, timeout_secs, parse_pool = None,
+                 repeat = 1)
+        -> dict of results
+
+    Crawl given number of movies from seed of corpus, replayed by
+    :ReplayStandin:, with each backend repeat times. The fastest crawl
+    counts. Pages missing from corpus are reported, as they make a crawl
+    retry.
+    """
+    standin = ReplayStandin(corpus, latency_secs = latency_secs)
+    standin.start()
+    old_proxy = os.environ.get("http_proxy")
+    os.environ["http_proxy"] = standin.proxy_url()
+    results = {}
+    try:
+        for backend in backends:
+            best = None
+            for i in range(repeat):
+                missed_before = standin.missed_pages()
+                result = bench_crawl(backend, standin, movies, workers, \
+                                     concurrency, timeout_secs, \
+                                     parse_pool, seed = corpus.seed())
+                result['missed_pages'] = standin.missed_pages() - \
+                                         missed_before
+                if best is None or \
+                        result['pages_per_sec'] > best['pages_per_sec']:
+                    best = result
+            best['value'] = best['pages_per_sec']
+            best['unit'] = "pages/s"
+            results["crawl." + backend] = best
+    finally:
+        standin.stop()
+        if old_proxy is None:
+            del os.environ["http_proxy"]
+        else:
+            os.environ["http_proxy"] = old_proxy
+    return results
+
+class SyncedFileHandler(logging.FileHandler):
+    """
+    A file handler waiting for each record to reach disk, like a log on
+    slow or network storage.
+    """
+    def flush(self):
+        logging.FileHandler.flush(self)
+        if self.stream is not None:
+            os.fsync(self.stream.fileno())
+
+def bench_logging(records, max_per_sec = 100, synced = False):
+    """
+    bench_logging(records, max_per_sec = 100, synced = False)
+        -> list of results
+
+    Log given number of records like those of Sqlite3Host.save(), to a
+    file written in logging thread, or by :QueueLogHandler: in
+    background. Report records per second and worst latency of logging
+    calls, and seconds until everything is written. Sampled mode keeps
+    max_per_sec records per second. If synced, each record waits for
+    disk.
+    """
+    file_handler = SyncedFileHandler if synced else logging.FileHandler
+    def text_handler(path):
+        handler = file_handler(path)
+        handler.setFormatter(logging.Formatter( \
+                '%(asctime)s - %(name)s - %(levelname)s - %(message)s'))
+        return handler
+    def json_handler(path):
+        handler = file_handler(path)
+        handler.setFormatter(JsonFormatter("bench"))
+        return handler
+    def queued(handler, sampled = False):
+        handler = QueueLogHandler(handler, max_queued = records)
+        if sampled:
+            handler.addFilter(SamplingFilter(max_per_sec))
+        return handler
+    cases = (("sync-text", True, text_handler),
+             ("sync-json", False, json_handler),
+             ("async-text", False, lambda path: queued(text_handler(path))),
+             ("async-json", False, lambda path: queued(json_handler(path))),
+             ("async-sampled", False, \
+              lambda path: queued(json_handler(path), True)))
+    results = []
+    for name, eager, create in cases:
+        path = tempfile.mktemp(prefix="bench_", suffix=".log")
+        handler = create(path)
+        logger = logging.Logger("bench." + name)
+        logger.addHandler(handler)
+        latencies = []
+        begin = time.time()
+        for i in range(records):
+            call = time.time()
+            if eager:
+                # Message formatted before the call, as douban used to.
+                logger.info("Sqlite3Host: Save Movie: %s %s, retry  = %d" \
+                            % (u"Movie %d" % i, str(i), 0))
+            else:
+                logger.info("Sqlite3Host: Save Movie: %s %s, retry  = %d", \
+                            u"Movie %d" % i, str(i), 0)
+            latencies.append(time.time() - call)
+        logged = time.time() - begin
+        handler.close()
+        written = time.time() - begin
+        with io.open(path, encoding="utf-8") as f:
+            lines = len(f.readlines())
+        os.remove(path)
+        latencies.sort()
+        results.append({'backend': name,
+                        'records': records,
+                        'lines': lines,
+                        'records_per_sec': records / logged,
+                        'p99_latency': latencies[int(records * 0.99)],
+                        'max_latency': latencies[-1],
+                        'written_secs': written})
+    return results
+
+def print_logging_result(result):
+    print("%-14s %8d lines %10.1f records/s %8.1f us p99 %8.1f us max "
+          "%6.2fs written" % \
+            (result['backend'], result['lines'], \
+             result['records_per_sec'], result['p99_latency'] * 1e6, \
+             result['max_latency'] * 1e6, result['written_secs']))
+
+def compare_results(results, baseline, tolerance):
+    """
+    compare_results(results, baseline, tolerance)
+        -> list of (name, baseline value, value, verdict, calibrated)
+
+    Compare results to a baseline, both higher is better. Normalized
+    values are compared where both sides have them, and calibrated is
+    True for them. A value is "slower" or "faster" if it differs by more
+    than tolerance, a fraction of baseline value. Results missing from
+    either side are "new" or "missing".
+    """
+    compared = []
+    for name in sorted(set(results) | set(baseline)):
+        if name not in baseline:
+            compared.append((name, None, results[name]['value'], "new", \
+                             False))
+            continue
+        if name not in results:
+            compared.append((name, baseline[name]['value'], None, \
+                             "missing", False))
+            continue
+        calibrated = 'normalized' in baseline[name] and \
+                     'normalized' in results[name]
+        key = 'normalized' if calibrated else 'value'
+        old = baseline[name][key]
+        new = results[name][key]
+        if new < old * (1 - tolerance):
+            verdict = "slower"
+        elif new > old * (1 + tolerance):
+            verdict = "faster"
+        else:
+            verdict = "same"
+        compared.append((name, old, new, verdict, calibrated))
+    return compared
+
+def print_suite_result(results):
+    for name, result in sorted(results.items()):
+        print("%-24s %12.1f %s" % (name, result['value'], result['unit']))
+
+def print_comparison(compared):
+    for name, old, new, verdict, calibrated in compared:
+        change = ""
+        if old and new is not None:
+            change = "%+.1f%%" % ((new - old) * 100.0 / old)
+        if verdict in ("slower", "faster") and not calibrated:
+            verdict += " (absolute)"
+        print("%-24s %12s %12s %8s %s" % \
+                (name, "-" if old is None else "%.4g" % old, \
+                 "-" if new is None else "%.4g" % new, change, verdict))
+
+class NullHost(object):
+    """
+    Stands for :Sqlite3Host: when only frontier is measured.
+    """
+    def save_partial_movie_ids(self, douban_ids, commit = True):
+        pass
+
+def bench_frontier(kind, movies, related_movies = 10):
+    """
+    bench_frontier(kind, movies, related_movies = 10) -> dict of results
+
+    Simulate a crawl of given number of movies on a graph where each
+    movie links to related_movies movies, without any network or
+    database. The kind is "list" for the plain list queue spiders used
+    to have, or a strategy of :CrawlFrontier:.
+    """
+    universe = movies * related_movies
+    def related(movie_id):
+        return [(movie_id * 2654435761 + i * 40503) % universe \
+                for i in range(related_movies)]
+    max_pending = 0
+    begin = time.time()
+    if kind == "list":
+        # Pop from head of list, and append all related movies not
+        # parsed yet, even if they are pending already.
+        pending = [0]
+        parsed = set()
+        while len(parsed) < movies and len(pending) != 0:
+            movie_id = pending[0]
+            del pending[0]
+            if movie_id in parsed:
+                continue
+            parsed.add(movie_id)
+            for each in related(movie_id):
+                if each not in parsed:
+                    pending.append(each)
+            max_pending = max(max_pending, len(pending))
+    else:
+        frontier = CrawlFrontier(NullHost(), kind)
+        frontier.push(0)
+        parsed = 0
+        while parsed < movies:
+            movie_id = frontier.pop()
+            if movie_id is None:
+                break
+            parsed += 1
+            frontier.extend(related(movie_id), referrer = movie_id, \
+                            unseen_celebrities = movie_id % 8)
+            frontier.movie_done(movie_id)
+            max_pending = max(max_pending, frontier.pending_count())
+    elapsed = time.time() - begin
+    return {'backend': kind,
+            'movies': movies,
+            'seconds': elapsed,
+            'max_pending': max_pending,
+            'movies_per_sec': movies / elapsed}
+
+def print_frontier_result(result):
+    print("%-12s %8d movies %8.2fs %10.1f movies/s %9d max pending" % \
+            (result['backend'], result['movies'], result['seconds'], \
+             result['movies_per_sec'], result['max_pending']))
+
+def load_corpus(corpus_dir):
+    """
+    load_corpus(corpus_dir) -> list of HTML content
+
+    Load saved movie pages, all .html files under corpus_dir, encoded
+    in UTF-8.
+    """
+    pages = []
+    for root, dirs, files in os.walk(corpus_dir):
+        for name in sorted(files):
+            if name.endswith(".html") or name.endswith(".htm"):
+                with io.open(os.path.join(root, name), \
+                             encoding="utf-8") as f:
+                    pages.append(f.read())
+    return pages
+
+def visitor_result(visitor):
+    return (visitor.title(), visitor.year(), visitor.region(), \
+            visitor.directors(), visitor.scriptwriters(), \
+            visitor.actors(), visitor.related_movie_urls())
+
+def bench_parse(pages, selective, rounds = 1):
+    """
+    bench_parse(pages, selective, rounds = 1) -> dict of results
+
+    Parse all pages with :MoviePageVisitor: for given rounds, in whole
+    page or selective mode.
+    """
+    begin = time.time()
+    for i in range(rounds):
+        for each in pages:
+            MoviePageVisitor(each, selective = selective)
+    elapsed = time.time() - begin
+    parsed_bytes = sum(len(each) for each in pages) * rounds
+    return {'backend': "selective" if selective else "full",
+            'pages': len(pages) * rounds,
+            'seconds': elapsed,
+            'pages_per_sec': len(pages) * rounds / elapsed,
+            'chars_per_sec': parsed_bytes / elapsed}
+
+def check_parse(pages):
+    """
+    check_parse(pages) -> number of pages parsed differently
+
+    Compare results of whole page and selective mode.
+    """
+    return len([each for each in pages \
+                if visitor_result(MoviePageVisitor(each)) != \
+                   visitor_result(MoviePageVisitor(each, selective = True))])
+
+def print_parse_result(result):
+    print("%-10s %6d pages %8.2fs %9.1f pages/s %10.1f Kchars/s" % \
+            (result['backend'], result['pages'], result['seconds'], \
+             result['pages_per_sec'], result['chars_per_sec'] / 1024.0))
+
+def bench_memory(movies):
+    """
+    bench_memory(movies) -> dict of bytes per item
+
+    Measure memory held by movies queued in :CrawlFrontier:, stub movies
+    and celebrities, and parsed movies with their celebrities. It
+    requires tracemalloc of Python 3.4 or later.
+    """
+    import tracemalloc
+    standin = DoubanStandin(movies = movies)
+    pages = [standin.movie_page(i + 1) for i in range(movies)]
+    def measure(build):
+        tracemalloc.start()
+        before = tracemalloc.get_traced_memory()[0]
+        kept = build()
+        after = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        return (after - before) / float(movies)
+    def queue():
+        frontier = CrawlFrontier(NullHost())
+        frontier.extend(["%d" % (10000000 + i) for i in range(movies)])
+        return frontier
+    def parse():
+        parsed = []
+        for i in range(movies):
+            movie = Movie("%d" % (i + 1))
+            movie.parse(pages[i])
+            parsed.append(movie)
+        return parsed
+    return {'queued movie': measure(queue),
+            'stub movie': measure(lambda: [Movie("%d" % (10000000 + i)) \
+                                           for i in range(movies)]),
+            'stub celebrity': measure(lambda: \
+                    [Celebrity("%d" % (1000000 + i)) for i in range(movies)]),
+            'parsed movie': measure(parse)}
+
+def print_result(result):
+    print("%-10s %6d pages %8.2fs %9.1f pages/s %10.1f KB/s" % \
+            (result['backend'], result['pages'], result['seconds'], \
+             result['pages_per_sec'], result['bytes_per_sec'] / 1024.0))
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description="""
+    Benchmark douban spider against local stand-in server.
+    """)
+    parser.add_argument('-b',\
+                        '--backend', \
+                        default="threaded,async", \
+                        help="Comma separated backends: threaded, async.")
+    parser.add_argument('-m',\
+                        '--movies', \
+                        default="100", \
+                        help="Number of movies to crawl.")
+    parser.add_argument('-l',\
+                        '--latency', \
+                        default="0.05", \
+                        help="Latency of each response in seconds.")
+    parser.add_argument('-w',\
+                        '--workers', \
+                        default="8", \
+                        help="Fetch workers of threaded backend.")
+    parser.add_argument('-c',\
+                        '--concurrency', \
+                        default="100", \
+                        help="Requests in flight of async backend.")
+    parser.add_argument('-t',\
+                        '--timeout', \
+                        default="600", \
+                        help="Give up a crawl after given seconds.")
+    parser.add_argument('-P',\
+                        '--parsers', \
+                        default="0", \
+                        help="Number of parse processes in crawls. 0 means "
+                             "pages are parsed by fetchers.")
+    parser.add_argument('-f',\
+                        '--frontier', \
+                        default="", \
+                        help="Comma separated crawl sizes. If given, "
+                             "benchmark frontier without crawling.")
+    parser.add_argument('--memory', \
+                        action="store_true", \
+                        help="Benchmark memory of movies without crawling.")
+    parser.add_argument('-p',\
+                        '--parse', \
+                        action="store_true", \
+                        help="Benchmark parsing of movie pages without "
+                             "crawling.")
+    parser.add_argument('--corpus', \
+                        default="", \
+                        help="Directory of saved movie pages to parse. "
+                             "Empty means pages of stand-in server.")
+    parser.add_argument('--rounds', \
+                        default="5", \
+                        help="Times to parse each page.")
+    parser.add_argument('--logging', \
+                        default="0", \
+                        help="Number of records to benchmark logging "
+                             "modes with, without crawling.")
+    parser.add_argument('--fsync', \
+                        action="store_true", \
+                        help="Wait for disk on each record in logging "
+                             "benchmark.")
+    parser.add_argument('--suite', \
+                        action="store_true", \
+                        help="Benchmark visitors, database and crawls "
+                             "with a corpus of recorded pages.")
+    parser.add_argument('--fixtures', \
+                        default=FIXTURES, \
+                        help="Corpus of recorded pages used by suite.")
+    parser.add_argument('--repeat', \
+                        default="5", \
+                        help="Runs of each suite benchmark. The fastest "
+                             "one counts.")
+    parser.add_argument('--output', \
+                        default="", \
+                        help="File to write suite results to as JSON.")
+    parser.add_argument('--compare', \
+                        action="store_true", \
+                        help="Run suite and compare with baseline. Exit "
+                             "with 1 if parsing gets slower relative to a "
+                             "calibration loop.")
+    parser.add_argument('--baseline', \
+                        default=BASELINE, \
+                        help="Suite results of JSON to compare with.")
+    parser.add_argument('--tolerance', \
+                        default="0.2", \
+                        help="Change to baseline ignored, as a fraction.")
+    parser.add_argument('--record', \
+                        default="", \
+                        help="Record a corpus of pages to given file, by "
+                             "crawling stand-in server.")
+    parser.add_argument('--live', \
+                        action="store_true", \
+                        help="Record from Douban instead of stand-in "
+                             "server, two seconds between movies.")
+    parser.add_argument('--seed', \
+                        default="1", \
+                        help="Movie Id to start recording from.")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.CRITICAL)
+    if args.record:
+        standin = None
+        if not args.live:
+            standin = DoubanStandin()
+            standin.start()
+            os.environ["http_proxy"] = standin.proxy_url()
+        try:
+            corpus = record_corpus(int(args.movies), args.seed, \
+                                   workers = int(args.workers), \
+                                   fetch_gap_in_secs = 2 if args.live \
+                                                       else 0, \
+                                   timeout_secs = float(args.timeout))
+        finally:
+            if standin is not None:
+                standin.stop()
+        corpus.save(args.record)
+        print("Recorded %s to %s." % (corpus.stats(), args.record))
+        sys.exit(0)
+    if int(args.logging) > 0:
+        for result in bench_logging(int(args.logging), \
+                                    synced = args.fsync):
+            print_logging_result(result)
+        sys.exit(0)
+    if args.memory:
+        for name, size in sorted(bench_memory(int(args.movies)).items()):
+            print("%-15s %8.1f bytes" % (name, size))
+        sys.exit(0)
+    if args.parse:
+        if args.corpus:
+            pages = load_corpus(args.corpus)
+        else:
+            standin = DoubanStandin()
+            pages = [standin.movie_page(i + 1) \
+                     for i in range(int(args.movies))]
+        print("%d pages, %d differences between modes." % \
+                (len(pages), check_parse(pages)))
+        for selective in (False, True):
+            print_parse_result(bench_parse(pages, selective, \
+                                           int(args.rounds)))
+        sys.exit(0)
+    if args.frontier:
+        for movies in args.frontier.split(","):
+            for kind in ("list", ) + CrawlFrontier.STRATEGIES:
+                print_frontier_result(bench_frontier(kind, int(movies)))
+        sys.exit(0)
+    parse_pool = None
+    if int(args.parsers) > 0:
+        # Start processes before any thread.
+        parse_pool = ParsePool(processes = int(args.parsers))
+        parse_pool.start()
+        set_parse_pool(parse_pool)
+    if args.suite or args.compare:
+        corpus = PageCorpus.load(args.fixtures)
+        # Leave recorded movies a crawl doesn't reach, as concurrent
+        # crawls don't take movies in the order of recording.
+        movies = min(int(args.movies), max(1, corpus.movies() // 2))
+        results = {}
+        try:
+            results.update(bench_visitors(corpus, int(args.rounds), \
+                                          int(args.repeat)))
+            results.update(bench_store(corpus, int(args.repeat)))
+            results.update(bench_replay(corpus, args.backend.split(","), \
+                                        movies, int(args.workers), \
+                                        int(args.concurrency), \
+                                        float(args.latency), \
+                                        float(args.timeout), parse_pool, \
+                                        int(args.repeat)))
+        finally:
+            if parse_pool is not None:
+                parse_pool.stop()
+        print_suite_result(results)
+        report = {'python': platform.python_version(),
+                  'platform': platform.platform(),
+                  'corpus': corpus.stats(),
+                  'results': results}
+        if args.output:
+            with open(args.output, 'w') as f:
+                json.dump(report, f, sort_keys = True, indent = 2)
+        if args.compare:
+            with open(args.baseline) as f:
+                baseline = json.load(f)
+            compared = compare_results(results, baseline['results'], \
+                                       float(args.tolerance))
+            print("")
+            if baseline['python'] != report['python'] or \
+                    baseline['platform'] != report['platform']:
+                # Numbers of another machine tell little.
+                print("Baseline is recorded with Python %s on %s." % \
+                        (baseline['python'], baseline['platform']))
+            print("%-24s %12s %12s %8s %s" % \
+                    ("benchmark", "baseline", "now", "change", "verdict"))
+            print_comparison(compared)
+            # Absolute numbers drift with load of the machine, by half
+            # from run to run. Only parsing is normalized by calibration
+            # loop. Crawls wait on stand-in, and database on disk.
+            if [each for each in compared if each[3] == "slower" and \
+                                             not each[4]]:
+                print("")
+                print("Warning: Absolute numbers are slower. They are "
+                      "noisy, and don't fail comparison.")
+            if [each for each in compared if each[3] == "slower" and \
+                                             each[4]]:
+                sys.exit(1)
+        sys.exit(0)
+    standin = DoubanStandin(latency_secs = float(args.latency))
+    standin.start()
+    # Threaded backend goes through urlopen(), which takes proxy from
+    # environment variable.
+    os.environ["http_proxy"] = standin.proxy_url()
+    try:
+        for backend in args.backend.split(","):
+            print_result(bench_crawl(backend, standin, \
+                                     int(args.movies), \
+                                     int(args.workers), \
+                                     int(args.concurrency), \
+                                     float(args.timeout), \
+                                     parse_pool))
+    finally:
+        standin.stop()
+        if parse_pool is not None:
+            parse_pool.stop()
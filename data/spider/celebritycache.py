@@ -0,0 +1,179 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import logging
+import threading
+
+class CelebrityCache(object):
+    """
+    Celebrities known to a crawl. It's consulted before a celebrity is
+    fetched, so every celebrity is fetched and saved only once, however
+    many movies it appears in.
+
+    It keeps Ids of saved celebrities, and results of search pages: an
+    Id like /search/name either redirects to a real Id, or is a dead
+    link. Saved Ids are loaded from database of :Sqlite3Host:, and
+    redirects are saved to it as well. Dead links are saved as
+    celebrities, so they are known on resume too.
+
+    A celebrity is fetched and saved through the first :Celebrity:
+    object claiming it. Other threads asking for a celebrity being
+    fetched wait for the result.
+    """
+    def __init__(self, db_host):
+        """
+        CelebrityCache.__init__(self, db_host)
+
+        Create an empty cache persisted to db_host. Call load() to
+        resume from database.
+        """
+        self.__db_host = db_host
+        self.__condition = threading.Condition()
+        self.__saved = set()
+        # Search Id to real Id, or None for a dead link.
+        self.__aliases = {}
+        self.__new_aliases = []
+        # Celebrity Id to the object claiming it, until it's saved.
+        self.__claims = {}
+        self.__fetching = set()
+        self.__stats = {'fetches': 0,
+                        'skips': 0,
+                        'redirects': 0}
+
+    def load(self):
+        """
+        CelebrityCache.load(self)
+
+        Load saved celebrities and redirects from database. It must be
+        called after db_host.start(), from the same thread.
+        """
+        saved = self.__db_host.load_celebrity_ids()
+        aliases = self.__db_host.load_celebrity_aliases()
+        with self.__condition:
+            self.__saved.update(saved)
+            self.__aliases.update(aliases)
+        logging.info("CelebrityCache: %d celebrities and %d redirects "
+                     "loaded." % (len(saved), len(aliases)))
+
+    def resolve(self, celebrity, wait = True):
+        """
+        CelebrityCache.resolve(self, celebrity, wait = True)
+            -> True if caller should fetch it
+
+        Apply known redirect to given :Celebrity:, and claim it if it's
+        neither saved nor claimed. Caller must call fetched() after
+        fetching a claimed celebrity, whether fetching succeeds or not.
+
+        If the celebrity is being fetched by another thread, wait for it
+        unless wait is False. Callers sharing a thread with the fetching
+        one, e.g. an event loop, must not wait.
+        """
+        with self.__condition:
+            while True:
+                celebrity_id = celebrity.douban_id()
+                if celebrity_id in self.__aliases:
+                    real_id = self.__aliases[celebrity_id]
+                    if real_id is None:
+                        self.__stats['skips'] += 1
+                        return False
+                    celebrity.redirect(real_id)
+                    celebrity_id = real_id
+                    self.__stats['redirects'] += 1
+                if wait and celebrity_id in self.__fetching:
+                    self.__condition.wait()
+                    continue
+                break
+            if celebrity_id in self.__saved or \
+                    celebrity_id in self.__claims:
+                self.__stats['skips'] += 1
+                return False
+            self.__claims[celebrity_id] = celebrity
+            self.__fetching.add(celebrity_id)
+            self.__stats['fetches'] += 1
+            return True
+
+    def fetched(self, celebrity, celebrity_id, failed = False):
+        """
+        CelebrityCache.fetched(self, celebrity, celebrity_id,
+                               failed = False)
+
+        Record result of fetching a claimed celebrity, whose Id was
+        celebrity_id before fetching. Redirect of a search page is kept,
+        and so is a dead link unless fetching failed.
+
+        A failed celebrity is released, so it's not saved, and it's
+        fetched again by the next movie it appears in, or the next run.
+        """
+        with self.__condition:
+            self.__fetching.discard(celebrity_id)
+            new_id = celebrity.douban_id()
+            if self.__claims.get(celebrity_id) is celebrity and \
+                    (failed or new_id != celebrity_id):
+                del self.__claims[celebrity_id]
+            if new_id != celebrity_id:
+                self.__aliases[celebrity_id] = new_id
+                self.__new_aliases.append((celebrity_id, new_id))
+                if not failed and new_id not in self.__saved and \
+                        new_id not in self.__claims:
+                    self.__claims[new_id] = celebrity
+            elif not failed and celebrity.search_url() is not None and \
+                    celebrity.is_dead_link():
+                self.__aliases[celebrity_id] = None
+            self.__condition.notify_all()
+
+    def owns(self, celebrity):
+        """
+        CelebrityCache.owns(self, celebrity) -> True if caller should
+                                                save it
+        """
+        with self.__condition:
+            celebrity_id = celebrity.douban_id()
+            return self.__claims.get(celebrity_id) is celebrity and \
+                   celebrity_id not in self.__saved
+
+    def saved(self, celebrity):
+        with self.__condition:
+            celebrity_id = celebrity.douban_id()
+            self.__saved.add(celebrity_id)
+            self.__claims.pop(celebrity_id, None)
+
+    def save_aliases(self):
+        """
+        CelebrityCache.save_aliases(self)
+
+        Save redirects found since last call. They are committed with
+        next write of database. It must be called from the thread
+        calling db_host.start().
+        """
+        with self.__condition:
+            aliases = self.__new_aliases
+            self.__new_aliases = []
+        if len(aliases) > 0:
+            self.__db_host.save_celebrity_aliases(aliases, commit = False)
+
+    def revisit(self, celebrity_ids):
+        """
+        CelebrityCache.revisit(self, celebrity_ids)
+
+        Forget that given celebrities are saved, so they are fetched
+        again by the next movie they appear in.
+        """
+        with self.__condition:
+            self.__saved.difference_update(celebrity_ids)
+
+    def mark_saved(self, celebrity_ids):
+        """
+        CelebrityCache.mark_saved(self, celebrity_ids)
+
+        Take given celebrities as saved, e.g. by another shard of a
+        crawl, so they are not fetched here.
+        """
+        with self.__condition:
+            self.__saved.update(celebrity_ids)
+
+    def saved_count(self):
+        with self.__condition:
+            return len(self.__saved)
+
+    def stats(self):
+        with self.__condition:
+            return dict(self.__stats)
@@ -0,0 +1,144 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import re
+import gzip
+import json
+import logging
+import threading
+
+class PageCorpus(object):
+    """
+    Recorded Douban pages, replayed by benchmarks. A corpus is a gzip
+    compressed file of JSON lines. The first line describes the crawl
+    recording it: its seed movie and number of movies. Each other line
+    is a page with its URL, kind ("movie", "celebrity" or "search") and
+    decoded content.
+
+    A recorded crawl is closed: a crawl from the same seed finds every
+    page it needs in corpus, as long as it stops well before number of
+    recorded movies.
+    """
+    __kinds = (("movie", re.compile(r'^https?:\/\/[^\/]+\/subject\/')),
+               ("celebrity", re.compile(r'^https?:\/\/[^\/]+\/celebrity\/')),
+               ("search", re.compile(r'^https?:\/\/[^\/]+\/search\/')))
+
+    def __init__(self, seed = None, movies = 0):
+        self.__seed = seed
+        self.__movies = movies
+        self.__pages = {}
+
+    @staticmethod
+    def kind_of(url):
+        """
+        PageCorpus.kind_of(url) -> "movie", "celebrity", "search" or None
+
+        Static method. Tell kind of page from its URL.
+        """
+        for kind, pattern in PageCorpus.__kinds:
+            if pattern.match(url) is not None:
+                return kind
+        return None
+
+    @staticmethod
+    def load(path):
+        """
+        PageCorpus.load(path) -> :PageCorpus:
+
+        Static method. Load a corpus saved by save().
+        """
+        with gzip.open(path, 'rb') as f:
+            lines = f.read().decode('utf-8').splitlines()
+        header = json.loads(lines[0])
+        corpus = PageCorpus(header['seed'], header['movies'])
+        for line in lines[1:]:
+            page = json.loads(line)
+            corpus.add(page['url'], page['content'])
+        return corpus
+
+    def save(self, path):
+        """
+        PageCorpus.save(self, path)
+
+        Save pages sorted by URL, so a corpus recorded twice gives the
+        same file.
+        """
+        lines = [json.dumps({'seed': self.__seed, 'movies': self.__movies}, \
+                            sort_keys = True)]
+        for url in sorted(self.__pages):
+            kind, content = self.__pages[url]
+            lines.append(json.dumps({'url': url,
+                                     'kind': kind,
+                                     'content': content}, sort_keys = True))
+        data = (u'\n'.join(lines) + u'\n').encode('utf-8')
+        # No file name or time in header, for the same reason.
+        with open(path, 'wb') as raw:
+            with gzip.GzipFile(filename = '', fileobj = raw, mode = 'wb', \
+                               mtime = 0) as f:
+                f.write(data)
+
+    def seed(self):
+        return self.__seed
+
+    def movies(self):
+        return self.__movies
+
+    def add(self, url, content):
+        self.__pages[url] = (PageCorpus.kind_of(url), content)
+
+    def page(self, url):
+        """
+        PageCorpus.page(self, url) -> HTML content or None
+        """
+        page = self.__pages.get(url)
+        if page is None:
+            return None
+        return page[1]
+
+    def pages(self, kind):
+        """
+        PageCorpus.pages(self, kind) -> list of HTML content
+
+        Return content of all pages of given kind, sorted by URL.
+        """
+        return [self.__pages[url][1] for url in sorted(self.__pages) \
+                if self.__pages[url][0] == kind]
+
+    def urls(self, kind = None):
+        return [url for url in sorted(self.__pages) \
+                if kind is None or self.__pages[url][0] == kind]
+
+    def stats(self):
+        result = {}
+        for kind, content in self.__pages.values():
+            result[kind] = result.get(kind, 0) + 1
+        return result
+
+class CorpusRecorder(object):
+    """
+    Records every page fetched by douban module into a :PageCorpus:. It
+    works as a :PageCache: always missing, installed by
+    douban.set_page_cache() during a crawl.
+    """
+    def __init__(self, corpus):
+        self.__corpus = corpus
+        self.__lock = threading.Lock()
+
+    def offline(self):
+        return False
+
+    def is_fresh(self, page):
+        return False
+
+    def lookup(self, url):
+        return None
+
+    def store(self, url, body, charset, etag = None, last_modified = None):
+        if PageCorpus.kind_of(url) is None:
+            logging.warn("CorpusRecorder: Unknown page: %s" % url)
+            return
+        content = body.decode(charset)
+        with self.__lock:
+            self.__corpus.add(url, content)
+
+    def revalidated(self, page):
+        pass
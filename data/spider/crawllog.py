@@ -0,0 +1,191 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import sys
+import json
+import uuid
+import logging
+import threading
+
+# Python 2/3 compatibility hack: Import correct libraries
+ver = sys.version[0]
+if ver == '2':
+    import Queue as Q
+    string_types = basestring
+elif ver == '3':
+    import queue as Q
+    string_types = str
+else:
+    raise Exception("Support Python runtime version")
+
+def new_crawl_id():
+    return uuid.uuid4().hex[:12]
+
+class JsonFormatter(logging.Formatter):
+    """
+    Format a record as a line of JSON, with keys time, level, logger,
+    thread, crawl_id, type and message. The type is message before
+    arguments are applied, e.g. "Movie %s fetched.", so all lines of a
+    kind can be found without parsing messages. Key dropped tells
+    records of the same type dropped by :SamplingFilter: before it, and
+    key exception holds a traceback if there's one.
+    """
+    def __init__(self, crawl_id = None):
+        logging.Formatter.__init__(self)
+        self.__crawl_id = crawl_id
+
+    def format(self, record):
+        entry = {'time': record.created,
+                 'level': record.levelname,
+                 'logger': record.name,
+                 'thread': record.threadName,
+                 'crawl_id': self.__crawl_id,
+                 'type': record.msg if isinstance(record.msg, string_types) \
+                         else type(record.msg).__name__,
+                 'message': record.getMessage()}
+        dropped = getattr(record, 'dropped', 0)
+        if dropped:
+            entry['dropped'] = dropped
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, sort_keys = True)
+
+class SamplingFilter(logging.Filter):
+    """
+    Keep at most max_per_sec records of each message type per second,
+    and drop the rest. Type of a record is its message before arguments
+    are applied, so messages must pass arguments to logging calls
+    rather than format them first. Limits of some types can be given
+    in rates, a dict from message to records per second. A limit of 0
+    means no limit.
+
+    Warnings and errors are never dropped. The first record kept after
+    some are dropped tells how many in its attribute dropped.
+    """
+    def __init__(self, max_per_sec = 0, rates = None):
+        logging.Filter.__init__(self)
+        self.__max_per_sec = max_per_sec
+        self.__rates = dict(rates or {})
+        self.__lock = threading.Lock()
+        # Message type to [second, records in that second, dropped].
+        self.__types = {}
+        self.__dropped = 0
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING:
+            return True
+        limit = self.__rates.get(record.msg, self.__max_per_sec)
+        if limit <= 0:
+            return True
+        second = int(record.created)
+        with self.__lock:
+            state = self.__types.get(record.msg)
+            if state is None:
+                state = [second, 0, 0]
+                self.__types[record.msg] = state
+            elif state[0] != second:
+                state[0] = second
+                state[1] = 0
+            state[1] += 1
+            if state[1] > limit:
+                state[2] += 1
+                self.__dropped += 1
+                return False
+            record.dropped = state[2]
+            state[2] = 0
+        return True
+
+    def dropped(self):
+        return self.__dropped
+
+class QueueLogHandler(logging.Handler):
+    """
+    A handler passing records to a background thread, which hands them
+    to target handler. Logging threads never wait for formatting or
+    file I/O. Arguments of records are applied by the background thread,
+    so objects passed to logging calls must not change afterwards.
+
+    When max_queued records are waiting, debug and info records are
+    dropped and counted. Warnings and errors wait for room.
+    """
+    def __init__(self, target, max_queued = 10000):
+        logging.Handler.__init__(self)
+        self.__target = target
+        self.__queue = Q.Queue(max_queued)
+        self.__lock = threading.Lock()
+        self.__dropped = 0
+        self.__thread = threading.Thread(target=self.__write_loop)
+        self.__thread.daemon = True
+        self.__thread.start()
+
+    def handle(self, record):
+        # Queue is locked by itself. Handler lock would serialize
+        # logging threads for nothing.
+        kept = self.filter(record)
+        if kept:
+            self.emit(record)
+        return kept
+
+    def emit(self, record):
+        if record.levelno >= logging.WARNING:
+            self.__queue.put(record)
+            return
+        try:
+            self.__queue.put_nowait(record)
+        except Q.Full:
+            with self.__lock:
+                self.__dropped += 1
+
+    def dropped(self):
+        return self.__dropped
+
+    def close(self):
+        """
+        QueueLogHandler.close(self)
+
+        Write all queued records, stop background thread and close
+        target handler.
+        """
+        if self.__thread is not None:
+            self.__queue.put(None)
+            self.__thread.join()
+            self.__thread = None
+            self.__target.close()
+        logging.Handler.close(self)
+
+    def __write_loop(self):
+        while True:
+            record = self.__queue.get()
+            if record is None:
+                break
+            self.__target.handle(record)
+
+def start_logging(path, crawl_id = None, json_lines = True, \
+                  max_per_sec = 0, rates = None, max_queued = 10000, \
+                  level = logging.INFO):
+    """
+    start_logging(path, crawl_id = None, json_lines = True,
+                  max_per_sec = 0, rates = None, max_queued = 10000,
+                  level = logging.INFO) -> :QueueLogHandler:
+
+    Send records of root logger to file of given path through a
+    :QueueLogHandler:. Lines are JSON of :JsonFormatter: with crawl_id,
+    a new one if it's None, or plain text if json_lines is False.
+    Records are sampled by a :SamplingFilter: if max_per_sec or rates
+    is given. Queued records are written when returned handler is
+    closed, by caller or by logging.shutdown() on exit.
+    """
+    target = logging.FileHandler(path)
+    if json_lines:
+        if crawl_id is None:
+            crawl_id = new_crawl_id()
+        target.setFormatter(JsonFormatter(crawl_id))
+    else:
+        target.setFormatter(logging.Formatter( \
+                '%(asctime)s - %(name)s - %(levelname)s - %(message)s'))
+    handler = QueueLogHandler(target, max_queued)
+    if max_per_sec > 0 or rates:
+        handler.addFilter(SamplingFilter(max_per_sec, rates))
+    root = logging.getLogger()
+    root.addHandler(handler)
+    root.setLevel(level)
+    return handler
@@ -1,23 +1,34 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
+import os
 import sys
 import re
-import urllib2
+import json
+import codecs
+import hashlib
 import logging
+import time
 import sqlite3
 import threading
+import collections
+
+from ratelimit import HostRateLimiter
+from httpclient import HttpConnectionPool, HttpStatusException
+from pagecache import PageCache, CacheMissException
+from frontier import CrawlFrontier
+from celebritycache import CelebrityCache
+from metrics import NullRegistry
 
 # Python 2/3 compatibility hack: Import correct libraries
 ver = sys.version[0]
 if ver == '2':
-    # We must keep a timout for urllib.urlopen(), for a known
-    # hanging issue from link below (yes, still bugs me at 2015)
-    # https://mail.python.org/pipermail/python-bugs-list/2006-February/031871.html
-    import urllib2 as UL
     import HTMLParser as HP
+    import Queue as Q
+    import urlparse as UP
 elif ver == '3':
-    import urllib as UL
     import html.parser as HP
+    import queue as Q
+    import urllib.parse as UP
 else:
     raise Exception("Support Python runtime version")
 
@@ -28,6 +39,9 @@ class UnsupportedDataException(Exception):
     def type_name(self):
         return self.__type_name
 
+class DatabaseNotStartedException(Exception):
+    pass
+
 class UrlParseException(Exception):
     def __init__(self, url):
         Exception.__init__(self)
@@ -35,18 +49,307 @@ class UrlParseException(Exception):
     def url(self):
         return self.__url
 
-def parsehtml(url, timeout_secs = 5):
+# Rate limiter shared by all parsehtml() calls. None means unlimited.
+_rate_limiter = None
+# HTTP client shared by all parsehtml() calls. It keeps connections
+# alive between pages.
+_http_client = HttpConnectionPool()
+
+def set_http_client(http_client):
+    """
+    set_http_client(http_client)
+
+    Replace the :HttpConnectionPool: used by all parsehtml() calls.
+    """
+    global _http_client
+    _http_client = http_client
+
+def set_rate_limiter(rate_limiter):
+    """
+    set_rate_limiter(rate_limiter)
+
+    Install a :HostRateLimiter: used by all parsehtml() calls. Set it to
+    None to disable rate limiting.
+    """
+    global _rate_limiter
+    _rate_limiter = rate_limiter
+
+# Page cache shared by all parsehtml() calls. None means no cache.
+_page_cache = None
+
+def set_page_cache(page_cache):
+    """
+    set_page_cache(page_cache)
+
+    Install a :PageCache: used by all parsehtml() calls. Set it to None
+    to disable cache.
+    """
+    global _page_cache
+    _page_cache = page_cache
+
+# Movie pages are parsed in selective mode of :MoviePageVisitor: unless
+# it's disabled.
+_selective_parsing = True
+
+def set_selective_parsing(selective):
     """
-    parsehtml(url, timeout_secs = 5)
+    set_selective_parsing(selective)
+
+    Choose whether Movie.parse() parses only regions it needs, or whole
+    page.
+    """
+    global _selective_parsing
+    _selective_parsing = selective
+
+# Parse pool used by fetch() of movies and celebrities. None means
+# pages are parsed in fetching thread.
+_parse_pool = None
 
-    A helper function to receive content from given URL.
+def set_parse_pool(parse_pool):
     """
+    set_parse_pool(parse_pool)
+
+    Install a :ParsePool: parsing pages fetched by Movie.fetch() and
+    Celebrity.fetch(). Set it to None to parse in fetching thread.
+    """
+    global _parse_pool
+    _parse_pool = parse_pool
+
+# Movie pages are parsed while they download if it's enabled, and no
+# parse pool is installed.
+_streaming_parsing = False
+
+def set_streaming_parsing(streaming):
+    """
+    set_streaming_parsing(streaming)
+
+    Choose whether Movie.fetch() feeds a page to parser as it arrives,
+    and stops reading after recommendations. Selective mode doesn't
+    apply to a streamed page, as regions are found in whole page.
+    """
+    global _streaming_parsing
+    _streaming_parsing = streaming
+
+# Metrics of fetching, parsing and saving. The null registry drops
+# everything, so instrumented code costs a method call when disabled.
+_metrics = NullRegistry()
+
+def set_metrics(registry):
+    """
+    set_metrics(registry)
+
+    Install a :MetricsRegistry: recording every stage of crawling from
+    now on. Set it to None to disable metrics. Spiders register their
+    gauges when created, so it should be installed before that, and
+    after a parse pool is started, as parse processes don't report.
+    """
+    global _metrics
+    if registry is None:
+        registry = NullRegistry()
+    _metrics = registry
+
+def _openpage(url, timeout_secs, max_bytes):
+    """
+    Return (cached page, None) if page is taken from page cache, or
+    (None, response) with body not read yet.
+    """
+    page_cache = _page_cache
+    metrics = _metrics
+    cached = None
+    headers = None
+    if page_cache is not None:
+        cached = page_cache.lookup(url)
+        if cached is not None:
+            if page_cache.offline() or page_cache.is_fresh(cached):
+                metrics.count("fetch.cache_hits")
+                return cached, None
+            headers = cached.validators()
+        elif page_cache.offline():
+            metrics.count("fetch.cache_misses")
+            raise CacheMissException(url)
+    rate_limiter = _rate_limiter
+    host = UP.urlparse(url).netloc
+    if rate_limiter is not None:
+        begin = metrics.clock()
+        rate_limiter.acquire(host)
+        metrics.observe("fetch.rate_wait", begin)
     # Note: it may cause exception.
-    response = UL.urlopen(url, timeout=timeout_secs)
-    encoding = response.headers.getparam('charset')
-    content = response.read().decode(encoding)
-    response.close()
-    return content
+    begin = metrics.clock()
+    try:
+        response = _http_client.get(url, timeout_secs = timeout_secs, \
+                                    max_bytes = max_bytes, \
+                                    headers = headers)
+    except HttpStatusException as e:
+        metrics.count("fetch.errors")
+        if rate_limiter is not None:
+            rate_limiter.report(host, e.status())
+        raise
+    except Exception as e:
+        metrics.count("fetch.errors")
+        raise
+    # Time to first byte. Reading body is timed by callers.
+    metrics.observe("fetch.response", begin)
+    if rate_limiter is not None:
+        rate_limiter.report(host, response.status())
+    if response.status() == 304 and cached is not None:
+        # Read the empty body, so connection goes back to pool.
+        response.body()
+        page_cache.revalidated(cached)
+        metrics.count("fetch.revalidated")
+        return cached, None
+    return None, response
+
+def _storepage(url, body, charset, response):
+    page_cache = _page_cache
+    if page_cache is not None:
+        page_cache.store(url, body, charset, \
+                         response.headers().get('etag'), \
+                         response.headers().get('last-modified'))
+
+def fetchpage(url, timeout_secs = 5, max_bytes = None):
+    """
+    fetchpage(url, timeout_secs = 5, max_bytes = None)
+        -> (body bytes, charset)
+
+    Receive raw content from given URL. Fresh pages are taken from page
+    cache. Stale pages are revalidated with a conditional GET. In
+    offline mode, :CacheMissException: is raised for pages not in cache.
+    """
+    metrics = _metrics
+    begin = metrics.clock()
+    cached, response = _openpage(url, timeout_secs, max_bytes)
+    if cached is not None:
+        return cached.body(), cached.charset()
+    body = response.body()
+    metrics.observe("fetch", begin)
+    metrics.count("fetch.pages")
+    metrics.count("fetch.bytes", len(body))
+    charset = response.charset() or 'utf-8'
+    _storepage(url, body, charset, response)
+    return body, charset
+
+def streampage(url, visitor, timeout_secs = 5, max_bytes = None):
+    """
+    streampage(url, visitor, timeout_secs = 5, max_bytes = None)
+        -> True if whole page is read
+
+    Receive a page like fetchpage(), and feed it to visitor while it
+    downloads, so the page is never held as a whole. Chunks are decoded
+    by an incremental decoder of page charset, which keeps a character
+    split between chunks until its rest arrives.
+
+    The visitor is an HTMLParser with is_complete(), like
+    :MoviePageVisitor: created without content. Reading stops when it
+    returns True, and the connection is closed rather than drained. A
+    page to be stored in page cache is always read to the end. Caller
+    calls visitor.reset() after it returns.
+    """
+    metrics = _metrics
+    begin = metrics.clock()
+    cached, response = _openpage(url, timeout_secs, max_bytes)
+    if cached is not None:
+        visitor.feed(cached.body().decode(cached.charset()))
+        return True
+    received = 0
+    charset = response.charset() or 'utf-8'
+    decoder = codecs.getincrementaldecoder(charset)()
+    # Chunks are kept only for page cache.
+    body = None
+    if _page_cache is not None:
+        body = []
+    # Text is fed up to the last tag start. HTMLParser passes text split
+    # between two feeds to handle_data() in two calls, which visitors
+    # don't expect.
+    pending = u''
+    for chunk in response.chunks():
+        received += len(chunk)
+        if body is not None:
+            body.append(chunk)
+        pending += decoder.decode(chunk)
+        end = pending.rfind(u'<')
+        if end <= 0:
+            continue
+        visitor.feed(pending[:end])
+        pending = pending[end:]
+        if body is None and visitor.is_complete():
+            response.close()
+            # Download and parsing overlap. They are timed together.
+            metrics.observe("fetch.stream", begin)
+            metrics.count("fetch.pages")
+            metrics.count("fetch.bytes", received)
+            metrics.count("fetch.stream_stops")
+            return False
+    visitor.feed(pending + decoder.decode(b'', True))
+    metrics.observe("fetch.stream", begin)
+    metrics.count("fetch.pages")
+    metrics.count("fetch.bytes", received)
+    if body is not None:
+        _storepage(url, b''.join(body), charset, response)
+    return True
+
+def parsehtml(url, timeout_secs = 5, max_bytes = None):
+    """
+    parsehtml(url, timeout_secs = 5, max_bytes = None)
+
+    A helper function to receive content from given URL. The whole
+    request must complete in timeout_secs, and the page can't be larger
+    than max_bytes on wire if it's given.
+    """
+    body, charset = fetchpage(url, timeout_secs, max_bytes)
+    return body.decode(charset)
+
+def extractrecord(kind, body, charset, selective = None):
+    """
+    extractrecord(kind, body, charset, selective = None) -> dict
+
+    Decode and parse a page of given kind, "movie", "celebrity" or
+    "search", to a record of plain values. It's the work of a parse
+    stage, and it runs in any process. Selective mode of movie pages is
+    set by set_selective_parsing() if it's None.
+    """
+    if selective is None:
+        selective = _selective_parsing
+    metrics = _metrics
+    begin = metrics.clock()
+    html_content = body.decode(charset)
+    metrics.observe("decode", begin)
+    begin = metrics.clock()
+    if kind == "movie":
+        record = Movie.extract_record(html_content, selective)
+    elif kind == "celebrity":
+        record = Celebrity.extract_record(html_content)
+    elif kind == "search":
+        record = Celebrity.extract_search_record(html_content)
+    else:
+        raise UnsupportedDataException(kind)
+    metrics.observe("parse." + kind, begin)
+    return record
+
+def extractpage(url, kind, timeout_secs = 5, max_bytes = None):
+    """
+    extractpage(url, kind, timeout_secs = 5, max_bytes = None) -> dict
+
+    Receive a page and parse it to a record with extractrecord(). If a
+    parse pool is installed, parsing is done by the pool. Otherwise,
+    movie pages are parsed while they download if it's enabled by
+    set_streaming_parsing().
+    """
+    if kind == "movie" and _streaming_parsing and _parse_pool is None:
+        visitor = MoviePageVisitor(None)
+        streampage(url, visitor, timeout_secs, max_bytes)
+        visitor.reset()
+        return Movie.visitor_record(visitor)
+    body, charset = fetchpage(url, timeout_secs, max_bytes)
+    parse_pool = _parse_pool
+    if parse_pool is not None:
+        # Parse processes don't report. Time the round trip here,
+        # including wait for a free slot.
+        metrics = _metrics
+        begin = metrics.clock()
+        record = parse_pool.extract(kind, body, charset)
+        metrics.observe("parse_pool." + kind, begin)
+        return record
+    return extractrecord(kind, body, charset)
 
 class CelebritySearchPageVisitor(HP.HTMLParser):
     STATE_IDLE = 0
@@ -243,7 +546,30 @@ class MoviePageVisitor(HP.HTMLParser):
     STATE_MOVIE_YEAR_START = 12
     STATE_REGION_START = 13
 
-    def __init__(self, html_content):
+    # Used by selective mode to locate regions we need. Attribute values
+    # must match exactly, as handle_starttag() requires.
+    __title_pattern = re.compile(r'property\s*=\s*["\']v:itemreviewed["\']')
+    __h1_pattern = re.compile(r'<h1[\s>]', re.I)
+    __h1_end_pattern = re.compile(r'</h1\s*>', re.I)
+    __info_pattern = re.compile( \
+            r'<div\s[^>]*\bid\s*=\s*(["\']?)info\1[\s/>]', re.I)
+    __recommendations_pattern = re.compile( \
+            r'<div\s[^>]*\bclass\s*=\s*(["\']?)recommendations-bd\1[\s/>]', \
+            re.I)
+    __div_pattern = re.compile(r'<(/?)div[\s/>]', re.I)
+
+    def __init__(self, html_content, selective = False):
+        """
+        MoviePageVisitor.__init__(self, html_content, selective = False)
+
+        Parse given movie page. In selective mode, only regions of title,
+        #info and recommendations are parsed, which is several times
+        faster and gives the same result. If any region is not found,
+        whole page is parsed.
+
+        If html_content is None, nothing is parsed. Caller feeds the page
+        in chunks, and may stop once is_complete() returns True.
+        """
         HP.HTMLParser.__init__(self)
         self.__state = [MoviePageVisitor.STATE_IDLE]
         self.__tag_stack = []
@@ -252,14 +578,85 @@ class MoviePageVisitor(HP.HTMLParser):
         self.__title = None
         self.__year = None
         self.__region = None
+        self.__info_parsed = False
+        self.__recommendations_parsed = False
         self.__celebrities = {
                 MoviePageVisitor.STATE_DIRECTOR_START: [],
                 MoviePageVisitor.STATE_SCRIPTWRITER_START: [],
                 MoviePageVisitor.STATE_ACTOR_START: []
         }
-        self.feed(html_content)
+        if html_content is None:
+            return
+        regions = None
+        if selective:
+            regions = MoviePageVisitor.__regions(html_content)
+            if regions is None:
+                logging.debug("MoviePageVisitor: Regions not found. "
+                              "Parse whole page.")
+        if regions is None:
+            self.feed(html_content)
+        else:
+            # Regions are balanced and fed in order of page, so state
+            # automaton sees what it would see in whole page.
+            for start, end in regions:
+                self.feed(html_content[start:end])
         self.reset()
 
+    @staticmethod
+    def __regions(html_content):
+        """
+        Return (start, end) offsets of title, #info and recommendations
+        in order of page, or None if any of them is not found.
+        """
+        matched = MoviePageVisitor.__title_pattern.search(html_content)
+        if matched is None:
+            return None
+        # Title and year are spans inside the h1 around title.
+        h1 = None
+        for h1 in MoviePageVisitor.__h1_pattern.finditer(html_content, \
+                                                         0, matched.start()):
+            pass
+        if h1 is None:
+            return None
+        h1_end = MoviePageVisitor.__h1_end_pattern.search(html_content, \
+                                                          h1.start())
+        if h1_end is None or h1_end.end() < matched.end():
+            return None
+        regions = [(h1.start(), h1_end.end())]
+        for pattern in (MoviePageVisitor.__info_pattern, \
+                        MoviePageVisitor.__recommendations_pattern):
+            matched = pattern.search(html_content)
+            if matched is None:
+                return None
+            end = MoviePageVisitor.__div_end(html_content, matched.start())
+            if end < 0:
+                return None
+            regions.append((matched.start(), end))
+        regions.sort()
+        for i in range(1, len(regions)):
+            if regions[i][0] < regions[i - 1][1]:
+                # Nested or overlapped. Don't guess.
+                return None
+        return regions
+
+    @staticmethod
+    def __div_end(html_content, start):
+        """
+        Return offset after the end tag of div starting at start, or -1
+        if it's not closed.
+        """
+        depth = 0
+        for matched in MoviePageVisitor.__div_pattern.finditer(html_content, \
+                                                               start):
+            if matched.group(1):
+                depth -= 1
+                if depth == 0:
+                    end = html_content.find('>', matched.start())
+                    return -1 if end < 0 else end + 1
+            else:
+                depth += 1
+        return -1
+
     def directors(self):
         return self.__celebrities[MoviePageVisitor.STATE_DIRECTOR_START]
     def scriptwriters(self):
@@ -274,6 +671,15 @@ class MoviePageVisitor(HP.HTMLParser):
         return self.__year
     def region(self):
         return self.__region
+    def is_complete(self):
+        """
+        MoviePageVisitor.is_complete(self) -> True if rest of page is
+                                              not needed
+
+        Title, #info and recommendations are all parsed.
+        """
+        return self.__title is not None and self.__info_parsed and \
+               self.__recommendations_parsed
 
     def handle_starttag(self, tag, attrs):
         attrs_dict = dict(attrs)
@@ -303,7 +709,7 @@ class MoviePageVisitor(HP.HTMLParser):
                     attrs_dict["property"] == "v:initialReleaseDate":
                 if "content" in attrs_dict:
                     self.__year = attrs_dict["content"]
-                    logging.debug("Year found from info: %s" % self.__year)
+                    logging.debug("Year found from info: %s", self.__year)
             else:
                 pass
         elif ltag == 'a':
@@ -355,8 +761,10 @@ class MoviePageVisitor(HP.HTMLParser):
         elif ltag == 'div':
             if last_state == MoviePageVisitor.STATE_MOVIE_INFO_START:
                 self.__state.pop()
+                self.__info_parsed = True
             elif last_state == MoviePageVisitor.STATE_RELATED_MOVIE_START:
                 self.__state.pop()
+                self.__recommendations_parsed = True
             else:
                 pass
 
@@ -398,10 +806,18 @@ class MoviePageVisitor(HP.HTMLParser):
         elif last_state == MoviePageVisitor.STATE_MOVIE_YEAR_START:
             if self.__year is None:
                 self.__year = data[1:-1]
-                logging.debug("MoviePageVisitor: First year found from h1: %s" \
-                                % self.__year)
+                logging.debug("MoviePageVisitor: First year found from h1: %s", \
+                              self.__year)
 
 class Movie(object):
+    # A crawl keeps lots of movies. Slots save a dict per movie.
+    __slots__ = ('__movie_id',
+                 '__unique_id',
+                 '__title',
+                 '__year',
+                 '__region',
+                 '__related_movie_ids',
+                 '__celebrities')
     __movie_url_pattern = \
             re.compile(r"http:\/\/movie\.douban\.com\/subject\/([0-9][0-9]*)\/?")
     __param_removal_pattern = \
@@ -421,8 +837,8 @@ class Movie(object):
         self.__title = None
         self.__year = None
         self.__region = None
-        self.__related_movies = []
-        self.__celebrities = []
+        self.__related_movie_ids = ()
+        self.__celebrities = ()
         if fetch_on_init:
             self.fetch()
 
@@ -450,8 +866,14 @@ class Movie(object):
         Return a list of related movies, found from HTML page. The
         IDs can be used to regenerate full movie page URL with
         Movie.reformat_movie_url().
+
+        Movie objects are created on each call. Use related_movie_ids()
+        if only Ids are needed.
         """
-        return self.__related_movies
+        return [Movie(each) for each in self.__related_movie_ids]
+
+    def related_movie_ids(self):
+        return self.__related_movie_ids
 
     def fetch(self):
         """
@@ -459,38 +881,77 @@ class Movie(object):
         HTML content. After fetch all fields are updated.
         """
         logging.info("Movie: Fetching: %s", self.__movie_id)
-        m = MoviePageVisitor(parsehtml(self.url()))
+        record = extractpage(self.url(), "movie")
         logging.info("HTML content fetched: %s", self.__movie_id)
+        self.load_record(record)
+
+    def parse(self, html_content):
+        """
+        Movie.parse(self, html_content)
+
+        Update all fields from HTML content of movie page. It's used by
+        callers which download the page themselves.
+        """
+        self.load_record(Movie.extract_record(html_content, \
+                                              _selective_parsing))
+
+    @staticmethod
+    def extract_record(html_content, selective = False):
+        """
+        Movie.extract_record(html_content, selective = False) -> dict
+
+        Static method. Parse HTML content of movie page to a record of
+        plain values, which can be sent between processes. See
+        :MoviePageVisitor: for selective mode.
+        """
+        return Movie.visitor_record(MoviePageVisitor(html_content, \
+                                                     selective = selective))
+
+    @staticmethod
+    def visitor_record(m):
+        """
+        Movie.visitor_record(m) -> dict
+
+        Static method. Make a record of Movie.extract_record() from a
+        :MoviePageVisitor: which has parsed a page.
+        """
         celebrities = []
         for each_director in m.directors():
-            new_celebrity = Celebrity(each_director["douban_id"])
-            new_celebrity.profession(Celebrity.DIRECTOR)
-            new_celebrity.name(each_director["name"])
-            celebrities.append(new_celebrity)
+            celebrities.append((each_director["douban_id"], \
+                                each_director["name"], Celebrity.DIRECTOR))
         for each_actor in m.actors():
-            new_celebrity = Celebrity(each_actor["douban_id"])
-            new_celebrity.profession(Celebrity.ACTOR)
-            new_celebrity.name(each_actor["name"])
-            celebrities.append(new_celebrity)
+            celebrities.append((each_actor["douban_id"], \
+                                each_actor["name"], Celebrity.ACTOR))
         for each_scriptwriter in m.scriptwriters():
-            new_celebrity = Celebrity(each_scriptwriter["douban_id"])
-            new_celebrity.profession(Celebrity.SCRIPTWRITER)
-            new_celebrity.name(each_scriptwriter["name"])
-            celebrities.append(new_celebrity)
-        for each_celebrity in celebrities:
-            each_celebrity.from_movie_douban_id(self.__movie_id)
+            celebrities.append((each_scriptwriter["douban_id"], \
+                                each_scriptwriter["name"], \
+                                Celebrity.SCRIPTWRITER))
+        return {'title': m.title(),
+                'year': m.year(),
+                'region': m.region(),
+                'celebrities': celebrities,
+                'related_movie_ids': [Movie.parse_movie_id(each) \
+                                      for each in m.related_movie_urls()]}
+
+    def load_record(self, record):
+        """
+        Movie.load_record(self, record)
 
-        related_movies = []
-        for each_urls in m.related_movie_urls():
-            each_movie_douban_id = Movie.parse_movie_id(each_urls)
-            new_movie = Movie(each_movie_douban_id)
-            related_movies.append(new_movie)
+        Update all fields from a record of Movie.extract_record().
+        """
+        celebrities = []
+        for douban_id, name, profession in record['celebrities']:
+            new_celebrity = Celebrity(douban_id)
+            new_celebrity.profession(profession)
+            new_celebrity.name(name)
+            new_celebrity.from_movie_douban_id(self.__movie_id)
+            celebrities.append(new_celebrity)
 
-        self.__related_movies = related_movies
+        self.__related_movie_ids = tuple(record['related_movie_ids'])
         self.__celebrities = celebrities
-        self.__title = m.title()
-        self.__year = m.year()
-        self.__region = m.region()
+        self.__title = record['title']
+        self.__year = record['year']
+        self.__region = record['region']
         self.__unique_id = "%s_%s" % (self.__title, self.__year)
 
     @staticmethod
@@ -518,11 +979,24 @@ class Movie(object):
         return "http://movie.douban.com/subject/%s/" % movie_id
 
 
+# Details of a celebrity from its own page. Celebrities known only from
+# movie pages don't have it.
+CelebrityDetails = collections.namedtuple('CelebrityDetails', \
+        ('gender', 'day_of_birth', 'day_of_death', 'place_of_birth', \
+         'imdb_link'))
+
 class Celebrity(object):
     """
     This is only a place holder for fetching celebrity web page. Will be
     used in the next version.
     """
+    # Most celebrities are stubs from movie pages, holding Id, name and
+    # profession. Details are kept in a :CelebrityDetails: when fetched.
+    __slots__ = ('__celebrity_id',
+                 '__name',
+                 '__profession',
+                 '__from_movie_douban_id',
+                 '__details')
     celebrity_pattern = re.compile("\/celebrity\/([0-9][0-9]*)\/")
     __celebrity_url_pattern = \
             re.compile(r"http:\/\/movie\.douban\.com\/celebrity\/([0-9][0-9]*)\/?")
@@ -548,20 +1022,16 @@ class Celebrity(object):
         self.__celebrity_id = douban_url_id
         self.__name = None
         self.__profession = None
-        self.__unique_id = None
-        self.__day_of_birth = None
-        self.__day_of_death = None
-        self.__place_of_birth = None
-        self.__imdb_link = None
-        self.__gender = Celebrity.UNKNOWN_GENDER
-        self.__is_dead_link = True
         self.__from_movie_douban_id = None
+        # None until celebrity page is parsed. It's a dead link then.
+        self.__details = None
 
         if fetch_on_init:
             self.fetch()
 
     def unique_id(self):
-        return self.__unique_id
+        # Not decided for celebrities yet.
+        return None
     def douban_id(self):
         return self.__celebrity_id
 
@@ -580,17 +1050,27 @@ class Celebrity(object):
         return self.__profession
 
     def day_of_birth(self):
-        return self.__day_of_birth
+        if self.__details is None:
+            return None
+        return self.__details.day_of_birth
     def day_of_death(self):
-        return self.__day_of_death
+        if self.__details is None:
+            return None
+        return self.__details.day_of_death
     def place_of_birth(self):
-        return self.__place_of_birth
+        if self.__details is None:
+            return None
+        return self.__details.place_of_birth
     def imdb_link(self):
-        return self.__imdb_link
+        if self.__details is None:
+            return None
+        return self.__details.imdb_link
     def gender(self):
-        return self.__gender
+        if self.__details is None:
+            return Celebrity.UNKNOWN_GENDER
+        return self.__details.gender
     def is_dead_link(self):
-        return self.__is_dead_link
+        return self.__details is None
     def from_movie_douban_id(self, new_id = None):
         old_id = self.__from_movie_douban_id
         if new_id is not None:
@@ -599,43 +1079,130 @@ class Celebrity(object):
         else:
             return self.__from_movie_douban_id
 
+    def url(self):
+        return Celebrity.reformat_celebrity_url(self.__celebrity_id)
+
+    def redirect(self, celebrity_id):
+        """
+        Celebrity.redirect(self, celebrity_id)
+
+        Set the real Id of a celebrity known by search page, when search
+        result is known already.
+        """
+        logging.debug("Celebrity: Known redirect %s => %s", \
+                      self.__celebrity_id, celebrity_id)
+        self.__celebrity_id = celebrity_id
+
+    def search_url(self):
+        """
+        Celebrity.search_url(self) -> URL or None
+
+        A special case: the Id can be set as a format like /search/name.
+        Return the URL of search page in this case, or None if the Id
+        is a real celebrity Id.
+        """
+        matched = Celebrity.__search_pattern.match(self.__celebrity_id)
+        if matched is None:
+            return None
+        return "http://movie.douban.com%s" % self.__celebrity_id
+
     def fetch(self):
         # A special case: self.__celebrity_id can be set as a format
         # like /search/name. We must fetch it to get result.
         logging.info("Celebrity: Fetching: %s", self.__celebrity_id)
-        matched = Celebrity.__search_pattern.match(self.__celebrity_id)
-        if matched is not None:
-            search_id = self.__celebrity_id 
+        search_url = self.search_url()
+        if search_url is not None:
             # Oh yes, we got a search page instead of real user page.
-            logging.debug("Celebrity: Second search: %s" \
-                    % self.__celebrity_id)
-            search_url = "http://movie.douban.com%s" % self.__celebrity_id
-            # Get HTML content, search for h3 tag, and get <a>
-            # under it as the real path.
-            c = CelebritySearchPageVisitor(parsehtml(search_url))
-            # Update the id to real page
-            result_url = c.search_result_url()
-            # NOTE: result_url may be None when douban does not have
-            # information either. In this case we have to keep
-            if result_url is None:
-                self.__is_dead_link = True
-                logging.warn("Celebrity: Dead link: %s" \
-                        % self.__celebrity_id)
+            logging.debug("Celebrity: Second search: %s", \
+                          self.__celebrity_id)
+            if not self.load_search_record(extractpage(search_url, \
+                                                       "search")):
                 # There's nothing we can do. Just return.
                 return
-            else:
-                self.__celebrity_id = Celebrity.parse_celebrity_id(result_url)
-                self.__name = c.name()
-                logging.info("Celebrity: Redirect %s => %s" \
-                        % (search_id, self.__celebrity_id))
-        full_url = Celebrity.reformat_celebrity_url(self.__celebrity_id)
-        c = CelebrityPageVisitor(parsehtml(full_url))
-        self.__gender = c.gender()
-        self.__day_of_birth = c.day_of_birth()
-        self.__day_of_death = c.day_of_death()
-        self.__place_of_birth = c.place_of_birth()
-        self.__imdb_link = c.imdb_link()
-        self.__is_dead_link = False
+        self.load_record(extractpage(self.url(), "celebrity"))
+
+    def parse_search_page(self, html_content):
+        """
+        Celebrity.parse_search_page(self, html_content) -> True or False
+
+        Update the Id from HTML content of search page. Return False if
+        search page gives no result, and the celebrity is a dead link.
+        """
+        return self.load_search_record( \
+                Celebrity.extract_search_record(html_content))
+
+    @staticmethod
+    def extract_search_record(html_content):
+        """
+        Celebrity.extract_search_record(html_content) -> dict
+
+        Static method. Parse HTML content of search page to a record of
+        plain values. Its douban_id is None if there's no result.
+        """
+        # Get HTML content, search for h3 tag, and get <a>
+        # under it as the real path.
+        c = CelebritySearchPageVisitor(html_content)
+        result_url = c.search_result_url()
+        if result_url is None:
+            return {'douban_id': None, 'name': None}
+        return {'douban_id': Celebrity.parse_celebrity_id(result_url),
+                'name': c.name()}
+
+    def load_search_record(self, record):
+        """
+        Celebrity.load_search_record(self, record) -> True or False
+
+        Update the Id from a record of Celebrity.extract_search_record().
+        Return False if the celebrity is a dead link.
+        """
+        search_id = self.__celebrity_id
+        # NOTE: Result may be None when douban does not have
+        # information either. In this case we have to keep
+        if record['douban_id'] is None:
+            self.__details = None
+            logging.warn("Celebrity: Dead link: %s", self.__celebrity_id)
+            return False
+        # Update the id to real page
+        self.__celebrity_id = record['douban_id']
+        self.__name = record['name']
+        logging.info("Celebrity: Redirect %s => %s", \
+                     search_id, self.__celebrity_id)
+        return True
+
+    def parse(self, html_content):
+        """
+        Celebrity.parse(self, html_content)
+
+        Update all fields from HTML content of celebrity page.
+        """
+        self.load_record(Celebrity.extract_record(html_content))
+
+    @staticmethod
+    def extract_record(html_content):
+        """
+        Celebrity.extract_record(html_content) -> dict
+
+        Static method. Parse HTML content of celebrity page to a record
+        of plain values.
+        """
+        c = CelebrityPageVisitor(html_content)
+        return {'gender': c.gender(),
+                'day_of_birth': c.day_of_birth(),
+                'day_of_death': c.day_of_death(),
+                'place_of_birth': c.place_of_birth(),
+                'imdb_link': c.imdb_link()}
+
+    def load_record(self, record):
+        """
+        Celebrity.load_record(self, record)
+
+        Update all fields from a record of Celebrity.extract_record().
+        """
+        self.__details = CelebrityDetails(record['gender'], \
+                                          record['day_of_birth'], \
+                                          record['day_of_death'], \
+                                          record['place_of_birth'], \
+                                          record['imdb_link'])
         # NOTE: We don't update profession. In a lot of cases, one
         # person may have multiple professions. So we leave it to
         # movie_profession_map table.
@@ -668,6 +1235,12 @@ class Celebrity(object):
 class Sqlite3Host(object):
     PLACEHOLDER = "_NaN_"
 
+    # Version 1 has no key or index at all. Version 2 adds primary keys
+    # and indexes, and writes with upsert. Version 3 adds change sequence
+    # to tables of __change_tables. It's kept in user_version pragma of
+    # database.
+    SCHEMA_VERSION = 3
+
     __table_params = {
         'v1_celebrity_info': ('unique_id',
                               'douban_id',
@@ -685,49 +1258,253 @@ class Sqlite3Host(object):
         'v1_movie_profession_map': ('movie_douban_id',
                                     'celebrity_douban_id',
                                     'profession'),
-        'v1_partial_movie_info': ('douban_id'),
+        'v1_partial_movie_info': ('douban_id', ),
         'v1_dead_link_celebrity_info': ('douban_id',
                                         'name',
-                                        'from_movie_douban_id')
+                                        'from_movie_douban_id'),
+        'v1_celebrity_alias_info': ('search_id',
+                                    'douban_id'),
+        'v1_celebrity_costar_map': ('celebrity_douban_id',
+                                    'costar_douban_id',
+                                    'movie_count'),
+        'v1_watermark_info': ('name',
+                              'last_rowid'),
+        'v1_freshness_info': ('kind',
+                              'douban_id',
+                              'record_hash',
+                              'fetched_at',
+                              'changed_at',
+                              'revisit_secs',
+                              'next_visit_at',
+                              'visits',
+                              'changes')
+    }
+    __table_keys = {
+        'v1_celebrity_info': ('douban_id', ),
+        'v1_movie_info': ('douban_id', ),
+        'v1_movie_profession_map': ('movie_douban_id',
+                                    'celebrity_douban_id',
+                                    'profession'),
+        'v1_partial_movie_info': ('douban_id', ),
+        'v1_dead_link_celebrity_info': ('douban_id', ),
+        'v1_celebrity_alias_info': ('search_id', ),
+        'v1_celebrity_costar_map': ('celebrity_douban_id',
+                                    'costar_douban_id'),
+        'v1_watermark_info': ('name', ),
+        'v1_freshness_info': ('kind',
+                              'douban_id')
     }
     __table_creations = {
         'v1_celebrity_info': """create table v1_celebrity_info (
                                 unique_id text,
-                                douban_id text,
+                                douban_id text primary key,
                                 name text,
                                 gender integer,
                                 day_of_birth text,
-                                place_of_birth text,
                                 day_of_death text,
-                                imdb_link text)""",
+                                place_of_birth text,
+                                imdb_link text,
+                                change_seq integer)""",
         'v1_movie_info': """create table v1_movie_info (
                             unique_id text,
-                            douban_id text,
+                            douban_id text primary key,
                             title text,
                             year text,
-                            region text)""",
+                            region text,
+                            change_seq integer)""",
         'v1_movie_profession_map': \
                 """create table v1_movie_profession_map (
                    movie_douban_id text,
                    celebrity_douban_id text,
-                   profession integer)""",
+                   profession integer,
+                   change_seq integer,
+                   primary key (movie_douban_id,
+                                celebrity_douban_id,
+                                profession))""",
         'v1_partial_movie_info': """create table v1_partial_movie_info (
-                            douban_id text)""",
+                            douban_id text primary key)""",
         'v1_dead_link_celebrity_info': \
                 """create table v1_dead_link_celebrity_info (
-                   douban_id text,
+                   douban_id text primary key,
                    name text,
-                   from_movie_douban_id text)"""
-
+                   from_movie_douban_id text)""",
+        'v1_celebrity_alias_info': \
+                """create table v1_celebrity_alias_info (
+                   search_id text primary key,
+                   douban_id text)""",
+        'v1_celebrity_costar_map': \
+                """create table v1_celebrity_costar_map (
+                   celebrity_douban_id text,
+                   costar_douban_id text,
+                   movie_count integer,
+                   primary key (celebrity_douban_id,
+                                costar_douban_id))""",
+        'v1_watermark_info': """create table v1_watermark_info (
+                                name text primary key,
+                                last_rowid integer)""",
+        'v1_freshness_info': """create table v1_freshness_info (
+                                kind text,
+                                douban_id text,
+                                record_hash text,
+                                fetched_at real,
+                                changed_at real,
+                                revisit_secs real,
+                                next_visit_at real,
+                                visits integer,
+                                changes integer,
+                                primary key (kind, douban_id))"""
         }
-    def __init__(self, sqlite_db_path):
+    # Primary key of v1_movie_profession_map serves lookups by
+    # movie_douban_id, so it needs no index of its own.
+    __index_creations = (
+        """create index if not exists v1_movie_profession_map_celebrity
+           on v1_movie_profession_map (celebrity_douban_id)""",
+        """create index if not exists v1_celebrity_costar_map_rank
+           on v1_celebrity_costar_map (celebrity_douban_id,
+                                       movie_count desc,
+                                       costar_douban_id)""",
+        """create index if not exists v1_freshness_info_due
+           on v1_freshness_info (kind, next_visit_at)""",
+        """create index if not exists v1_celebrity_info_change
+           on v1_celebrity_info (change_seq)""",
+        """create index if not exists v1_movie_info_change
+           on v1_movie_info (change_seq)""",
+        """create index if not exists v1_movie_profession_map_change
+           on v1_movie_profession_map (change_seq)""",
+    )
+    # Tables handed to consumers, with a change_seq column. A row takes
+    # next number of its table when it's inserted or its values change,
+    # so an export can take rows changed since its last run. Writers
+    # take turns on database, so numbers are committed in order.
+    __change_tables = ('v1_celebrity_info',
+                       'v1_movie_info',
+                       'v1_movie_profession_map')
+    # Name of a celebrity saved as a dead link is kept in another table.
+    __celebrity_name = """coalesce(
+            (select name from v1_celebrity_info
+             where douban_id = %(id)s),
+            (select name from v1_dead_link_celebrity_info
+             where douban_id = %(id)s))"""
+
+    @staticmethod
+    def __upsert(table, source = None):
         """
-        Sqlite3Host.__init__(self, sqlite_db_path)
+        Return insertion statement of given table. On conflict of primary
+        key, other columns are updated. Tables with all columns in key
+        just ignore the new row. Rows are given as parameters, or
+        selected from source table of the same columns.
+
+        Rows of __change_tables get next change sequence. A row updated
+        with the same values keeps its sequence.
+        """
+        params = Sqlite3Host.__table_params[table]
+        keys = Sqlite3Host.__table_keys[table]
+        columns = list(params)
+        selections = list(params)
+        if table in Sqlite3Host.__change_tables:
+            columns.append('change_seq')
+            last_change = "(select coalesce(max(change_seq), 0) from %s)" \
+                    % table
+            if source is None:
+                selections.append("%s + 1" % last_change)
+            else:
+                # Subquery is evaluated once, before any row is copied.
+                # Rowid of source keeps copied rows in order.
+                selections.append("%s + rowid" % last_change)
+        if source is None:
+            insertion = "insert into %s (%s) values (%s)" % \
+                    (table, ", ".join(columns), \
+                     ", ".join(["?"] * len(params) + \
+                               selections[len(params):]))
+        else:
+            # The where clause tells SQLite an upsert follows, not a
+            # join constraint.
+            insertion = "insert into %s (%s) select %s from %s " \
+                        "where 1 order by rowid" % \
+                    (table, ", ".join(columns), ", ".join(selections), \
+                     source)
+        values = [each for each in params if each not in keys]
+        if sqlite3.sqlite_version_info < (3, 24, 0):
+            # No upsert syntax before SQLite 3.24. Replace works the same
+            # for us, except rowid and change sequence change, even if
+            # values don't.
+            if len(values) > 0:
+                return insertion.replace("insert", "insert or replace", 1)
+            return insertion.replace("insert", "insert or ignore", 1)
+        if len(values) == 0:
+            return "%s on conflict (%s) do nothing" % \
+                    (insertion, ", ".join(keys))
+        update = "%s on conflict (%s) do update set %s" % \
+                (insertion, ", ".join(keys), \
+                 ", ".join("%s = excluded.%s" % (each, each) \
+                           for each in values + columns[len(params):]))
+        if table in Sqlite3Host.__change_tables:
+            update += " where %s" % " or ".join( \
+                    "%s is not excluded.%s" % (each, each) for each in values)
+        return update
+
+    def __init__(self, sqlite_db_path, batch_size = 0, \
+                 flush_interval_secs = 0, journal_mode = None, \
+                 synchronous = None, costars = False, freshness = False, \
+                 min_revisit_secs = 86400, max_revisit_secs = 90 * 86400, \
+                 read_only = False):
+        """
+        Sqlite3Host.__init__(self, sqlite_db_path, batch_size = 0,
+                             flush_interval_secs = 0, journal_mode = None,
+                             synchronous = None, costars = False,
+                             freshness = False, min_revisit_secs = 86400,
+                             max_revisit_secs = 90 * 86400,
+                             read_only = False)
 
         Write data to a SQLite3 database.
+
+        If batch_size is larger than 0, rows are buffered per table and
+        written with executemany() in a single transaction, when
+        batch_size rows are buffered or flush_interval_secs passed since
+        last flush. Buffered rows are always written on stop().
+
+        The journal_mode and synchronous are passed to SQLite as pragmas,
+        e.g. "WAL" and "NORMAL". None keeps SQLite defaults.
+
+        If costars is True, a table of co-stars is kept for
+        celebrity_costars(). It's refreshed from movies saved since last
+        refresh, in the transaction writing them. Turning it on for an
+        existing database builds it from all movies on first write.
+
+        If freshness is True, each saved movie and celebrity gets a hash
+        of its rows, and a time to revisit it. A record saved with the
+        same hash is not written again, and its revisit interval is
+        doubled, up to max_revisit_secs. A changed record has its
+        interval halved, down to min_revisit_secs. Records due for a
+        revisit are given by due_movie_ids() and due_celebrity_ids().
+
+        If read_only is True, an existing database is opened for queries
+        only, e.g. by a web server or an exporter running beside a
+        spider. Tables are not created or migrated, no write lock is
+        taken, and any write fails.
         """
         self.__sqlite_db_path = sqlite_db_path
+        self.__read_only = read_only
         self.__conn = None
+        self.__insertions = dict((each, Sqlite3Host.__upsert(each)) \
+                                 for each in Sqlite3Host.__table_params)
+        self.__batch_size = batch_size
+        self.__flush_interval = flush_interval_secs
+        self.__journal_mode = journal_mode
+        self.__synchronous = synchronous
+        self.__costars = costars
+        self.__freshness = freshness
+        self.__min_revisit = float(min_revisit_secs)
+        self.__max_revisit = float(max_revisit_secs)
+        # Buffered freshness rows by (kind, Id), which queries can't see
+        # until they are flushed.
+        self.__fresh_rows = {}
+        self.__freshness_stats = {'new': 0,
+                                  'changed': 0,
+                                  'unchanged': 0}
+        self.__pending_rows = {}
+        self.__pending_count = 0
+        self.__last_flush = time.time()
 
     def start(self):
         """
@@ -738,8 +1515,48 @@ class Sqlite3Host(object):
         """
         if self.__conn is not None:
             return
+        if self.__read_only:
+            self.__conn = Sqlite3Host.__connect_read_only( \
+                    self.__sqlite_db_path)
+            return
         self.__conn = sqlite3.connect(self.__sqlite_db_path)
+        if self.__journal_mode is not None:
+            mode = self.__conn.execute("pragma journal_mode = %s" % \
+                                       self.__journal_mode).fetchone()
+            logging.info("Sqlite3Host: Journal mode: %s" % mode[0])
+        if self.__synchronous is not None:
+            self.__conn.execute("pragma synchronous = %s" % \
+                                self.__synchronous)
         self.__create_table()
+        self.__last_flush = time.time()
+
+    @staticmethod
+    def __connect_read_only(path):
+        if ver == '2':
+            # No URI filenames in Python 2. The database must exist, as
+            # connect() creates it otherwise.
+            if not os.path.isfile(path):
+                raise sqlite3.OperationalError( \
+                        "unable to open database file")
+            conn = sqlite3.connect(path)
+            conn.execute("pragma query_only = 1")
+            return conn
+        uri = "file:%s?mode=ro" % UP.quote(os.path.abspath(path))
+        return sqlite3.connect(uri, uri = True)
+
+    def stop(self):
+        """
+        Sqlite3Host.stop()
+
+        Write all buffered rows and close database. It must be called
+        from the thread calling start().
+        """
+        if self.__conn is None:
+            return
+        self.commit()
+        self.__conn.close()
+        self.__conn = None
+        logging.info("Sqlite3Host: Stopped.")
 
     def save(self, obj, commit = True):
         """
@@ -754,22 +1571,132 @@ class Sqlite3Host(object):
         step is useful if there are a lot of save() operations to be
         performed and developer really concerns about performance.
         However, in most cases we can safely use default commit = True.
+
+        In batch mode, the commit parameter is ignored. Rows are written
+        when batch is full, or on flush(), commit() and stop().
+
+        When freshness is tracked, only freshness of an unchanged record
+        is written.
+        """
+        if self.__conn is None:
+            raise DatabaseNotStartedException()
+        rows = self.__rows(obj)
+        if self.__freshness:
+            rows = self.__check_freshness(obj, rows)
+        self.__write(rows, commit)
+
+    def __check_freshness(self, obj, rows):
+        """
+        Return rows to be written for given object and its rows, with a
+        new row of freshness, or only that row if it's unchanged.
+        """
+        if type(obj) is Movie:
+            if self.__is_movie_partial(obj):
+                return rows
+            kind = "movie"
+        else:
+            kind = "celebrity"
+        key = (kind, obj.douban_id())
+        # JSON gives the same text for str and unicode, on Python 2 and
+        # 3.
+        record_hash = hashlib.sha1(json.dumps(rows, sort_keys = True) \
+                                   .encode('utf-8')).hexdigest()
+        now = time.time()
+        old = self.__fresh_rows.get(key)
+        if old is None:
+            query = """select kind, douban_id, record_hash, fetched_at,
+                       changed_at, revisit_secs, next_visit_at, visits,
+                       changes from v1_freshness_info
+                       where kind = ? and douban_id = ?"""
+            old = self.__conn.execute(query, key).fetchone()
+        if old is None:
+            self.__freshness_stats['new'] += 1
+            changed_at = now
+            revisit = self.__min_revisit
+            visits = 1
+            changes = 0
+        elif old[2] == record_hash:
+            self.__freshness_stats['unchanged'] += 1
+            _metrics.count("db.unchanged")
+            changed_at = old[4]
+            revisit = min(self.__max_revisit, \
+                          max(self.__min_revisit, old[5] * 2))
+            visits = old[7] + 1
+            changes = old[8]
+            rows = []
+        else:
+            self.__freshness_stats['changed'] += 1
+            changed_at = now
+            revisit = max(self.__min_revisit, \
+                          min(self.__max_revisit, old[5] / 2))
+            visits = old[7] + 1
+            changes = old[8] + 1
+        row = (kind, obj.douban_id(), record_hash, now, changed_at, \
+               revisit, now + revisit, visits, changes)
+        if self.__batch_size > 0:
+            self.__fresh_rows[key] = row
+        return rows + [('v1_freshness_info', row)]
+
+    def freshness_stats(self):
+        """
+        Sqlite3Host.freshness_stats(self) -> dict
+
+        Return numbers of records saved new, changed and unchanged in
+        this run, when freshness is tracked.
+        """
+        return dict(self.__freshness_stats)
+
+    def save_partial_movie_ids(self, douban_ids, commit = True):
+        """
+        Sqlite3Host.save_partial_movie_ids(self, douban_ids, commit = True)
+
+        Save movies known by Id only, as partial movies. The commit
+        parameter works as in save().
+        """
+        if self.__conn is None:
+            raise DatabaseNotStartedException()
+        self.__write([('v1_partial_movie_info', (self.__v(each), )) \
+                      for each in douban_ids], commit)
+
+    def save_celebrity_aliases(self, aliases, commit = True):
+        """
+        Sqlite3Host.save_celebrity_aliases(self, aliases, commit = True)
+
+        Save a list of (search Id, real Id) of celebrities found by
+        search pages. The commit parameter works as in save().
         """
         if self.__conn is None:
             raise DatabaseNotStartedException()
+        self.__write([('v1_celebrity_alias_info', each) \
+                      for each in aliases], commit)
+
+    def __write(self, rows, commit):
+        if self.__batch_size > 0:
+            for table, row in rows:
+                self.__pending_rows.setdefault(table, []).append(row)
+            self.__pending_count += len(rows)
+            self.flush_if_due()
+            return
+        metrics = _metrics
+        begin = metrics.clock()
+        for table, row in rows:
+            self.__conn.execute(self.__insertions[table], row)
+        if commit:
+            logging.debug("Sqlite3Host: Committing.")
+            self.__commit()
+        metrics.observe("db.write", begin)
+        metrics.count("db.rows", len(rows))
+        logging.info("Sqlite3Host: New column added.")
+
+    def __rows(self, obj):
+        """
+        Return a list of (table, row) to be inserted for given object.
+        """
+        rows = []
         if type(obj) is Movie:
-            logging.info("Sqlite3Host: Save Movie: %s %s, retry  = %d" % \
-                    (obj.title(), obj.douban_id(), \
-                     self.__is_movie_partial(obj)))
-            movie_insertion = """
-                insert into v1_movie_info values (?, ?, ?, ?, ?)
-            """
-            movie_profession_map = """
-                 insert into v1_movie_profession_map values (?, ?, ?)
-            """
-            movie_partial_insertion = """
-                insert into v1_partial_movie_info values (?)
-            """
+            logging.info("Sqlite3Host: Save Movie: %s %s, retry  = %d", \
+                         obj.title(), obj.douban_id(), \
+                         self.__is_movie_partial(obj))
             if self.__is_movie_partial(obj):
                 # We have to leave all partial movies to a seperated
                 # table, because Sqlite3 does not support dropping
@@ -783,32 +1710,29 @@ class Sqlite3Host(object):
                 #
                 # For the same reason, we don't need celebrities from
                 # partial movie. They will be retrieved at next fetch.
-                self.__conn.execute(movie_partial_insertion, \
-                                    (self.__v(obj.douban_id()), ))
+                rows.append(('v1_partial_movie_info', \
+                             (self.__v(obj.douban_id()), )))
             else:
-                self.__conn.execute(movie_insertion, \
+                rows.append(('v1_movie_info', \
                         (self.__v(obj.unique_id()), \
                          self.__v(obj.douban_id()), \
                          self.__v(obj.title()), \
                          self.__v(obj.year()), \
-                         self.__v(obj.region())))
+                         self.__v(obj.region()))))
                 for each_celebrity in obj.celebrities():
                     celebrity_douban_id = each_celebrity.douban_id()
                     celebrity_profession = each_celebrity.profession()
-                    self.__conn.execute(movie_profession_map, \
+                    rows.append(('v1_movie_profession_map', \
                             (self.__v(obj.douban_id()), \
                              self.__v(celebrity_douban_id), \
-                             self.__v(celebrity_profession)))
+                             self.__v(celebrity_profession))))
 
         elif type(obj) is Celebrity:
-            logging.info("Sqlite3Host: Save Celebrity: %s %s, %s, dead link = %d" % \
-                    (obj.name(), obj.douban_id(), obj.profession(), \
-                        obj.is_dead_link()))
+            logging.info("Sqlite3Host: Save Celebrity: %s %s, %s, dead link = %d", \
+                         obj.name(), obj.douban_id(), obj.profession(), \
+                         obj.is_dead_link())
             if not obj.is_dead_link():
-                celebrity_insertion = """
-                    insert into v1_celebrity_info values (?, ?, ?, ?, ?, ?, ?, ?)
-                """
-                self.__conn.execute(celebrity_insertion, \
+                rows.append(('v1_celebrity_info', \
                         (self.__v(obj.unique_id()), \
                          self.__v(obj.douban_id()), \
                          self.__v(obj.name()), \
@@ -816,21 +1740,15 @@ class Sqlite3Host(object):
                          self.__v(obj.day_of_birth()), \
                          self.__v(obj.day_of_death()), \
                          self.__v(obj.place_of_birth()), \
-                         self.__v(obj.imdb_link())))
+                         self.__v(obj.imdb_link()))))
             else: # Dead link
-                celebrity_dead_link_insertion = """
-                    insert into v1_dead_link_celebrity_info values (?, ?, ?)
-                """
-                self.__conn.execute(celebrity_dead_link_insertion, \
+                rows.append(('v1_dead_link_celebrity_info', \
                         (self.__v(obj.douban_id()), \
                          self.__v(obj.name()), \
-                         self.__v(obj.from_movie_douban_id())))
+                         self.__v(obj.from_movie_douban_id()))))
         else:
             raise UnsupportedDataException(type(obj).__name__)
-        if commit:
-            logging.debug("Sqlite3Host: Committing.")
-            self.__conn.commit()
-        logging.info("Sqlite3Host: New column added.")
+        return rows
 
     def __is_movie_partial(self, obj):
         if obj.title() is not None and obj.douban_id() is not None \
@@ -856,71 +1774,661 @@ class Sqlite3Host(object):
             raise DatabaseNotStartedException()
         for each in obj_list:
             self.save(each, False)
-        self.__conn.commit()
+        self.commit()
 
     def commit(self):
         if self.__conn is None:
             raise DatabaseNotStartedException()
+        if self.__batch_size > 0:
+            self.flush()
+        else:
+            self.__commit()
+
+    def __commit(self):
+        if self.__costars and not self.__read_only:
+            self.__refresh_costars()
         self.__conn.commit()
 
+    def flush_if_due(self):
+        """
+        Sqlite3Host.flush_if_due(self)
+
+        In batch mode, flush buffered rows if batch is full or flush
+        interval passed. Callers idle for a while can call it to keep
+        buffered rows from waiting for next save().
+        """
+        if self.__pending_count == 0:
+            return
+        if self.__pending_count >= self.__batch_size or \
+                (self.__flush_interval > 0 and \
+                 time.time() - self.__last_flush >= self.__flush_interval):
+            self.flush()
+
+    def flush(self):
+        """
+        Sqlite3Host.flush(self)
+
+        Write all buffered rows in a single transaction.
+        """
+        if self.__conn is None:
+            raise DatabaseNotStartedException()
+        self.__last_flush = time.time()
+        if self.__pending_count == 0:
+            return
+        pending_rows = self.__pending_rows
+        pending_count = self.__pending_count
+        self.__pending_rows = {}
+        self.__pending_count = 0
+        self.__fresh_rows = {}
+        metrics = _metrics
+        begin = metrics.clock()
+        try:
+            for table, rows in pending_rows.items():
+                self.__conn.executemany( \
+                        self.__insertions[table], rows)
+            self.__commit()
+        except:
+            self.__conn.rollback()
+            raise
+        metrics.observe("db.flush", begin)
+        metrics.count("db.rows", pending_count)
+        logging.info("Sqlite3Host: %d rows flushed.", pending_count)
+
     def load_partial_movie_ids(self):
+        """
+        Sqlite3Host.load_partial_movie_ids(self) -> list of Ids
+
+        Return partial movies in order they are saved. Partial movies
+        already saved in full are removed from partial table first.
+        """
         if self.__conn is None:
             raise DatabaseNotStartedException()
+        self.commit()
         logging.info("Sqlite3Host: Load partial movie Ids")
-        query = "select douban_id from v1_partial_movie_info"
-        cursor = self.__conn.execute(query)
-        columns = cursor.fetchall()
-        ids = [each[0] for each in columns]
-        logging.debug("Sqlite3Host: Drop partial movie table")
-        drop = "drop table v1_partial_movie_info"
-        self.__conn.execute(drop)
-        logging.debug("Sqlite3Host: Recreate partial movie table")
-        create = Sqlite3Host.__table_creations["v1_partial_movie_info"]
-        self.__conn.execute(create)
+        logging.debug("Sqlite3Host: Remove movies already fetched")
+        delete = """delete from v1_partial_movie_info where douban_id in
+                    (select douban_id from v1_movie_info)"""
+        self.__conn.execute(delete)
         self.__conn.commit()
-        logging.debug("Sqlite3Host: Partial movie table created.")
+        query = "select douban_id from v1_partial_movie_info order by rowid"
+        cursor = self.__conn.execute(query)
+        ids = [each[0] for each in cursor.fetchall()]
         logging.info("Sqlite3Host: Partial movie Ids loaded: %d" % len(ids))
         return ids
 
+    def load_movie_ids(self):
+        """
+        Sqlite3Host.load_movie_ids(self) -> list of Ids of saved movies
+        """
+        if self.__conn is None:
+            raise DatabaseNotStartedException()
+        self.commit()
+        query = "select douban_id from v1_movie_info"
+        return [each[0] for each in self.__conn.execute(query).fetchall()]
+
+    def load_celebrity_ids(self):
+        """
+        Sqlite3Host.load_celebrity_ids(self) -> list of Ids
+
+        Return Ids of saved celebrities, including dead links.
+        """
+        if self.__conn is None:
+            raise DatabaseNotStartedException()
+        self.commit()
+        query = """select douban_id from v1_celebrity_info union
+                   select douban_id from v1_dead_link_celebrity_info"""
+        return [each[0] for each in self.__conn.execute(query).fetchall()]
+
+    def load_celebrity_aliases(self):
+        """
+        Sqlite3Host.load_celebrity_aliases(self) -> dict
+
+        Return a dict from search Id to real Id of celebrities.
+        """
+        if self.__conn is None:
+            raise DatabaseNotStartedException()
+        self.commit()
+        query = "select search_id, douban_id from v1_celebrity_alias_info"
+        return dict(self.__conn.execute(query).fetchall())
+
+    @staticmethod
+    def columns(table):
+        """
+        Sqlite3Host.columns(table) -> list of column names
+
+        Static method. Return columns of given table, in order rows of
+        export_rows() have.
+        """
+        return list(Sqlite3Host.__table_params[table])
+
+    def last_change(self, table):
+        """
+        Sqlite3Host.last_change(self, table) -> largest change sequence,
+                                                or 0
+
+        Table must have change sequence, e.g. one of exported tables.
+        """
+        if self.__conn is None:
+            raise DatabaseNotStartedException()
+        Sqlite3Host.__check_change_table(table)
+        self.commit()
+        query = "select max(change_seq) from %s" % table
+        row = self.__conn.execute(query).fetchone()
+        return row[0] or 0
+
+    def export_rows(self, table, after_change = 0, until_change = None, \
+                    chunk_rows = 1000):
+        """
+        Sqlite3Host.export_rows(self, table, after_change = 0,
+                                until_change = None, chunk_rows = 1000)
+            -> iterator of lists of rows
+
+        Yield rows of table inserted or changed after change sequence
+        after_change, and up to until_change if it's given, in order of
+        change, at most chunk_rows at a time. Rows come from one
+        statement stepped as chunks are taken, so memory doesn't grow
+        with table, and all chunks see the same snapshot. In WAL journal
+        mode it doesn't block a spider writing the same database.
+        """
+        if self.__conn is None:
+            raise DatabaseNotStartedException()
+        Sqlite3Host.__check_change_table(table)
+        self.commit()
+        if until_change is None:
+            until_change = self.last_change(table)
+        query = """select %s from %s
+                   where change_seq > ? and change_seq <= ?
+                   order by change_seq""" % \
+                (", ".join(Sqlite3Host.__table_params[table]), table)
+        cursor = self.__conn.execute(query, (after_change, until_change))
+        try:
+            while True:
+                rows = cursor.fetchmany(chunk_rows)
+                if len(rows) == 0:
+                    break
+                yield rows
+        finally:
+            cursor.close()
+
+    @staticmethod
+    def __check_change_table(table):
+        if table not in Sqlite3Host.__change_tables:
+            raise ValueError("Table %s has no change sequence." % table)
+
+    def schema_version(self):
+        """
+        Sqlite3Host.schema_version(self) -> version of database
+
+        It's older than SCHEMA_VERSION for a database opened read only,
+        before a writer migrates it.
+        """
+        if self.__conn is None:
+            raise DatabaseNotStartedException()
+        return self.__conn.execute("pragma user_version").fetchone()[0]
+
+    def watermark(self, name):
+        """
+        Sqlite3Host.watermark(self, name) -> rowid, or 0
+
+        Return rowid saved by save_watermark() with given name, e.g. last
+        row of a table processed by co-stars.
+        """
+        if self.__conn is None:
+            raise DatabaseNotStartedException()
+        query = "select last_rowid from v1_watermark_info where name = ?"
+        row = self.__conn.execute(query, (name, )).fetchone()
+        return 0 if row is None else row[0]
+
+    def save_watermark(self, name, last_rowid, commit = True):
+        if self.__conn is None:
+            raise DatabaseNotStartedException()
+        self.__write([('v1_watermark_info', (name, last_rowid))], commit)
+
+    def due_movie_ids(self, now = None, limit = 0):
+        """
+        Sqlite3Host.due_movie_ids(self, now = None, limit = 0)
+            -> list of Ids
+
+        Return saved movies due for a revisit at time now, most overdue
+        first, at most limit of them if it's larger than 0. Movies saved
+        without freshness come first, as their age is unknown.
+        """
+        return self.__due_ids("movie", "v1_movie_info", now, limit)
+
+    def due_celebrity_ids(self, now = None, limit = 0):
+        """
+        Sqlite3Host.due_celebrity_ids(self, now = None, limit = 0)
+            -> list of Ids
+
+        Return saved celebrities due for a revisit, like due_movie_ids().
+        Dead links are never due.
+        """
+        return self.__due_ids("celebrity", "v1_celebrity_info", now, limit)
+
+    def __due_ids(self, kind, table, now, limit):
+        if self.__conn is None:
+            raise DatabaseNotStartedException()
+        self.commit()
+        if now is None:
+            now = time.time()
+        query = """select t.douban_id from %s t
+                   left join v1_freshness_info f
+                   on f.kind = ? and f.douban_id = t.douban_id
+                   where f.next_visit_at is null or f.next_visit_at <= ?
+                   order by coalesce(f.next_visit_at, 0), t.rowid
+                   limit ?""" % table
+        cursor = self.__conn.execute(query, \
+                                     (kind, now, limit if limit > 0 else -1))
+        return [each[0] for each in cursor.fetchall()]
+
+    def merge(self, other_db_path):
+        """
+        Sqlite3Host.merge(self, other_db_path) -> dict of row numbers
+
+        Copy all rows of another database into this one, in a single
+        transaction, e.g. to combine databases of a sharded crawl. Rows
+        already here are updated by rows of the same key. Partial movies
+        saved in full by either side are dropped. Co-stars are not
+        copied, but refreshed from copied movies if costars is True in
+        __init__().
+
+        Return number of rows copied from each table.
+        """
+        if self.__conn is None:
+            raise DatabaseNotStartedException()
+        self.commit()
+        self.__conn.execute("attach database ? as other", (other_db_path, ))
+        try:
+            version = self.__conn.execute( \
+                    "pragma other.user_version").fetchone()[0]
+            if version != Sqlite3Host.SCHEMA_VERSION:
+                raise Exception("Database %s has schema version %d." % \
+                        (other_db_path, version))
+            query = "select name from other.sqlite_master where type='table'"
+            other_tables = set(each[0] for each in \
+                               self.__conn.execute(query).fetchall())
+            counts = {}
+            for each in sorted(Sqlite3Host.__table_params):
+                if each in ('v1_celebrity_costar_map', \
+                            'v1_watermark_info') or \
+                        each not in other_tables:
+                    continue
+                cursor = self.__conn.execute(Sqlite3Host.__upsert( \
+                        each, "other.%s" % each))
+                counts[each] = cursor.rowcount
+            self.__conn.execute("""delete from v1_partial_movie_info
+                                   where douban_id in
+                                   (select douban_id from v1_movie_info)""")
+            self.__commit()
+        except:
+            self.__conn.rollback()
+            raise
+        finally:
+            self.__conn.execute("detach database other")
+        logging.info("Sqlite3Host: %s merged: %s" % (other_db_path, counts))
+        return counts
+
+    def refresh_costars(self):
+        """
+        Sqlite3Host.refresh_costars(self)
+
+        Update co-stars table with movies saved since last refresh. It's
+        called on every commit if costars is True in __init__().
+        """
+        if self.__conn is None:
+            raise DatabaseNotStartedException()
+        self.commit()
+        self.__refresh_costars()
+        self.__conn.commit()
+
+    def __refresh_costars(self):
+        """
+        Add co-stars of movies with profession rows after the watermark.
+        Rows are never deleted and a movie may get new celebrities, so a
+        pair is counted for a movie only when one of them is new to it.
+        """
+        watermark = self.watermark('costars')
+        query = "select max(rowid) from v1_movie_profession_map"
+        last_rowid = self.__conn.execute(query).fetchone()[0]
+        if last_rowid is None or last_rowid <= watermark:
+            return
+        query = """with movie_cast as (
+                       select movie_douban_id, celebrity_douban_id,
+                              min(rowid) as first_rowid
+                       from v1_movie_profession_map
+                       where movie_douban_id in
+                             (select movie_douban_id
+                              from v1_movie_profession_map
+                              where rowid > :watermark)
+                       group by movie_douban_id, celebrity_douban_id)
+                   select a.celebrity_douban_id, b.celebrity_douban_id,
+                          count(*)
+                   from movie_cast a join movie_cast b
+                   on a.movie_douban_id = b.movie_douban_id and
+                      a.celebrity_douban_id != b.celebrity_douban_id
+                   where a.first_rowid > :watermark or
+                         b.first_rowid > :watermark
+                   group by a.celebrity_douban_id, b.celebrity_douban_id"""
+        pairs = self.__conn.execute(query, \
+                                    {'watermark': watermark}).fetchall()
+        # Works without upsert syntax of SQLite 3.24.
+        self.__conn.executemany("""insert or ignore into
+                v1_celebrity_costar_map (celebrity_douban_id,
+                                         costar_douban_id, movie_count)
+                values (?, ?, 0)""", [each[:2] for each in pairs])
+        self.__conn.executemany("""update v1_celebrity_costar_map
+                set movie_count = movie_count + ?
+                where celebrity_douban_id = ? and costar_douban_id = ?""", \
+                [(count, celebrity, costar) \
+                 for celebrity, costar, count in pairs])
+        self.__conn.execute(self.__insertions['v1_watermark_info'], \
+                            ('costars', last_rowid))
+        logging.info("Sqlite3Host: %d co-star pairs refreshed." % len(pairs))
+
+    def movie_cast(self, movie_douban_id, offset = 0, limit = 50):
+        """
+        Sqlite3Host.movie_cast(self, movie_douban_id, offset = 0,
+                               limit = 50) -> list of dict
+
+        Return a page of celebrities of a movie, with keys douban_id,
+        name and profession. Directors go first, then scriptwriters and
+        actors, each in order of movie page. Name is None for a
+        celebrity not fetched yet.
+
+        Like other reads below, rows still buffered in batch mode are
+        not seen.
+        """
+        if self.__conn is None:
+            raise DatabaseNotStartedException()
+        query = """select celebrity_douban_id, %s, profession
+                   from v1_movie_profession_map
+                   where movie_douban_id = ?
+                   order by profession, rowid
+                   limit ? offset ?""" % \
+                (Sqlite3Host.__celebrity_name % {'id': 'celebrity_douban_id'})
+        cursor = self.__conn.execute(query, (movie_douban_id, limit, offset))
+        return [{'douban_id': douban_id,
+                 'name': name,
+                 'profession': profession} \
+                for douban_id, name, profession in cursor.fetchall()]
+
+    def movie_casts(self, movie_douban_ids, limit = 50):
+        """
+        Sqlite3Host.movie_casts(self, movie_douban_ids, limit = 50)
+            -> dict
+
+        Return first limit celebrities of each given movie in one query,
+        as a dict from movie Id to a list like movie_cast().
+        """
+        if self.__conn is None:
+            raise DatabaseNotStartedException()
+        casts = dict((each, []) for each in movie_douban_ids)
+        if len(casts) == 0:
+            return casts
+        query = """select movie_douban_id, celebrity_douban_id, %s,
+                          profession
+                   from v1_movie_profession_map
+                   where movie_douban_id in (%s)
+                   order by movie_douban_id, profession, rowid""" % \
+                (Sqlite3Host.__celebrity_name % {'id': 'celebrity_douban_id'}, \
+                 ", ".join("?" * len(casts)))
+        cursor = self.__conn.execute(query, list(casts.keys()))
+        for movie_id, douban_id, name, profession in cursor.fetchall():
+            cast = casts[movie_id]
+            if len(cast) < limit:
+                cast.append({'douban_id': douban_id,
+                             'name': name,
+                             'profession': profession})
+        return casts
+
+    def latest_movies(self, offset = 0, limit = 50):
+        """
+        Sqlite3Host.latest_movies(self, offset = 0, limit = 50)
+            -> list of dict
+
+        Return a page of saved movies, last saved first, with keys
+        douban_id, title, year and region.
+        """
+        if self.__conn is None:
+            raise DatabaseNotStartedException()
+        query = """select douban_id, title, year, region from v1_movie_info
+                   order by rowid desc limit ? offset ?"""
+        cursor = self.__conn.execute(query, (limit, offset))
+        return [{'douban_id': douban_id,
+                 'title': title,
+                 'year': year,
+                 'region': region} \
+                for douban_id, title, year, region in cursor.fetchall()]
+
+    def celebrity_filmography(self, celebrity_douban_id, offset = 0, \
+                              limit = 50):
+        """
+        Sqlite3Host.celebrity_filmography(self, celebrity_douban_id,
+                                          offset = 0, limit = 50)
+            -> list of dict
+
+        Return a page of saved movies of a celebrity, latest first, with
+        keys douban_id, title, year and profession. A movie appears once
+        for each profession of the celebrity in it.
+        """
+        if self.__conn is None:
+            raise DatabaseNotStartedException()
+        query = """select m.movie_douban_id, i.title, i.year, m.profession
+                   from v1_movie_profession_map m
+                   join v1_movie_info i on i.douban_id = m.movie_douban_id
+                   where m.celebrity_douban_id = ?
+                   order by i.year desc, m.movie_douban_id, m.profession
+                   limit ? offset ?"""
+        cursor = self.__conn.execute(query, \
+                                     (celebrity_douban_id, limit, offset))
+        return [{'douban_id': douban_id,
+                 'title': title,
+                 'year': year,
+                 'profession': profession} \
+                for douban_id, title, year, profession in cursor.fetchall()]
+
+    def celebrity_costars(self, celebrity_douban_id, offset = 0, limit = 50):
+        """
+        Sqlite3Host.celebrity_costars(self, celebrity_douban_id,
+                                      offset = 0, limit = 50)
+            -> list of dict
+
+        Return a page of celebrities sharing movies with a celebrity,
+        with keys douban_id, name and movie_count, most shared first.
+
+        It reads co-stars table if costars is True in __init__(), or
+        joins profession table with itself otherwise, which takes time
+        proportional to all casts of the celebrity's movies.
+        """
+        if self.__conn is None:
+            raise DatabaseNotStartedException()
+        if self.__costars:
+            costars = """select costar_douban_id, movie_count
+                         from v1_celebrity_costar_map
+                         where celebrity_douban_id = :id
+                         order by movie_count desc, costar_douban_id
+                         limit :limit offset :offset"""
+        else:
+            costars = """select b.celebrity_douban_id as costar_douban_id,
+                                count(distinct b.movie_douban_id)
+                                    as movie_count
+                         from v1_movie_profession_map a
+                         join v1_movie_profession_map b
+                         on b.movie_douban_id = a.movie_douban_id and
+                            b.celebrity_douban_id != a.celebrity_douban_id
+                         where a.celebrity_douban_id = :id
+                         group by b.celebrity_douban_id
+                         order by movie_count desc, costar_douban_id
+                         limit :limit offset :offset"""
+        query = """select costar_douban_id, %s, movie_count from (%s)
+                   order by movie_count desc, costar_douban_id""" % \
+                (Sqlite3Host.__celebrity_name % {'id': 'costar_douban_id'}, \
+                 costars)
+        cursor = self.__conn.execute(query, {'id': celebrity_douban_id, \
+                                             'limit': limit, \
+                                             'offset': offset})
+        return [{'douban_id': douban_id,
+                 'name': name,
+                 'movie_count': movie_count} \
+                for douban_id, name, movie_count in cursor.fetchall()]
+
     def __create_table(self):
+        version = self.__conn.execute("pragma user_version").fetchone()[0]
         tables = Sqlite3Host.__table_params.keys()
         query = '''select :table_name from sqlite_master where
                    type='table' and name=:table_name'''
-        for each_table in tables:
-            cur = self.__conn.execute(query, {'table_name': each_table})
-            if cur.fetchone() is None: # A table does not exist
-                logging.info("Create table %s." % each_table)
-                create = Sqlite3Host.__table_creations[each_table]
-                self.__conn.execute(create)
-            else:
-                logging.info("Table %s exists. Use it." % each_table)
-        self.__conn.commit()
+        # Run schema changes in one explicit transaction, so a database
+        # is never left half migrated. It takes write lock first, so
+        # processes starting at once wait for each other, rather than
+        # fail on upgrading their read locks.
+        isolation_level = self.__conn.isolation_level
+        self.__conn.isolation_level = None
+        try:
+            self.__conn.execute("begin immediate")
+            for each_table in tables:
+                cur = self.__conn.execute(query, {'table_name': each_table})
+                if cur.fetchone() is None: # A table does not exist
+                    logging.info("Create table %s." % each_table)
+                    create = Sqlite3Host.__table_creations[each_table]
+                    self.__conn.execute(create)
+                elif version < 2:
+                    self.__migrate_table_from_v1(each_table)
+                else:
+                    logging.info("Table %s exists. Use it." % each_table)
+                if version < 3 and \
+                        each_table in Sqlite3Host.__change_tables:
+                    self.__migrate_table_to_v3(each_table)
+            for each_index in Sqlite3Host.__index_creations:
+                self.__conn.execute(each_index)
+            self.__conn.execute("pragma user_version = %d" % \
+                                Sqlite3Host.SCHEMA_VERSION)
+            self.__conn.execute("commit")
+        except:
+            self.__conn.execute("rollback")
+            raise
+        finally:
+            self.__conn.isolation_level = isolation_level
         # Now all tables are created
 
+    def __migrate_table_from_v1(self, table):
+        """
+        Move rows of a version 1 table to a new table with primary key.
+        Duplicated rows are merged, and the last saved one wins.
+        """
+        logging.info("Migrate table %s to schema version %d." % \
+                (table, Sqlite3Host.SCHEMA_VERSION))
+        old_table = "%s_v1" % table
+        self.__conn.execute("alter table %s rename to %s" % (table, old_table))
+        self.__conn.execute(Sqlite3Host.__table_creations[table])
+        params = Sqlite3Host.__table_params[table]
+        columns = list(params)
+        if table == 'v1_celebrity_info':
+            # Version 1 inserts values by position, in order of params,
+            # while the table was created with place_of_birth and
+            # day_of_death swapped. Swap them back.
+            columns[params.index('day_of_death')] = 'place_of_birth'
+            columns[params.index('place_of_birth')] = 'day_of_death'
+        keys = Sqlite3Host.__table_keys[table]
+        if len(keys) == len(params):
+            insertion = "insert or ignore"
+        else:
+            insertion = "insert or replace"
+        self.__conn.execute("%s into %s (%s) select %s from %s order by rowid" \
+                % (insertion, table, ", ".join(params), \
+                   ", ".join(columns), old_table))
+        self.__conn.execute("drop table %s" % old_table)
+
+    def __migrate_table_to_v3(self, table):
+        """
+        Add change sequence to a table. Existing rows take their rowid,
+        which exports of version 2 used as watermark.
+        """
+        columns = [each[1] for each in \
+                   self.__conn.execute("pragma table_info(%s)" % table)]
+        if 'change_seq' not in columns:
+            self.__conn.execute("alter table %s add column change_seq " \
+                                "integer" % table)
+        self.__conn.execute("update %s set change_seq = rowid " \
+                            "where change_seq is null" % table)
+
 class Spider(object):
     """
     Main entry for fetching data from remote URL and save data to
     database.
     """
-    def __init__(self, db_host, max_movies = 0, fetch_gap_in_secs = 2):
-        # The pending items tracks all known URLs that hasn't been
-        # downloaded. When the fetching is done, the pending list is
-        # written to database.
+    def __init__(self, db_host, max_movies = 0, fetch_gap_in_secs = 2, \
+                 fetch_workers = 1, rate_limiter = None, \
+                 frontier_strategy = "fifo", recrawl = False, \
+                 coordinator = None):
+        """
+        Spider.__init__(self, db_host, max_movies = 0,
+                        fetch_gap_in_secs = 2, fetch_workers = 1,
+                        rate_limiter = None, frontier_strategy = "fifo",
+                        recrawl = False, coordinator = None)
+
+        Create a spider writing to db_host. When fetch_workers is larger
+        than 1, movies are fetched by a pool of fetch threads, while the
+        background thread keeps the only access to db_host.
+
+        If a :HostRateLimiter: is given, it throttles every page
+        request, including celebrities, and replaces the fixed fetch gap.
+
+        The frontier_strategy decides which movie is fetched next. See
+        :CrawlFrontier: for choices.
+
+        If recrawl is True, saved movies due for a revisit are fetched
+        again, most overdue first, and so are due celebrities appearing
+        in them. Related movies not seen before are crawled as usual.
+        It needs a :Sqlite3Host: tracking freshness, which doesn't write
+        records found unchanged.
+
+        If a :SpoolCoordinator: is given, the spider crawls one shard of
+        a crawl split across processes. It fetches only movies its shard
+        owns, and forwards others to their shards. When its frontier is
+        empty, it waits for movies from other shards until all of them
+        are done.
+
+        Gauges of frontier go to metrics installed by set_metrics().
+        """
+        # The frontier tracks all known movies that haven't been
+        # downloaded, and everything downloaded. It's kept in database
+        # as we go, so a new run continues where the last one stops.
+        # The index counts what's done in this run.
+        self.__frontier = CrawlFrontier(db_host, frontier_strategy)
+        self.__celebrities = CelebrityCache(db_host)
+        self.__seeds = []
         self.__index = {
-            'movies': [],
-            'parsed_movies': set(),
-            "parsed_celebrities": set()
+            'parsed_movies': 0,
+            "parsed_celebrities": 0,
+            # Movies missing from page cache in offline mode. They are
+            # not retried in this run, but stay pending in database.
+            "uncached_movies": 0
         }
         self.__db_host = db_host
         self.__stop_sign = threading.Condition()
         self.__started = False
         self.__background = threading.Thread(target=self.__worker_thread)
-        self.__fetch_gap = fetch_gap_in_secs
+        self.__rate_limiter = rate_limiter
+        if rate_limiter is not None:
+            # Rate limiter decides when to fetch. No fixed gap needed.
+            self.__fetch_gap = 0
+        else:
+            self.__fetch_gap = fetch_gap_in_secs
         self.__max_movies = max_movies
+        self.__recrawl = recrawl
+        self.__coordinator = coordinator
         self.__complete_callbacks = []
+        # Used by concurrent mode only. Fetch threads post results to
+        # __fetched_movies under __stop_sign, and watch __halt_sign so
+        # they can give up quickly when caller asks us to stop.
+        self.__fetch_workers = max(1, fetch_workers)
+        self.__fetched_movies = []
+        self.__halt_sign = threading.Event()
+        _metrics.gauge("frontier.pending", self.__frontier.pending_count)
+        _metrics.gauge("frontier.done", self.__frontier.done_movie_count)
 
     def set_movie_seed(self, seed_movie_douban_id):
-        self.__index["movies"].append(seed_movie_douban_id)
+        self.__seeds.append(seed_movie_douban_id)
 
     def set_complete_callback(self, complete_callback):
         self.__stop_sign.acquire()
@@ -941,6 +2449,7 @@ class Spider(object):
             # No need to stop twice.
             return
         self.__stop_sign.acquire()
+        self.__halt_sign.clear()
         self.__background.start()
         self.__started = True
         self.__stop_sign.release()
@@ -957,6 +2466,9 @@ class Spider(object):
             logging.warn("Already stopped. No need to do it twice.")
             return
         logging.info("Calling spider.stop().")
+        # Halt sign is checked without lock, so worker can stop even if
+        # it never waits on stop sign.
+        self.__halt_sign.set()
         self.__stop_sign.acquire() # Post a condition so they know
         logging.info("Lock acquired. Update status.")
         self.__started = False
@@ -966,12 +2478,20 @@ class Spider(object):
     def __worker_init_database(self):
         try:
             self.__db_host.start()
-            # Load pending items from last fetch.
-            # NOTE: We don't keep tracking parsed items from last fetch.
-            self.__index["movies"] += \
-                    self.__db_host.load_partial_movie_ids()
-            self.__index["parsed_movies"] = set([])
-            self.__index["parsed_celebrities"] = set([])
+            # Load pending and parsed items from last fetch. Seeds
+            # already known are skipped.
+            self.__frontier.load()
+            if self.__coordinator is not None:
+                self.__coordinator.start()
+            self.__frontier.extend(self.__route(self.__seeds))
+            self.__celebrities.load()
+            if self.__recrawl:
+                now = time.time()
+                revisits = self.__frontier.revisit( \
+                        self.__db_host.due_movie_ids(now))
+                self.__celebrities.revisit( \
+                        self.__db_host.due_celebrity_ids(now))
+                logging.info("Worker: %d movies due for revisit.", revisits)
             logging.info("Database initialized successfully.")
         except Exception as e:
             logging.error("FATAL: Database is wrong. Can't continue.")
@@ -980,11 +2500,16 @@ class Spider(object):
 
     def __worker_main_loop(self):
         success = True
-        while len(self.__index["movies"]) != 0:
+        while self.__frontier.pending_count() != 0 or \
+                self.__wait_forwarded():
             try:
+                self.__receive_forwarded()
                 # After every fetch, wait for 2 secs so caller can stop.
-                self.__stop_sign.wait(self.__fetch_gap)
-                if self.__started is False:
+                if self.__fetch_gap > 0:
+                    begin = _metrics.clock()
+                    self.__stop_sign.wait(self.__fetch_gap)
+                    _metrics.observe("spider.gap_wait", begin)
+                if self.__started is False or self.__halt_sign.is_set():
                     # OK if somebody asks us to stop. Save all pending list
                     # and exit.
                     logging.info("Called for stop. Exit.")
@@ -992,7 +2517,7 @@ class Spider(object):
                 else:
                     logging.info("Continue...")
                     if self.__max_movies > 0:
-                        parsed_movies = len(self.__index["parsed_movies"])
+                        parsed_movies = self.__index["parsed_movies"]
                         if self.__max_movies == parsed_movies:
                             logging.info("Worker: Movie limit reached. Stop.")
                             break
@@ -1000,54 +2525,43 @@ class Spider(object):
                     # so caller can't stop it at this moment. This is to
                     # make sure a fetch can't be interrupted.
 
-                    # Always insert from last but get from first, so
-                    # it's a queue, indeed.
-                    new_movie_id = self.__index["movies"][0]
-                    del self.__index["movies"][0]
+                    new_movie_id = self.__frontier.pop()
+                    if new_movie_id is None:
+                        # Only failed movies are pending. Wait for their
+                        # retry.
+                        self.__stop_sign.wait( \
+                                self.__frontier.retry_wait_secs())
+                        continue
+                    begin = _metrics.clock()
                     # NOTE: With a known issue, the URL fetching may
                     # result in an exception.
                     try:
                         new_movie = Movie(new_movie_id, \
                                           fetch_on_init = True)
+                    except CacheMissException as e:
+                        logging.warn("Movie %s not in cache. Skip.", \
+                                     new_movie_id)
+                        self.__index["uncached_movies"] += 1
+                        continue
                     except Exception as e:
-                        logging.error("Movie %s fails. Add to end." % \
-                                new_movie_id)
-                        self.__index["movies"].append(new_movie_id)
-                        # No need to try this movie again. Keep it
-                        # in list and try it later.
+                        logging.error("Movie %s fails: %r", new_movie_id, e)
+                        _metrics.count("spider.failures")
+                        # Keep it in list and try it after a delay,
+                        # unless it fails too many times.
+                        if self.__frontier.fail(new_movie_id):
+                            logging.info("Movie %s will be retried.", \
+                                         new_movie_id)
+                        else:
+                            logging.error("Movie %s is dropped until next "
+                                          "run.", new_movie_id)
                         continue
-                    logging.info("Movie %s fetched." % new_movie_id)
-                    logging.info("Keep related movies.")
-                    for each_related_movie in new_movie.related_movies():
-                        each_movie_id = each_related_movie.douban_id()
-                        if each_movie_id not in \
-                                self.__index["parsed_movies"]:
-                            # The item is not retrived. Add to list.
-                            self.__index["movies"].append(each_movie_id)
-                    logging.info("Keep celebrities.")
-                    # Besides saving movie information, we also need to
-                    # save celebrities indepdently
-                    for each_celebrity in new_movie.celebrities():
-                        # If may fail because douban may have no
-                        # information either.
-                        try:
-                            each_celebrity.fetch()
-                        except Exception as e:
-                            logging.error("Fails on fetching celebrity.")
-                            # It means an character is not correctly
-                            # parsed.
-                            # Keep the celebrity into unresolved list.
-                        each_id = each_celebrity.douban_id()
-                        if each_id not in \
-                                self.__index["parsed_celebrities"]:
-                            self.__db_host.save(each_celebrity)
-                            self.__index["parsed_celebrities"].add(each_id)
-                    # Movie must be save AFTER celebrities because the
-                    # path of celebrities can be updated on fetch().
-                    self.__db_host.save(new_movie)
-                    logging.info("Movie: %s saved" % new_movie_id)
-                    self.__index["parsed_movies"].add(\
-                            new_movie.douban_id())
+                    logging.info("Movie %s fetched.", new_movie_id)
+                    if not self.__fetch_celebrities(new_movie):
+                        # Interrupted. It stays partial.
+                        self.__frontier.retry(new_movie_id)
+                        break
+                    _metrics.observe("spider.movie", begin)
+                    self.__keep_movie(new_movie)
 
             except Exception as e:
                 import traceback
@@ -1060,26 +2574,293 @@ class Spider(object):
             logging.error("Worker: Main loop completes with errors.")
         return success
 
+    def __worker_concurrent_loop(self):
+        """
+        Concurrent version of __worker_main_loop(). Movie IDs are handed
+        to a pool of fetch threads, and fetched movies come back to this
+        thread, which is the only one allowed to touch database.
+        """
+        success = True
+        tasks = Q.Queue()
+        in_flight = set()
+        fetchers = []
+        for i in range(self.__fetch_workers):
+            fetcher = threading.Thread(target=self.__fetcher_thread, \
+                                       args=(tasks, ))
+            fetcher.daemon = True
+            fetcher.start()
+            fetchers.append(fetcher)
+        logging.info("Worker: %d fetchers started." % len(fetchers))
+        while True:
+            try:
+                self.__receive_forwarded()
+                # Keep every fetcher busy, unless we are asked to stop
+                # or movie limit is about to be reached.
+                while not self.__halt_sign.is_set() and \
+                        len(in_flight) < self.__fetch_workers and \
+                        self.__frontier.pending_count() != 0:
+                    if self.__max_movies > 0:
+                        scheduled = self.__index["parsed_movies"] + \
+                                    len(in_flight)
+                        if scheduled >= self.__max_movies:
+                            break
+                    # Frontier never gives a movie twice, unless it's
+                    # retried after it comes back.
+                    new_movie_id = self.__frontier.pop()
+                    if new_movie_id is None:
+                        # Only failed movies waiting for retry.
+                        break
+                    in_flight.add(new_movie_id)
+                    tasks.put((new_movie_id, _metrics.clock()))
+                if len(in_flight) == 0:
+                    # Nothing is fetching and nothing can be scheduled.
+                    # Movies left in frontier wait for next run, as we
+                    # are asked to stop or limit is reached, unless they
+                    # wait for a retry. Otherwise other shards may still
+                    # forward some.
+                    if self.__halt_sign.is_set() or \
+                            self.__limit_reached():
+                        break
+                    if self.__frontier.pending_count() != 0:
+                        self.__stop_sign.wait( \
+                                self.__frontier.retry_wait_secs())
+                    elif not self.__wait_forwarded():
+                        break
+                    continue
+                # Fetchers notify us when a movie comes back. It also
+                # releases stop sign so caller can stop us.
+                if len(self.__fetched_movies) == 0:
+                    begin = _metrics.clock()
+                    self.__stop_sign.wait(self.__fetch_gap + 1)
+                    _metrics.observe("spider.idle_wait", begin)
+                    self.__db_host.flush_if_due()
+                fetched = self.__fetched_movies
+                self.__fetched_movies = []
+                for (movie_id, new_movie, retry, posted) in fetched:
+                    # Time a fetched movie waits for this thread.
+                    _metrics.observe("spider.result_wait", posted)
+                    in_flight.discard(movie_id)
+                    if not retry:
+                        self.__index["uncached_movies"] += 1
+                    elif new_movie is None:
+                        # Either failed or interrupted. Keep it in list
+                        # and try it later. It stays partial anyway.
+                        if self.__halt_sign.is_set():
+                            self.__frontier.retry(movie_id)
+                        elif self.__frontier.fail(movie_id):
+                            logging.info("Movie %s will be retried.", \
+                                         movie_id)
+                        else:
+                            logging.error("Movie %s is dropped until next "
+                                          "run.", movie_id)
+                    else:
+                        self.__keep_movie(new_movie)
+            except Exception as e:
+                import traceback
+                tb = traceback.format_exc()
+                logging.error("FATAL: Exception from worker: %s (recovered)" % tb)
+                success = False
+        for each in fetchers:
+            tasks.put(None)
+        if success:
+            logging.info("Worker: Concurrent loop completes.")
+        else:
+            logging.error("Worker: Concurrent loop completes with errors.")
+        return success
+
+    def __fetcher_thread(self, tasks):
+        while True:
+            task = tasks.get()
+            if task is None:
+                break
+            movie_id, queued = task
+            _metrics.observe("spider.queue_wait", queued)
+            new_movie = None
+            retry = True
+            # Keep the fetch gap per fetcher. Waiting on halt sign lets
+            # us skip the fetch as soon as caller asks for stop.
+            if self.__fetch_gap > 0:
+                begin = _metrics.clock()
+                self.__halt_sign.wait(self.__fetch_gap)
+                _metrics.observe("spider.gap_wait", begin)
+            if not self.__halt_sign.is_set():
+                begin = _metrics.clock()
+                try:
+                    new_movie = Movie(movie_id, fetch_on_init = True)
+                    logging.info("Movie %s fetched.", movie_id)
+                    if not self.__fetch_celebrities(new_movie):
+                        new_movie = None
+                    else:
+                        _metrics.observe("spider.movie", begin)
+                except CacheMissException as e:
+                    logging.warn("Movie %s not in cache. Skip.", movie_id)
+                    new_movie = None
+                    retry = False
+                except Exception as e:
+                    logging.error("Movie %s fails: %r", movie_id, e)
+                    _metrics.count("spider.failures")
+                    new_movie = None
+            self.__stop_sign.acquire()
+            self.__fetched_movies.append((movie_id, new_movie, retry, \
+                                          _metrics.clock()))
+            self.__stop_sign.notify()
+            self.__stop_sign.release()
+        logging.info("Fetcher: Complete. Bye.")
+
+    def __fetch_celebrities(self, new_movie):
+        """
+        Fetch details of all celebrities from given movie. Return False
+        if fetching is interrupted by halt sign.
+        """
+        for each_celebrity in new_movie.celebrities():
+            if self.__halt_sign.is_set():
+                logging.info("Movie %s interrupted.", new_movie.douban_id())
+                return False
+            if not self.__celebrities.resolve(each_celebrity):
+                # Saved by an earlier run, or fetched for another movie.
+                continue
+            # If may fail because douban may have no
+            # information either.
+            celebrity_id = each_celebrity.douban_id()
+            failed = False
+            try:
+                each_celebrity.fetch()
+            except Exception as e:
+                logging.error("Fails on fetching celebrity.")
+                _metrics.count("spider.celebrity_failures")
+                # It means an character is not correctly
+                # parsed.
+                # Keep the celebrity into unresolved list.
+                failed = True
+            self.__celebrities.fetched(each_celebrity, celebrity_id, failed)
+        return True
+
+    def __keep_movie(self, new_movie):
+        """
+        Save a fetched movie and its celebrities, and keep related
+        movies in pending list. Must be called from background thread.
+        """
+        new_movie_id = new_movie.douban_id()
+        begin = _metrics.clock()
+        logging.info("Keep celebrities.")
+        # Besides saving movie information, we also need to
+        # save celebrities indepdently
+        # Only the celebrity object fetching a celebrity saves it. Other
+        # movies just refer it by Id.
+        self.__celebrities.save_aliases()
+        saved_celebrities = []
+        for each_celebrity in new_movie.celebrities():
+            if self.__celebrities.owns(each_celebrity):
+                self.__db_host.save(each_celebrity)
+                self.__celebrities.saved(each_celebrity)
+                saved_celebrities.append(each_celebrity.douban_id())
+        unseen_celebrities = len(saved_celebrities)
+        self.__index["parsed_celebrities"] += unseen_celebrities
+        if self.__coordinator is not None:
+            self.__coordinator.announce_celebrities(saved_celebrities)
+        logging.info("Keep related movies.")
+        # Frontier drops movies already known.
+        related_movie_ids = self.__route(new_movie.related_movie_ids())
+        self.__frontier.extend(related_movie_ids, \
+                               referrer = new_movie_id, \
+                               unseen_celebrities = unseen_celebrities)
+        # Movie must be save AFTER celebrities because the
+        # path of celebrities can be updated on fetch().
+        self.__db_host.save(new_movie)
+        logging.info("Movie: %s saved", new_movie_id)
+        self.__frontier.movie_done(new_movie_id)
+        self.__index["parsed_movies"] += 1
+        _metrics.observe("spider.keep", begin)
+        _metrics.count("spider.movies")
+        _metrics.count("spider.celebrities", unseen_celebrities)
+
+    def __route(self, movie_ids):
+        """
+        Return movies of our shard, and forward others to their shards.
+        """
+        if self.__coordinator is None:
+            return movie_ids
+        return self.__coordinator.route(movie_ids)
+
+    def __receive_forwarded(self, force = False):
+        """
+        Queue movies forwarded by other shards, and skip celebrities
+        they have saved. Inbox is read every poll interval of
+        coordinator, or now if force is True.
+        """
+        if self.__coordinator is None:
+            return
+        movie_ids, celebrity_ids = self.__coordinator.receive(force)
+        self.__celebrities.mark_saved(celebrity_ids)
+        if len(movie_ids) > 0:
+            queued = self.__frontier.extend(movie_ids)
+            _metrics.count("shard.received", queued)
+            # Forwarded movies are kept by this shard from now on.
+            self.__db_host.commit()
+        self.__coordinator.acknowledge()
+
+    def __limit_reached(self):
+        return self.__max_movies > 0 and \
+               self.__index["parsed_movies"] >= self.__max_movies
+
+    def __wait_forwarded(self):
+        """
+        Wait for movies from other shards, when frontier is empty.
+        Return True if some are queued, or False if all shards are
+        done, limit is reached, or we are asked to stop.
+        """
+        if self.__coordinator is None or self.__limit_reached():
+            return False
+        self.__coordinator.idle()
+        while not self.__halt_sign.is_set():
+            begin = _metrics.clock()
+            self.__stop_sign.wait(self.__coordinator.poll_secs())
+            _metrics.observe("spider.shard_wait", begin)
+            self.__db_host.flush_if_due()
+            self.__receive_forwarded(force = True)
+            if self.__frontier.pending_count() != 0:
+                self.__coordinator.busy()
+                return True
+            if self.__coordinator.is_done():
+                logging.info("Worker: All shards are done.")
+                return False
+        return False
+
     def __worker_save_pending_items(self):
         try:
-            # We have fetched all movies and celebrities. Stop.
-            pending_movies = len(self.__index["movies"])
-            parsed_movies = len(self.__index["parsed_movies"])
-            parsed_celebrities = len(self.__index["parsed_celebrities"])
+            # We have fetched all movies and celebrities. Stop. Pending
+            # movies are saved by frontier already, just commit them.
+            pending_movies = self.__frontier.pending_count() + \
+                             self.__frontier.dropped_movie_count() + \
+                             self.__index["uncached_movies"]
+            parsed_movies = self.__index["parsed_movies"]
+            parsed_celebrities = self.__index["parsed_celebrities"]
             logging.info("Worker: %d movies parsed." % parsed_movies)
             logging.info("Worker: %d celebrities parsed." % (parsed_celebrities))
+            logging.info("Worker: Celebrity cache: %s" % \
+                    self.__celebrities.stats())
             if pending_movies > 0:
                 logging.info("Worker: %d movies pending." % (pending_movies))
-                # Remove duplcations, but order may change.
-                dedup_ids = list(set(self.__index["movies"]))
-                logging.info("Worker: Dedup: %d IDs left." % len(dedup_ids))
-                saved_movies = [Movie(each) for each in dedup_ids]
-                self.__db_host.save_list(saved_movies)
+            self.__celebrities.save_aliases()
+            self.__db_host.commit()
+            if self.__coordinator is not None:
+                # Send movies still waiting in outbox.
+                self.__coordinator.stop()
+            if self.__recrawl:
+                logging.info("Worker: Freshness: %s" % \
+                        self.__db_host.freshness_stats())
             logging.info("Pending items saved to disk.")
         except Exception as e:
             logging.error("Failure when saving pending items.")
             return False
         return True
+    def __worker_stop_database(self):
+        # Write everything still buffered by database.
+        try:
+            self.__db_host.stop()
+        except Exception as e:
+            logging.error("Failure when stopping database.")
+
     def __invoke_callback(self):
         try:
             for each_callback in self.__complete_callbacks:
@@ -1094,13 +2875,22 @@ class Spider(object):
         self.__stop_sign.acquire()
         self.__started = True
         logging.info("Worker: lock acquired. Start working.")
+        if self.__rate_limiter is not None:
+            set_rate_limiter(self.__rate_limiter)
         try:
             if not self.__worker_init_database():
                 return
             # Data base is initialized. Enter main loop.
-            self.__worker_main_loop()
+            if self.__fetch_workers > 1:
+                self.__worker_concurrent_loop()
+            else:
+                self.__worker_main_loop()
             self.__worker_save_pending_items()
         finally:
+            self.__worker_stop_database()
+            if self.__rate_limiter is not None:
+                for host, stats in self.__rate_limiter.stats().items():
+                    logging.info("Worker: Rate of %s: %s" % (host, stats))
             self.__invoke_callback()
             self.__started = False
             self.__stop_sign.release()
@@ -1130,12 +2920,131 @@ if __name__ == '__main__':
                         '--maxmovies', \
                         default="15", \
                         help="Maximum movies to be parsed. 0 means unlimited.")
+    parser.add_argument('-w',\
+                        '--workers', \
+                        default="1", \
+                        help="Number of concurrent fetch workers.")
+    parser.add_argument('-r',\
+                        '--rate', \
+                        default="0", \
+                        help="Requests per second to each host. "
+                             "0 means a fixed gap between movies.")
+    parser.add_argument('-b',\
+                        '--burst', \
+                        default="1", \
+                        help="Requests allowed at once to each host.")
+    parser.add_argument('-o',\
+                        '--order', \
+                        default="fifo", \
+                        choices=CrawlFrontier.STRATEGIES, \
+                        help="Order of fetching movies.")
+    parser.add_argument('-c',\
+                        '--cachedir', \
+                        default="", \
+                        help="Directory of page cache. Empty means no cache.")
+    parser.add_argument('--cachesize', \
+                        default="0", \
+                        help="Maximum size of page cache in MB. 0 means unlimited.")
+    parser.add_argument('--cachettl', \
+                        default="30", \
+                        help="Days before a cached page is evicted.")
+    parser.add_argument('--offline', \
+                        action="store_true", \
+                        help="Read pages from page cache only.")
+    parser.add_argument('-P',\
+                        '--parsers', \
+                        default="0", \
+                        help="Number of parse processes. 0 means pages "
+                             "are parsed in fetch threads.")
+    parser.add_argument('--fullparse', \
+                        action="store_true", \
+                        help="Parse whole movie pages, not only regions "
+                             "needed.")
+    parser.add_argument('--stream', \
+                        action="store_true", \
+                        help="Parse movie pages while they download, and "
+                             "stop after recommendations. Not used with "
+                             "parse processes.")
+    parser.add_argument('--costars', \
+                        action="store_true", \
+                        help="Keep a co-stars table for read queries.")
+    parser.add_argument('--freshness', \
+                        action="store_true", \
+                        help="Keep hashes and revisit times of saved "
+                             "records, and skip writing unchanged ones.")
+    parser.add_argument('--recrawl', \
+                        action="store_true", \
+                        help="Fetch saved movies due for a revisit first. "
+                             "Implies --freshness.")
+    parser.add_argument('--minrevisit', \
+                        default="1", \
+                        help="Minimum days between two visits of a record.")
+    parser.add_argument('--maxrevisit', \
+                        default="90", \
+                        help="Maximum days between two visits of a record.")
+    parser.add_argument('--shards', \
+                        default="1", \
+                        help="Number of shards of a crawl split across "
+                             "processes. Each one needs its own database.")
+    parser.add_argument('--shard', \
+                        default="0", \
+                        help="Index of shard crawled by this process, "
+                             "from 0.")
+    parser.add_argument('--spool', \
+                        default="", \
+                        help="Directory shared by all shards to forward "
+                             "movies. Required by more than one shard.")
+    parser.add_argument('--batch', \
+                        default="200", \
+                        help="Rows written to database in one transaction. "
+                             "0 means a transaction per row.")
+    parser.add_argument('--flushsecs', \
+                        default="5", \
+                        help="Maximum seconds before buffered rows are written.")
+    parser.add_argument('--journal', \
+                        default="WAL", \
+                        help="SQLite journal mode.")
+    parser.add_argument('--sync', \
+                        default="NORMAL", \
+                        help="SQLite synchronous mode.")
+    parser.add_argument('--asynclog', \
+                        action="store_true", \
+                        help="Write log from a background thread.")
+    parser.add_argument('--jsonlog', \
+                        action="store_true", \
+                        help="Write log as JSON lines with crawl Id, from "
+                             "a background thread.")
+    parser.add_argument('--crawlid', \
+                        default="", \
+                        help="Crawl Id of JSON log. Empty means a new one.")
+    parser.add_argument('--lograte', \
+                        default="0", \
+                        help="Info records kept per second of each message "
+                             "in background log. 0 means all.")
+    parser.add_argument('--metricsport', \
+                        default="0", \
+                        help="Local port serving crawl metrics as JSON. "
+                             "0 means no server.")
+    parser.add_argument('--metricsdump', \
+                        default="", \
+                        help="File to append crawl metrics to, one JSON "
+                             "snapshot per line. Empty means no dump.")
+    parser.add_argument('--metricsinterval', \
+                        default="10", \
+                        help="Seconds between two metrics snapshots.")
 
     args = parser.parse_args()
-    formatter = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-    logging.basicConfig(filename=args.log, \
-                        format=formatter, \
-                        level=logging.INFO)
+    if args.asynclog or args.jsonlog:
+        from crawllog import start_logging
+        # Queued records are written by logging.shutdown() on exit.
+        start_logging(args.log, crawl_id = args.crawlid or None, \
+                      json_lines = args.jsonlog, \
+                      max_per_sec = float(args.lograte))
+    else:
+        formatter = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+        logging.basicConfig(filename=args.log, \
+                            format=formatter, \
+                            level=logging.INFO)
     class CompletionWaiter(object):
         def __init__(self):
             self.__condition = threading.Condition()
@@ -1167,10 +3076,65 @@ if __name__ == '__main__':
             self.__spider.stop()
             self.__waiter.wait()
             logging.info("Result saved. Exit.")
+    parse_pool = None
+    metrics_server = None
+    metrics_dumper = None
     try:
-        db = Sqlite3Host(args.db)
+        set_selective_parsing(not args.fullparse)
+        set_streaming_parsing(args.stream)
+        if int(args.parsers) > 0:
+            from pipeline import ParsePool
+            # Start processes before any thread.
+            parse_pool = ParsePool(processes = int(args.parsers), \
+                                   selective = not args.fullparse)
+            parse_pool.start()
+            set_parse_pool(parse_pool)
+        if int(args.metricsport) > 0 or args.metricsdump:
+            from metrics import MetricsRegistry, MetricsServer, \
+                                SnapshotDumper
+            registry = MetricsRegistry()
+            set_metrics(registry)
+            if int(args.metricsport) > 0:
+                metrics_server = MetricsServer(registry, \
+                                               port = int(args.metricsport))
+                metrics_server.start()
+            if args.metricsdump:
+                metrics_dumper = SnapshotDumper(registry, args.metricsdump, \
+                        interval_secs = float(args.metricsinterval))
+                metrics_dumper.start()
+        if args.cachedir:
+            set_page_cache(PageCache(args.cachedir, \
+                    ttl_secs = float(args.cachettl) * 86400, \
+                    max_bytes = int(args.cachesize) * 1024 * 1024, \
+                    offline = args.offline))
+        elif args.offline:
+            raise Exception("Offline mode requires page cache.")
+        db = Sqlite3Host(args.db, batch_size = int(args.batch), \
+                         flush_interval_secs = float(args.flushsecs), \
+                         journal_mode = args.journal, \
+                         synchronous = args.sync, \
+                         costars = args.costars, \
+                         freshness = args.freshness or args.recrawl, \
+                         min_revisit_secs = float(args.minrevisit) * 86400, \
+                         max_revisit_secs = float(args.maxrevisit) * 86400)
+        coordinator = None
+        if int(args.shards) > 1:
+            if not args.spool:
+                raise Exception("Sharded crawl requires spool directory.")
+            from shard import SpoolCoordinator
+            coordinator = SpoolCoordinator(args.spool, int(args.shard), \
+                                           int(args.shards))
         maxmovies = int(args.maxmovies)
-        spider = Spider(db, max_movies = maxmovies)
+        workers = int(args.workers)
+        rate_limiter = None
+        if float(args.rate) > 0:
+            rate_limiter = HostRateLimiter(rate = float(args.rate), \
+                                           burst = int(args.burst))
+        spider = Spider(db, max_movies = maxmovies, fetch_workers = workers, \
+                        rate_limiter = rate_limiter, \
+                        frontier_strategy = args.order, \
+                        recrawl = args.recrawl, \
+                        coordinator = coordinator)
         waiter = CompletionWaiter()
         spider.set_complete_callback(waiter)
         douban_id = Movie.parse_movie_id(args.seedurl)
@@ -1178,6 +3142,13 @@ if __name__ == '__main__':
         signal.signal(signal.SIGINT, OnSignalHandle(spider, waiter))
         spider.start()
         waiter.wait()
+        if parse_pool is not None:
+            logging.info("ParsePool: %s" % parse_pool.stats())
+            parse_pool.stop()
+        if metrics_dumper is not None:
+            metrics_dumper.stop()
+        if metrics_server is not None:
+            metrics_server.stop()
         sys.exit(0)
     except Exception as e:
         tb = traceback.format_exc()
@@ -0,0 +1,427 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import os
+import sys
+import csv
+import json
+import time
+import zlib
+import struct
+import logging
+import multiprocessing
+
+# Python 2/3 compatibility hack: Import correct libraries
+ver = sys.version[0]
+if ver == '2':
+    integer_types = (int, long)
+    text_type = unicode
+elif ver == '3':
+    integer_types = (int, )
+    text_type = str
+else:
+    raise Exception("Support Python runtime version")
+
+# Tables handed to consumers of a crawl.
+EXPORT_TABLES = ('v1_movie_info',
+                 'v1_celebrity_info',
+                 'v1_movie_profession_map')
+
+class JsonLinesWriter(object):
+    """
+    Write rows as JSON objects keyed by column, one per line.
+    """
+    def __init__(self, path, table, columns):
+        self.__file = open(path, 'wb')
+        self.__columns = columns
+
+    def write(self, rows):
+        lines = [json.dumps(dict(zip(self.__columns, each)), \
+                            ensure_ascii = False, sort_keys = True) \
+                 for each in rows]
+        self.__file.write((u'\n'.join(lines) + u'\n').encode('utf-8'))
+
+    def close(self):
+        self.__file.close()
+
+class CsvWriter(object):
+    """
+    Write rows as CSV in UTF-8, after a line of column names.
+    """
+    def __init__(self, path, table, columns):
+        if ver == '2':
+            self.__file = open(path, 'wb')
+        else:
+            self.__file = open(path, 'w', encoding = 'utf-8', newline = '')
+        self.__writer = csv.writer(self.__file)
+        self.__writer.writerow(columns)
+
+    def write(self, rows):
+        if ver == '2':
+            # CSV module of Python 2 takes bytes only.
+            rows = [[each.encode('utf-8') \
+                     if isinstance(each, text_type) else each \
+                     for each in row] for row in rows]
+        self.__writer.writerows(rows)
+
+    def close(self):
+        self.__file.close()
+
+class ColumnarWriter(object):
+    """
+    Write rows in a compact binary format, column by column. It's read by
+    :ColumnarReader:, and laid out as:
+
+    - Magic bytes "DBCOL" and version 1.
+    - Length of header as 32-bit unsigned integer, and header: JSON of
+      table and columns.
+    - Blocks of rows, one per write(). A block is number of its rows,
+      then each column: a type byte, length of data, and zlib compressed
+      data. Type "i" is a byte per row, 1 for null, then 64-bit signed
+      integers. Type "s" is 32-bit signed lengths of UTF-8 text, -1 for
+      null, then the text. Type "j" is like "s", with values encoded as
+      JSON, for columns of mixed types.
+    - A block of 0 rows ends the file.
+
+    Numbers are little endian. Values of a column in a block are alike,
+    e.g. Ids or professions, so they compress well.
+    """
+    MAGIC = b'DBCOL\x01'
+
+    def __init__(self, path, table, columns):
+        self.__file = open(path, 'wb')
+        self.__columns = columns
+        header = json.dumps({'table': table, 'columns': columns}, \
+                            sort_keys = True).encode('utf-8')
+        self.__file.write(ColumnarWriter.MAGIC)
+        self.__file.write(struct.pack('<I', len(header)))
+        self.__file.write(header)
+
+    def write(self, rows):
+        if len(rows) == 0:
+            return
+        self.__file.write(struct.pack('<I', len(rows)))
+        for index in range(len(self.__columns)):
+            kind, data = ColumnarWriter.__encode([each[index] \
+                                                  for each in rows])
+            data = zlib.compress(data)
+            self.__file.write(kind)
+            self.__file.write(struct.pack('<I', len(data)))
+            self.__file.write(data)
+
+    def close(self):
+        self.__file.write(struct.pack('<I', 0))
+        self.__file.close()
+
+    @staticmethod
+    def __encode(values):
+        present = [each for each in values if each is not None]
+        if all(isinstance(each, integer_types) for each in present):
+            nulls = bytearray([each is None for each in values])
+            numbers = [0 if each is None else each for each in values]
+            return b'i', bytes(nulls) + \
+                         struct.pack('<%dq' % len(numbers), *numbers)
+        if all(isinstance(each, text_type) for each in present):
+            kind = b's'
+            texts = [None if each is None else each.encode('utf-8') \
+                     for each in values]
+        else:
+            kind = b'j'
+            texts = [None if each is None else \
+                     json.dumps(each).encode('utf-8') for each in values]
+        lengths = [-1 if each is None else len(each) for each in texts]
+        return kind, struct.pack('<%di' % len(lengths), *lengths) + \
+                     b''.join([each for each in texts if each is not None])
+
+class ColumnarReader(object):
+    """
+    Read a file of :ColumnarWriter:. Iterating it yields rows as tuples,
+    holding one block in memory at a time.
+    """
+    def __init__(self, path):
+        self.__file = open(path, 'rb')
+        if self.__file.read(len(ColumnarWriter.MAGIC)) != \
+                ColumnarWriter.MAGIC:
+            self.__file.close()
+            raise ValueError("Not a columnar export: %s" % path)
+        length = struct.unpack('<I', self.__file.read(4))[0]
+        header = json.loads(self.__file.read(length).decode('utf-8'))
+        self.__table = header['table']
+        self.__columns = header['columns']
+
+    def table(self):
+        return self.__table
+
+    def columns(self):
+        return list(self.__columns)
+
+    def blocks(self):
+        """
+        ColumnarReader.blocks(self) -> iterator of lists of rows
+        """
+        while True:
+            count = struct.unpack('<I', self.__file.read(4))[0]
+            if count == 0:
+                break
+            columns = []
+            for index in range(len(self.__columns)):
+                kind = self.__file.read(1)
+                length = struct.unpack('<I', self.__file.read(4))[0]
+                data = zlib.decompress(self.__file.read(length))
+                columns.append(ColumnarReader.__decode(kind, data, count))
+            yield list(zip(*columns))
+
+    def __iter__(self):
+        for block in self.blocks():
+            for each in block:
+                yield each
+
+    def close(self):
+        self.__file.close()
+
+    @staticmethod
+    def __decode(kind, data, count):
+        if kind == b'i':
+            nulls = bytearray(data[:count])
+            numbers = struct.unpack('<%dq' % count, data[count:])
+            return [None if nulls[i] else numbers[i] for i in range(count)]
+        lengths = struct.unpack('<%di' % count, data[:4 * count])
+        values = []
+        offset = 4 * count
+        for length in lengths:
+            if length < 0:
+                values.append(None)
+                continue
+            text = data[offset:offset + length].decode('utf-8')
+            offset += length
+            values.append(json.loads(text) if kind == b'j' else text)
+        return values
+
+# Format name to (writer, file extension).
+FORMATS = {'jsonl': (JsonLinesWriter, 'jsonl'),
+           'csv': (CsvWriter, 'csv'),
+           'columnar': (ColumnarWriter, 'dbcol')}
+
+def export_table(db_path, table, path, format = 'jsonl', after_change = 0, \
+                 until_change = None, chunk_rows = 1000):
+    """
+    export_table(db_path, table, path, format = 'jsonl', after_change = 0,
+                 until_change = None, chunk_rows = 1000) -> number of rows
+
+    Write rows of table in database of db_path to file of given path,
+    inserted or changed after change sequence after_change, and up to
+    until_change if it's given. Database is opened read only. Rows are
+    read and written chunk_rows at a time, so memory doesn't grow with
+    table. The file appears only when it's complete.
+    """
+    # Import here so an export process doesn't load douban before fork.
+    from douban import Sqlite3Host
+    writer_class = FORMATS[format][0]
+    tmp_path = "%s.%d.tmp" % (path, os.getpid())
+    db = Sqlite3Host(db_path, read_only = True)
+    db.start()
+    count = 0
+    try:
+        writer = writer_class(tmp_path, table, Sqlite3Host.columns(table))
+        try:
+            for rows in db.export_rows(table, after_change, until_change, \
+                                       chunk_rows):
+                writer.write(rows)
+                count += len(rows)
+        finally:
+            writer.close()
+        os.rename(tmp_path, path)
+    finally:
+        db.stop()
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return count
+
+def _export_task(task):
+    # Runs in export process.
+    db_path, table, path, format, after_change, until_change, \
+            chunk_rows = task
+    begin = time.time()
+    count = export_table(db_path, table, path, format, after_change, \
+                         until_change, chunk_rows)
+    return count, time.time() - begin
+
+class CrawlExporter(object):
+    """
+    Export tables of a crawl database for consumers, one file per table.
+    Database is only read, so it's safe beside a running spider.
+
+    Export with a name is incremental: it writes only rows inserted or
+    changed since last export of the same name, by change sequence of
+    :Sqlite3Host:. A changed row is exported again, and the last one of
+    a key wins. The watermark of each table is kept in a file of output
+    directory, e.g. daily.watermark.json, written after all files are
+    complete. Files of incremental exports are named by table and range
+    of change sequence, e.g. v1_movie_info.1200-3400.jsonl, so earlier
+    files are never overwritten.
+
+    Tables are exported in parallel by a pool of processes, as encoding
+    rows is bound by CPU.
+    """
+    def __init__(self, db_path, output_dir, format = 'jsonl', \
+                 tables = EXPORT_TABLES, name = None, chunk_rows = 1000, \
+                 processes = 1):
+        """
+        CrawlExporter.__init__(self, db_path, output_dir, format = 'jsonl',
+                               tables = EXPORT_TABLES, name = None,
+                               chunk_rows = 1000, processes = 1)
+
+        Format is a key of FORMATS. Processes of 1 means tables are
+        exported one by one in this process.
+        """
+        if format not in FORMATS:
+            raise ValueError("Unknown export format: %s" % format)
+        unknown = [each for each in tables if each not in EXPORT_TABLES]
+        if len(unknown) > 0:
+            raise ValueError("Not exported tables: %s" % ", ".join(unknown))
+        self.__db_path = db_path
+        self.__output_dir = output_dir
+        self.__format = format
+        self.__tables = list(tables)
+        self.__name = name
+        self.__chunk_rows = chunk_rows
+        self.__processes = max(1, processes)
+
+    def run(self):
+        """
+        CrawlExporter.run(self) -> dict of table to dict
+
+        Export all tables. Return for each table its file, or None if it
+        has no new rows, with keys path, rows, after_change, until_change
+        and secs.
+        """
+        from douban import Sqlite3Host
+        if not os.path.isdir(self.__output_dir):
+            os.makedirs(self.__output_dir)
+        extension = FORMATS[self.__format][1]
+        watermarks = {}
+        # Rows changed during export wait for next one.
+        tasks = []
+        db = Sqlite3Host(self.__db_path, read_only = True)
+        db.start()
+        try:
+            version = db.schema_version()
+            if version < Sqlite3Host.SCHEMA_VERSION:
+                raise Exception("Database %s has schema version %d. Start "
+                                "a spider on it to migrate." % \
+                                (self.__db_path, version))
+            if self.__name is not None:
+                watermarks = self.__load_watermarks(db)
+            for table in self.__tables:
+                after_change = watermarks.get(table, 0)
+                until_change = db.last_change(table)
+                if until_change <= after_change:
+                    continue
+                if self.__name is not None:
+                    name = "%s.%d-%d.%s" % (table, after_change, \
+                                            until_change, extension)
+                else:
+                    name = "%s.%s" % (table, extension)
+                tasks.append((self.__db_path, table, \
+                              os.path.join(self.__output_dir, name), \
+                              self.__format, after_change, until_change, \
+                              self.__chunk_rows))
+        finally:
+            db.stop()
+        processes = min(self.__processes, len(tasks))
+        if processes > 1:
+            pool = multiprocessing.Pool(processes)
+            try:
+                results = pool.map(_export_task, tasks)
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            results = [_export_task(each) for each in tasks]
+        result = dict((table, None) for table in self.__tables)
+        for task, (count, secs) in zip(tasks, results):
+            table, path, after_change, until_change = \
+                    task[1], task[2], task[4], task[5]
+            watermarks[table] = until_change
+            result[table] = {'path': path,
+                             'rows': count,
+                             'after_change': after_change,
+                             'until_change': until_change,
+                             'secs': secs}
+            logging.info("CrawlExporter: %d rows of %s exported to %s." \
+                    % (count, table, path))
+        if self.__name is not None and len(tasks) > 0:
+            self.__save_watermarks(watermarks)
+        return result
+
+    def __watermark_path(self):
+        return os.path.join(self.__output_dir, \
+                            "%s.watermark.json" % self.__name)
+
+    def __load_watermarks(self, db):
+        path = self.__watermark_path()
+        if os.path.exists(path):
+            with open(path) as f:
+                return json.load(f)
+        # Exports of schema version 2 kept rowid in database, which is
+        # where change sequence of migrated rows starts.
+        return dict((table, db.watermark("export:%s:%s" % \
+                                         (self.__name, table))) \
+                    for table in self.__tables)
+
+    def __save_watermarks(self, watermarks):
+        path = self.__watermark_path()
+        tmp_path = "%s.%d.tmp" % (path, os.getpid())
+        with open(tmp_path, 'w') as f:
+            json.dump(watermarks, f, sort_keys = True)
+        os.rename(tmp_path, path)
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description="""
+    Export movies, celebrities and professions of a crawl database.
+    """)
+    parser.add_argument('-d',\
+                        '--db', \
+                        default="ruuxee_douban_spider.db", \
+                        help="Path to database file.")
+    parser.add_argument('-o',\
+                        '--output', \
+                        default="ruuxee_douban_export", \
+                        help="Directory of exported files.")
+    parser.add_argument('-f',\
+                        '--format', \
+                        default="jsonl", \
+                        choices=sorted(FORMATS), \
+                        help="Format of exported files.")
+    parser.add_argument('-t',\
+                        '--tables', \
+                        default=",".join(EXPORT_TABLES), \
+                        help="Comma separated tables to export.")
+    parser.add_argument('-n',\
+                        '--name', \
+                        default="", \
+                        help="Name of an incremental export, exporting "
+                             "rows added or changed since its last run. "
+                             "Empty means all rows.")
+    parser.add_argument('-c',\
+                        '--chunk', \
+                        default="1000", \
+                        help="Rows read and written at a time.")
+    parser.add_argument('-P',\
+                        '--processes', \
+                        default="1", \
+                        help="Number of tables exported at once.")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    exporter = CrawlExporter(args.db, args.output, format = args.format, \
+                             tables = args.tables.split(","), \
+                             name = args.name or None, \
+                             chunk_rows = int(args.chunk), \
+                             processes = int(args.processes))
+    result = exporter.run()
+    for table in sorted(result):
+        if result[table] is None:
+            print("%-25s no new rows" % table)
+        else:
+            print("%-25s %8d rows %7.2fs %s" % (table, result[table]['rows'], \
+                    result[table]['secs'], result[table]['path']))
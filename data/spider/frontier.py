@@ -0,0 +1,294 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import time
+import heapq
+import logging
+import threading
+import collections
+
+class CrawlFrontier(object):
+    """
+    Movies waiting to be fetched, with all movies known to a crawl.
+    A movie Id is queued only once: Ids already queued, being
+    fetched or done are dropped on push, so the queue never holds
+    duplications.
+
+    Order of queue is decided by strategy:
+
+    - "fifo": Movies are fetched in order they are found.
+    - "depth": Movies fewer links away from seeds go first, even if they
+      are found later, e.g. by a retry or a resumed crawl.
+    - "celebrities": Movies linked from pages with more unseen
+      celebrities go first, as they are likely in a part of graph not
+      crawled yet. Ties are broken by depth.
+
+    FIFO queue is a deque. Other strategies keep a heap, where a movie
+    found again by a better link gets a new entry, and the stale one is
+    skipped when it's popped.
+
+    Frontier is kept in the database of :Sqlite3Host: with the data it
+    leads to. Queued movies are partial movies, while done movies are the
+    saved ones. They are written in the same batches, so a killed spider
+    loses no more than its unflushed batch, and never fetches a saved
+    movie again on resume. Celebrities are tracked by :CelebrityCache:.
+
+    A failed movie is queued again after a delay, doubled with each
+    failure. After max_attempts failures it's dropped for this run, and
+    stays partial in database for next run.
+    """
+    STRATEGIES = ("fifo", "depth", "celebrities")
+    MAX_ATTEMPTS = 5
+    RETRY_DELAY_SECS = 1
+    # Priority of revisits in a heap, before any movie found by a link.
+    __REVISIT_PRIORITY = (float('-inf'), )
+
+    def __init__(self, db_host, strategy = "fifo", \
+                 max_attempts = MAX_ATTEMPTS, \
+                 retry_delay_secs = RETRY_DELAY_SECS):
+        """
+        CrawlFrontier.__init__(self, db_host, strategy = "fifo",
+                               max_attempts = MAX_ATTEMPTS,
+                               retry_delay_secs = RETRY_DELAY_SECS)
+
+        Create an empty frontier persisted to db_host. Call load() to
+        resume from database. A movie failing max_attempts times is
+        dropped, and the n-th failure delays it for
+        retry_delay_secs * 2 ** (n - 1) seconds.
+        """
+        if strategy not in CrawlFrontier.STRATEGIES:
+            raise ValueError("Unknown frontier strategy: %s" % strategy)
+        self.__db_host = db_host
+        self.__strategy = strategy
+        self.__lock = threading.Lock()
+        self.__queue = collections.deque()
+        # Used by strategies other than FIFO. The heap holds entries of
+        # (priority, sequence, movie Id), and __priorities the current
+        # priority of each queued movie. Depth of a movie is kept until
+        # it's done, so its retry and its related movies know it.
+        self.__heap = []
+        self.__priorities = {}
+        self.__depths = {}
+        self.__sequence = 0
+        self.__seen_movies = set()
+        self.__done_movies = set()
+        # Failed movies waiting for a retry. The heap holds entries of
+        # (due time, sequence, movie Id), and __attempts the number of
+        # failures of each movie until it's done or dropped.
+        self.__max_attempts = max(1, max_attempts)
+        self.__retry_delay = retry_delay_secs
+        self.__delayed = []
+        self.__attempts = {}
+        self.__dropped_movies = 0
+
+    def load(self):
+        """
+        CrawlFrontier.load(self)
+
+        Load done movies and queued movies from database. It must be
+        called after db_host.start(), from the same thread.
+        """
+        done_movies = self.__db_host.load_movie_ids()
+        queued_movies = self.__db_host.load_partial_movie_ids()
+        with self.__lock:
+            self.__done_movies.update(done_movies)
+            self.__seen_movies.update(done_movies)
+            for each in queued_movies:
+                if each not in self.__seen_movies:
+                    self.__seen_movies.add(each)
+                    self.__enqueue(each, 0, 0)
+        logging.info("CrawlFrontier: %d movies queued, %d movies done." \
+                % (self.__pending(), len(self.__done_movies)))
+
+    def push(self, movie_id):
+        """
+        CrawlFrontier.push(self, movie_id) -> True if queued
+
+        Queue a movie unless it's seen before.
+        """
+        return self.extend([movie_id]) == 1
+
+    def extend(self, movie_ids, referrer = None, unseen_celebrities = 0):
+        """
+        CrawlFrontier.extend(self, movie_ids, referrer = None,
+                             unseen_celebrities = 0)
+            -> number of queued movies
+
+        Queue movies not seen before, and save them as partial movies.
+        They are committed with next write of database.
+
+        The referrer is Id of movie linking to them, and
+        unseen_celebrities is number of celebrities first seen on the
+        referrer. They are used by strategies other than FIFO. A queued
+        movie found again by a better referrer is moved forward.
+        """
+        queued = []
+        with self.__lock:
+            depth = self.__depths.get(referrer, -1) + 1
+            for each in movie_ids:
+                if each not in self.__seen_movies:
+                    self.__seen_movies.add(each)
+                    self.__enqueue(each, depth, unseen_celebrities)
+                    queued.append(each)
+                elif each in self.__priorities:
+                    self.__promote(each, depth, unseen_celebrities)
+        if len(queued) > 0:
+            self.__db_host.save_partial_movie_ids(queued, commit = False)
+        return len(queued)
+
+    def revisit(self, movie_ids):
+        """
+        CrawlFrontier.revisit(self, movie_ids) -> number of queued movies
+
+        Queue done movies again, so they are fetched anew, e.g. movies
+        due for a revisit in a re-crawl. They go before all movies
+        queued by other calls, in given order, whatever the strategy is.
+        Unlike extend(), they are not saved as partial movies, as they
+        stay saved. Movies queued or being fetched are skipped.
+        """
+        revisits = []
+        with self.__lock:
+            for each in movie_ids:
+                if each in self.__done_movies:
+                    self.__done_movies.discard(each)
+                elif each in self.__seen_movies:
+                    continue
+                self.__seen_movies.add(each)
+                revisits.append(each)
+                if self.__strategy != "fifo":
+                    self.__depths[each] = 0
+                    self.__push_heap(each, CrawlFrontier.__REVISIT_PRIORITY)
+            if self.__strategy == "fifo":
+                self.__queue.extendleft(reversed(revisits))
+        return len(revisits)
+
+    def pop(self):
+        """
+        CrawlFrontier.pop(self) -> movie Id or None if queue is empty
+
+        Take the first movie in queue. It stays seen, so it's not queued
+        again while being fetched. Call fail() if fetching fails, or
+        retry() if it's interrupted.
+
+        It's None while only failed movies are pending, before their
+        delay is over. See retry_wait_secs().
+        """
+        with self.__lock:
+            self.__requeue_due()
+            if self.__strategy == "fifo":
+                if len(self.__queue) == 0:
+                    return None
+                return self.__queue.popleft()
+            while len(self.__heap) != 0:
+                priority, sequence, movie_id = heapq.heappop(self.__heap)
+                if self.__priorities.get(movie_id) == priority:
+                    del self.__priorities[movie_id]
+                    return movie_id
+                # Stale entry of a promoted movie.
+            return None
+
+    def retry(self, movie_id):
+        """
+        CrawlFrontier.retry(self, movie_id)
+
+        Put a popped movie back to queue. It goes after queued movies of
+        the same depth, without bonus of unseen celebrities.
+        """
+        with self.__lock:
+            self.__enqueue(movie_id, self.__depths.get(movie_id, 0), 0)
+
+    def fail(self, movie_id):
+        """
+        CrawlFrontier.fail(self, movie_id) -> True if it will be retried
+
+        Put a popped movie whose fetch fails back to queue when its
+        retry delay is over, as retry() does. After max_attempts
+        failures it's dropped instead. It stays seen and partial, so
+        it's fetched by next run only.
+        """
+        with self.__lock:
+            attempts = self.__attempts.get(movie_id, 0) + 1
+            if attempts >= self.__max_attempts:
+                self.__attempts.pop(movie_id, None)
+                self.__depths.pop(movie_id, None)
+                self.__dropped_movies += 1
+                logging.warn("CrawlFrontier: Movie %s fails %d times. " \
+                             "Drop it." % (movie_id, attempts))
+                return False
+            self.__attempts[movie_id] = attempts
+            delay = self.__retry_delay * (2 ** (attempts - 1))
+            self.__sequence += 1
+            heapq.heappush(self.__delayed, \
+                           (time.time() + delay, self.__sequence, movie_id))
+            return True
+
+    def retry_wait_secs(self):
+        """
+        CrawlFrontier.retry_wait_secs(self) -> seconds or None
+
+        Time until next failed movie is queued again, or None if no
+        movie waits for a retry.
+        """
+        with self.__lock:
+            if len(self.__delayed) == 0:
+                return None
+            return max(0, self.__delayed[0][0] - time.time())
+
+    def movie_done(self, movie_id):
+        with self.__lock:
+            self.__seen_movies.add(movie_id)
+            self.__done_movies.add(movie_id)
+            self.__depths.pop(movie_id, None)
+            self.__attempts.pop(movie_id, None)
+
+    def is_movie_done(self, movie_id):
+        with self.__lock:
+            return movie_id in self.__done_movies
+
+    def pending_count(self):
+        with self.__lock:
+            return self.__pending()
+
+    def done_movie_count(self):
+        with self.__lock:
+            return len(self.__done_movies)
+
+    def dropped_movie_count(self):
+        with self.__lock:
+            return self.__dropped_movies
+
+    def __pending(self):
+        if self.__strategy == "fifo":
+            return len(self.__queue) + len(self.__delayed)
+        return len(self.__priorities) + len(self.__delayed)
+
+    def __requeue_due(self):
+        now = time.time()
+        while len(self.__delayed) != 0 and self.__delayed[0][0] <= now:
+            due, sequence, movie_id = heapq.heappop(self.__delayed)
+            self.__enqueue(movie_id, self.__depths.get(movie_id, 0), 0)
+
+    def __priority(self, depth, unseen_celebrities):
+        if self.__strategy == "depth":
+            return (depth, )
+        return (-unseen_celebrities, depth)
+
+    def __enqueue(self, movie_id, depth, unseen_celebrities):
+        if self.__strategy == "fifo":
+            self.__queue.append(movie_id)
+            return
+        self.__depths[movie_id] = depth
+        self.__push_heap(movie_id, self.__priority(depth, unseen_celebrities))
+
+    def __promote(self, movie_id, depth, unseen_celebrities):
+        if self.__strategy == "fifo":
+            return
+        priority = self.__priority(min(depth, self.__depths[movie_id]), \
+                                   unseen_celebrities)
+        if priority < self.__priorities[movie_id]:
+            self.__depths[movie_id] = min(depth, self.__depths[movie_id])
+            self.__push_heap(movie_id, priority)
+
+    def __push_heap(self, movie_id, priority):
+        self.__sequence += 1
+        self.__priorities[movie_id] = priority
+        heapq.heappush(self.__heap, (priority, self.__sequence, movie_id))
@@ -0,0 +1,321 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import os
+import sys
+import time
+import zlib
+import socket
+import logging
+import threading
+
+# Python 2/3 compatibility hack: Import correct libraries
+ver = sys.version[0]
+if ver == '2':
+    import httplib as HL
+    import urlparse as UP
+elif ver == '3':
+    import http.client as HL
+    import urllib.parse as UP
+else:
+    raise Exception("Support Python runtime version")
+
+class HttpStatusException(Exception):
+    def __init__(self, url, status):
+        Exception.__init__(self)
+        self.__url = url
+        self.__status = status
+    def url(self):
+        return self.__url
+    def status(self):
+        return self.__status
+
+class ReadBudgetException(Exception):
+    def __init__(self, url):
+        Exception.__init__(self)
+        self.__url = url
+    def url(self):
+        return self.__url
+
+class HttpResponse(object):
+    """
+    A response from :HttpConnectionPool:. Body is read on demand with
+    chunks() or body(). The connection goes back to pool only when body
+    is fully read, otherwise it's closed.
+    """
+    CHUNK_SIZE = 16384
+
+    def __init__(self, pool, key, conn, response, url, max_bytes, deadline):
+        self.__pool = pool
+        self.__key = key
+        self.__conn = conn
+        self.__response = response
+        self.__url = url
+        self.__max_bytes = max_bytes
+        self.__deadline = deadline
+        self.__received_bytes = 0
+        self.__headers = dict((name.lower(), value) \
+                              for name, value in response.getheaders())
+        encoding = self.__headers.get('content-encoding', '').lower()
+        if encoding == 'gzip':
+            self.__decoder = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        elif encoding == 'deflate':
+            self.__decoder = zlib.decompressobj()
+        else:
+            self.__decoder = None
+
+    def url(self):
+        return self.__url
+    def status(self):
+        return self.__response.status
+    def headers(self):
+        return self.__headers
+    def received_bytes(self):
+        """
+        Bytes received from wire, before decompression.
+        """
+        return self.__received_bytes
+
+    def charset(self):
+        """
+        HttpResponse.charset(self) -> charset from Content-Type or None
+        """
+        content_type = self.__headers.get('content-type', '')
+        for param in content_type.split(';')[1:]:
+            name, _, value = param.strip().partition('=')
+            if name.lower() == 'charset':
+                return value.strip('"\'')
+        return None
+
+    def chunks(self, chunk_size = CHUNK_SIZE):
+        """
+        HttpResponse.chunks(self, chunk_size = CHUNK_SIZE) -> generator
+
+        Yield decoded body as chunks of bytes, as they arrive. Raise
+        :ReadBudgetException: if body is larger than max_bytes or read
+        is not complete before deadline.
+        """
+        try:
+            while True:
+                if self.__deadline is not None and \
+                        time.time() > self.__deadline:
+                    raise ReadBudgetException(self.__url)
+                data = self.__response.read(chunk_size)
+                if not data:
+                    break
+                self.__received_bytes += len(data)
+                if self.__max_bytes is not None and \
+                        self.__received_bytes > self.__max_bytes:
+                    raise ReadBudgetException(self.__url)
+                if self.__decoder is not None:
+                    data = self.__decoder.decompress(data)
+                    if not data:
+                        continue
+                yield data
+            if self.__decoder is not None:
+                data = self.__decoder.flush()
+                if data:
+                    yield data
+        except:
+            self.close()
+            raise
+        self.__release()
+
+    def body(self):
+        """
+        HttpResponse.body(self) -> Full decoded body as bytes.
+        """
+        return b''.join(self.chunks())
+
+    def close(self):
+        """
+        HttpResponse.close(self)
+
+        Drop the response without reading body. Connection is closed.
+        """
+        if self.__conn is not None:
+            self.__conn.close()
+            self.__conn = None
+
+    def __release(self):
+        if self.__conn is None:
+            return
+        if self.__response.will_close:
+            self.__conn.close()
+        else:
+            self.__pool._release(self.__key, self.__conn)
+        self.__conn = None
+
+
+class HttpConnectionPool(object):
+    """
+    An HTTP client keeping persistent connections to each host. It's
+    thread safe: a connection is used by one request at a time, and
+    goes back to pool when its response is fully read.
+
+    Connections are pooled by scheme, host and port, so a redirect from
+    http to https gets a connection of its own. HTTPS through a proxy
+    goes by a CONNECT tunnel to each host.
+    """
+    REDIRECT_STATUS = (301, 302, 303, 307, 308)
+    DEFAULT_PORTS = {'http': 80, 'https': 443}
+    DEFAULT_HEADERS = {
+        'User-Agent': 'Mozilla/5.0 (compatible; ruuxee-spider)',
+        'Accept': 'text/html,application/xhtml+xml',
+        'Accept-Encoding': 'gzip',
+        'Connection': 'keep-alive'
+    }
+
+    def __init__(self, max_idle_per_host = 8, timeout_secs = 5, \
+                 proxy = None, max_redirects = 5, ssl_context = None):
+        """
+        HttpConnectionPool.__init__(self, max_idle_per_host = 8,
+                                    timeout_secs = 5, proxy = None,
+                                    max_redirects = 5, ssl_context = None)
+
+        The proxy is a (host, port) tuple, used for both http and https.
+        If it's None, proxy is taken from http_proxy or https_proxy
+        environment variable on each request, like urlopen() does.
+
+        The ssl_context verifies HTTPS servers. None means default
+        context of ssl module.
+        """
+        self.__max_idle = max_idle_per_host
+        self.__timeout = timeout_secs
+        self.__proxy = proxy
+        self.__max_redirects = max_redirects
+        self.__ssl_context = ssl_context
+        self.__lock = threading.Lock()
+        self.__idle = {}
+
+    def get(self, url, timeout_secs = None, max_bytes = None, \
+            headers = None):
+        """
+        HttpConnectionPool.get(self, url, timeout_secs = None,
+                               max_bytes = None, headers = None)
+            -> :HttpResponse:
+
+        Send a GET request, follow redirects, and return response with
+        body unread. Raise :HttpStatusException: for status other than
+        2xx and 304. The timeout_secs covers whole request including body,
+        and max_bytes limits body size on wire.
+        """
+        if timeout_secs is None:
+            timeout_secs = self.__timeout
+        deadline = time.time() + timeout_secs
+        for i in range(self.__max_redirects + 1):
+            response = self.__request(url, timeout_secs, max_bytes, \
+                                      deadline, headers)
+            status = response.status()
+            if status in HttpConnectionPool.REDIRECT_STATUS and \
+                    'location' in response.headers():
+                location = response.headers()['location']
+                response.body()
+                url = UP.urljoin(url, location)
+                logging.debug("HttpConnectionPool: Redirect to %s", url)
+                continue
+            if status >= 400 or status < 200 or \
+                    (status >= 300 and status != 304):
+                response.close()
+                raise HttpStatusException(url, status)
+            return response
+        raise HttpStatusException(url, status)
+
+    def close(self):
+        """
+        HttpConnectionPool.close(self)
+
+        Close all idle connections.
+        """
+        with self.__lock:
+            idle = self.__idle
+            self.__idle = {}
+        for conns in idle.values():
+            for conn in conns:
+                conn.close()
+
+    def _release(self, key, conn):
+        with self.__lock:
+            conns = self.__idle.setdefault(key, [])
+            if len(conns) < self.__max_idle:
+                conns.append(conn)
+                return
+        conn.close()
+
+    def __request(self, url, timeout_secs, max_bytes, deadline, headers):
+        parsed = UP.urlparse(url)
+        if parsed.scheme not in HttpConnectionPool.DEFAULT_PORTS:
+            raise HttpStatusException(url, 0)
+        proxy = self.__proxy
+        if proxy is None:
+            proxy = HttpConnectionPool.__env_proxy(parsed.scheme)
+        # Key of pool is (scheme, host, port, tunnel), where host and port
+        # are of the server we connect to, and tunnel is the real host
+        # and port behind a proxy for https.
+        origin = (parsed.hostname, \
+                  parsed.port or HttpConnectionPool.DEFAULT_PORTS[ \
+                          parsed.scheme])
+        path = parsed.path or '/'
+        if parsed.query:
+            path += '?' + parsed.query
+        if proxy is None:
+            key = (parsed.scheme, ) + origin + (None, )
+        elif parsed.scheme == 'http':
+            # Proxy takes full URL, so one connection serves all hosts.
+            key = ('http', ) + tuple(proxy) + (None, )
+            path = url
+        else:
+            key = ('https', ) + tuple(proxy) + (origin, )
+        request_headers = dict(HttpConnectionPool.DEFAULT_HEADERS)
+        request_headers['Host'] = parsed.netloc
+        if headers is not None:
+            request_headers.update(headers)
+        # An idle connection may be closed by server already. Retry once
+        # on a new connection if it happens.
+        conn, reused = self.__acquire(key, timeout_secs)
+        try:
+            conn.request('GET', path, headers=request_headers)
+            response = conn.getresponse()
+        except (HL.HTTPException, socket.error) as e:
+            conn.close()
+            if not reused:
+                raise
+            logging.debug("HttpConnectionPool: Stale connection to %s:%d", \
+                          key[1], key[2])
+            conn, reused = self.__acquire(key, timeout_secs, reuse = False)
+            try:
+                conn.request('GET', path, headers=request_headers)
+                response = conn.getresponse()
+            except:
+                conn.close()
+                raise
+        return HttpResponse(self, key, conn, response, url, max_bytes, \
+                            deadline)
+
+    def __acquire(self, key, timeout_secs, reuse = True):
+        conn = None
+        if reuse:
+            with self.__lock:
+                conns = self.__idle.get(key)
+                if conns:
+                    conn = conns.pop()
+        if conn is not None:
+            if conn.sock is not None:
+                conn.sock.settimeout(timeout_secs)
+            return conn, True
+        scheme, host, port, tunnel = key
+        if scheme == 'http':
+            return HL.HTTPConnection(host, port, timeout=timeout_secs), False
+        conn = HL.HTTPSConnection(host, port, timeout=timeout_secs, \
+                                  context=self.__ssl_context)
+        if tunnel is not None:
+            conn.set_tunnel(*tunnel)
+        return conn, False
+
+    @staticmethod
+    def __env_proxy(scheme):
+        proxy_url = os.environ.get('%s_proxy' % scheme) or \
+                    os.environ.get('%s_PROXY' % scheme.upper())
+        if not proxy_url:
+            return None
+        parsed = UP.urlparse(proxy_url)
+        return (parsed.hostname, parsed.port or 80)
@@ -0,0 +1,383 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import sys
+import json
+import time
+import bisect
+import logging
+import threading
+import collections
+
+# Python 2/3 compatibility hack: Import correct libraries
+ver = sys.version[0]
+if ver == '2':
+    import BaseHTTPServer as HS
+    import SocketServer as SS
+elif ver == '3':
+    import http.server as HS
+    import socketserver as SS
+else:
+    raise Exception("Support Python runtime version")
+
+class Counter(object):
+    """
+    A count of events, e.g. pages or bytes fetched. Besides the total,
+    it keeps counts of last window_secs seconds, so rate of a long crawl
+    tells what happens now rather than since start.
+    """
+    def __init__(self, window_secs = 60):
+        self.__lock = threading.Lock()
+        self.__window = window_secs
+        self.__created = time.time()
+        self.__total = 0
+        # Deque of [second, count of that second].
+        self.__recent = collections.deque()
+
+    def add(self, n = 1):
+        second = int(time.time())
+        with self.__lock:
+            self.__total += n
+            recent = self.__recent
+            if recent and recent[-1][0] == second:
+                recent[-1][1] += n
+            else:
+                recent.append([second, n])
+                while recent[0][0] <= second - self.__window:
+                    recent.popleft()
+
+    def value(self):
+        return self.__total
+
+    def rate(self, now = None):
+        """
+        Counter.rate(self, now = None) -> Count per second
+
+        Return mean rate of last window seconds, or since the counter is
+        created if it's younger.
+        """
+        if now is None:
+            now = time.time()
+        begin = int(now) - self.__window
+        with self.__lock:
+            recent = sum([n for second, n in self.__recent \
+                          if second > begin])
+        return float(recent) / max(1.0, min(self.__window, \
+                                            now - self.__created))
+
+class Histogram(object):
+    """
+    Distribution of latencies in seconds. Buckets grow by double from
+    0.1 ms to about 52 seconds, and percentiles are upper bounds of
+    buckets they fall in, so they are never off by more than double.
+    """
+    BOUNDS = tuple([0.0001 * 2 ** i for i in range(20)])
+
+    def __init__(self):
+        self.__lock = threading.Lock()
+        # The last bucket keeps everything above largest bound.
+        self.__buckets = [0] * (len(Histogram.BOUNDS) + 1)
+        self.__count = 0
+        self.__sum = 0.0
+        self.__min = None
+        self.__max = None
+
+    def observe(self, secs):
+        index = bisect.bisect_left(Histogram.BOUNDS, secs)
+        with self.__lock:
+            self.__buckets[index] += 1
+            self.__count += 1
+            self.__sum += secs
+            if self.__min is None or secs < self.__min:
+                self.__min = secs
+            if self.__max is None or secs > self.__max:
+                self.__max = secs
+
+    def snapshot(self):
+        """
+        Histogram.snapshot(self) -> dict
+
+        Return count, sum, mean, min, max, p50, p90 and p99 in seconds.
+        """
+        with self.__lock:
+            buckets = list(self.__buckets)
+            count = self.__count
+            result = {'count': count,
+                      'sum': self.__sum,
+                      'min': self.__min,
+                      'max': self.__max}
+        result['mean'] = result['sum'] / count if count else None
+        for name, q in (('p50', 0.5), ('p90', 0.9), ('p99', 0.99)):
+            result[name] = Histogram.__percentile(buckets, count, q, \
+                                                  result['min'], \
+                                                  result['max'])
+        return result
+
+    @staticmethod
+    def __percentile(buckets, count, q, smallest, largest):
+        if count == 0:
+            return None
+        rank = q * count
+        seen = 0
+        for index, n in enumerate(buckets):
+            seen += n
+            if seen >= rank:
+                break
+        if index < len(Histogram.BOUNDS):
+            return max(smallest, min(Histogram.BOUNDS[index], largest))
+        return largest
+
+class _Timer(object):
+    """
+    Context manager observing seconds of its block in a histogram.
+    """
+    __slots__ = ('__histogram', '__begin')
+
+    def __init__(self, histogram):
+        self.__histogram = histogram
+        self.__begin = None
+
+    def __enter__(self):
+        self.__begin = time.time()
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.__histogram.observe(time.time() - self.__begin)
+        return False
+
+class MetricsRegistry(object):
+    """
+    Named counters, latency histograms and gauges of a crawl, shared by
+    all threads. Instruments are created on first use.
+
+    Names are dotted by stage, e.g. "fetch.bytes" or "parse.movie".
+    Gauges are functions called on snapshot(), e.g. size of frontier.
+    """
+    def __init__(self, window_secs = 60):
+        self.__lock = threading.Lock()
+        self.__window = window_secs
+        self.__started = time.time()
+        self.__counters = {}
+        self.__histograms = {}
+        self.__gauges = {}
+
+    def enabled(self):
+        return True
+
+    def clock(self):
+        """
+        MetricsRegistry.clock(self) -> Seconds
+
+        Return current time, to be passed to observe() later.
+        """
+        return time.time()
+
+    def count(self, name, n = 1):
+        counter = self.__counters.get(name)
+        if counter is None:
+            with self.__lock:
+                counter = self.__counters.setdefault(name, \
+                                                     Counter(self.__window))
+        counter.add(n)
+
+    def observe(self, name, begin):
+        """
+        MetricsRegistry.observe(self, name, begin)
+
+        Observe seconds since begin, a value of clock(), in histogram of
+        given name.
+        """
+        self.__histogram(name).observe(time.time() - begin)
+
+    def timer(self, name):
+        """
+        MetricsRegistry.timer(self, name) -> Context manager
+
+        Observe seconds of a with block in histogram of given name.
+        """
+        return _Timer(self.__histogram(name))
+
+    def gauge(self, name, function):
+        with self.__lock:
+            self.__gauges[name] = function
+
+    def __histogram(self, name):
+        histogram = self.__histograms.get(name)
+        if histogram is None:
+            with self.__lock:
+                histogram = self.__histograms.setdefault(name, Histogram())
+        return histogram
+
+    def snapshot(self):
+        """
+        MetricsRegistry.snapshot(self) -> dict
+
+        Return values of all instruments, to be dumped as JSON. Each
+        counter comes with its total, rate of recent window and mean
+        rate since registry is created.
+        """
+        now = time.time()
+        uptime = now - self.__started
+        with self.__lock:
+            counters = dict(self.__counters)
+            histograms = dict(self.__histograms)
+            gauges = dict(self.__gauges)
+        result = {'time': now,
+                  'uptime_secs': uptime,
+                  'counters': {},
+                  'histograms': {},
+                  'gauges': {}}
+        for name, counter in counters.items():
+            total = counter.value()
+            result['counters'][name] = \
+                    {'count': total,
+                     'rate': counter.rate(now),
+                     'mean_rate': total / uptime if uptime > 0 else 0.0}
+        for name, histogram in histograms.items():
+            result['histograms'][name] = histogram.snapshot()
+        for name, function in gauges.items():
+            try:
+                result['gauges'][name] = function()
+            except Exception as e:
+                logging.error("MetricsRegistry: Gauge %s fails: %s" % \
+                        (name, e))
+                result['gauges'][name] = None
+        return result
+
+class _NullTimer(object):
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        return False
+
+class NullRegistry(object):
+    """
+    A registry dropping everything. It's installed when metrics are
+    disabled, so instrumented code costs a method call per event.
+    """
+    __timer = _NullTimer()
+
+    def enabled(self):
+        return False
+
+    def clock(self):
+        return 0
+
+    def count(self, name, n = 1):
+        pass
+
+    def observe(self, name, begin):
+        pass
+
+    def timer(self, name):
+        return NullRegistry.__timer
+
+    def gauge(self, name, function):
+        pass
+
+    def snapshot(self):
+        return {}
+
+class MetricsServer(object):
+    """
+    A local HTTP server answering every GET with snapshot of a registry
+    as JSON, so a running crawl can be watched with curl or scraped by a
+    monitor.
+    """
+    def __init__(self, registry, port = 0, host = '127.0.0.1'):
+        """
+        MetricsServer.__init__(self, registry, port = 0,
+                               host = '127.0.0.1')
+
+        Port 0 means any free port. Server listens on loopback only,
+        unless another host is given.
+        """
+        self.__registry = registry
+        self.__host = host
+        self.__port = port
+        self.__server = None
+        self.__thread = None
+
+    def start(self):
+        if self.__server is not None:
+            return
+        registry = self.__registry
+        class Handler(HS.BaseHTTPRequestHandler):
+            def do_GET(self):
+                body = json.dumps(registry.snapshot(), sort_keys = True, \
+                                  indent = 2).encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+            def log_message(self, format, *args):
+                logging.debug("MetricsServer: " + format, *args)
+        class Server(SS.ThreadingMixIn, HS.HTTPServer):
+            daemon_threads = True
+            allow_reuse_address = True
+        self.__server = Server((self.__host, self.__port), Handler)
+        self.__thread = threading.Thread(target=self.__server.serve_forever)
+        self.__thread.daemon = True
+        self.__thread.start()
+        logging.info("MetricsServer: Listen on %s:%d" % self.address())
+
+    def stop(self):
+        if self.__server is None:
+            return
+        self.__server.shutdown()
+        self.__server.server_close()
+        self.__thread.join()
+        self.__server = None
+        self.__thread = None
+
+    def address(self):
+        return self.__server.server_address
+
+class SnapshotDumper(object):
+    """
+    Append snapshot of a registry to a file every interval_secs, one
+    JSON object per line. A last snapshot is written on stop().
+    """
+    def __init__(self, registry, path, interval_secs = 10):
+        self.__registry = registry
+        self.__path = path
+        self.__interval = interval_secs
+        self.__stop_sign = threading.Event()
+        self.__thread = None
+
+    def start(self):
+        if self.__thread is not None:
+            return
+        self.__stop_sign.clear()
+        self.__thread = threading.Thread(target=self.__dump_loop)
+        self.__thread.daemon = True
+        self.__thread.start()
+
+    def stop(self):
+        if self.__thread is None:
+            return
+        self.__stop_sign.set()
+        self.__thread.join()
+        self.__thread = None
+        self.dump()
+
+    def dump(self):
+        """
+        SnapshotDumper.dump(self)
+
+        Append a snapshot now.
+        """
+        line = json.dumps(self.__registry.snapshot(), sort_keys = True)
+        try:
+            with open(self.__path, 'a') as f:
+                f.write(line + '\n')
+        except IOError as e:
+            logging.error("SnapshotDumper: Can't write %s: %s" % \
+                    (self.__path, e))
+
+    def __dump_loop(self):
+        while not self.__stop_sign.wait(self.__interval):
+            self.dump()
@@ -0,0 +1,250 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import os
+import json
+import time
+import zlib
+import errno
+import hashlib
+import logging
+import threading
+
+class CacheMissException(Exception):
+    def __init__(self, url):
+        Exception.__init__(self)
+        self.__url = url
+    def url(self):
+        return self.__url
+
+class CachedPage(object):
+    """
+    A page loaded from :PageCache:. Body is kept as received bytes, so
+    it's decoded with the charset from original response.
+    """
+    def __init__(self, url, body, charset, etag, last_modified, fetched_at):
+        self.__url = url
+        self.__body = body
+        self.__charset = charset
+        self.__etag = etag
+        self.__last_modified = last_modified
+        self.__fetched_at = fetched_at
+
+    def url(self):
+        return self.__url
+    def body(self):
+        return self.__body
+    def charset(self):
+        return self.__charset
+    def etag(self):
+        return self.__etag
+    def last_modified(self):
+        return self.__last_modified
+    def fetched_at(self):
+        return self.__fetched_at
+
+    def validators(self):
+        """
+        CachedPage.validators(self) -> dict of headers
+
+        Return headers for a conditional GET of this page.
+        """
+        headers = {}
+        if self.__etag is not None:
+            headers['If-None-Match'] = self.__etag
+        if self.__last_modified is not None:
+            headers['If-Modified-Since'] = self.__last_modified
+        return headers
+
+
+class PageCache(object):
+    """
+    An on-disk cache of fetched pages. Each page is stored in a file
+    named by SHA-1 of its URL, holding a line of JSON metadata and the
+    zlib compressed body.
+
+    Pages younger than fresh_secs are used without network. Older pages
+    are revalidated with conditional GET. Pages older than ttl_secs are
+    evicted, and least recently used pages are evicted when cache grows
+    over max_bytes.
+    """
+    def __init__(self, cache_dir, fresh_secs = 86400, \
+                 ttl_secs = 30 * 86400, max_bytes = 0, offline = False):
+        """
+        PageCache.__init__(self, cache_dir, fresh_secs = 86400,
+                           ttl_secs = 30 * 86400, max_bytes = 0,
+                           offline = False)
+
+        Open or create cache in cache_dir. A max_bytes of 0 means cache
+        size is not limited. In offline mode pages are only read from
+        cache, whatever their age is.
+        """
+        self.__cache_dir = cache_dir
+        self.__fresh_secs = fresh_secs
+        self.__ttl_secs = ttl_secs
+        self.__max_bytes = max_bytes
+        self.__offline = offline
+        self.__lock = threading.Lock()
+        self.__stats = {'hits': 0,
+                        'misses': 0,
+                        'revalidated': 0,
+                        'stored': 0,
+                        'evicted': 0}
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+        self.__total_bytes = sum(size for path, size, atime in self.__entries())
+        logging.info("PageCache: %s opened, %d bytes." % \
+                (cache_dir, self.__total_bytes))
+
+    def offline(self):
+        return self.__offline
+
+    def is_fresh(self, page):
+        return time.time() - page.fetched_at() < self.__fresh_secs
+
+    def lookup(self, url):
+        """
+        PageCache.lookup(self, url) -> :CachedPage: or None
+        """
+        path = self.__path(url)
+        try:
+            with open(path, 'rb') as f:
+                meta = json.loads(f.readline().decode('utf-8'))
+                body = zlib.decompress(f.read())
+        except (IOError, OSError, ValueError, zlib.error) as e:
+            self.__count('misses')
+            return None
+        if meta['url'] != url:
+            # SHA-1 collision. Very unlikely, but don't return wrong page.
+            self.__count('misses')
+            return None
+        if time.time() - meta['fetched_at'] > self.__ttl_secs and \
+                not self.__offline:
+            self.__remove(path)
+            self.__count('misses')
+            return None
+        self.__touch_file(path)
+        self.__count('hits')
+        return CachedPage(url, body, meta['charset'], meta['etag'], \
+                          meta['last_modified'], meta['fetched_at'])
+
+    def store(self, url, body, charset, etag = None, last_modified = None):
+        """
+        PageCache.store(self, url, body, charset, etag = None,
+                        last_modified = None)
+
+        Save received body bytes of given URL.
+        """
+        meta = {'url': url,
+                'charset': charset,
+                'etag': etag,
+                'last_modified': last_modified,
+                'fetched_at': time.time()}
+        self.__write(url, meta, zlib.compress(body))
+        self.__count('stored')
+
+    def revalidated(self, page):
+        """
+        PageCache.revalidated(self, page)
+
+        Mark a page as fresh again, when server says it's not modified.
+        """
+        meta = {'url': page.url(),
+                'charset': page.charset(),
+                'etag': page.etag(),
+                'last_modified': page.last_modified(),
+                'fetched_at': time.time()}
+        self.__write(page.url(), meta, zlib.compress(page.body()))
+        self.__count('revalidated')
+
+    def evict(self, target_bytes = None):
+        """
+        PageCache.evict(self, target_bytes = None)
+
+        Remove expired pages, then remove least recently used pages until
+        cache size is under target_bytes (max_bytes by default).
+        """
+        if target_bytes is None:
+            target_bytes = self.__max_bytes
+        now = time.time()
+        entries = sorted(self.__entries(), key=lambda each: each[2])
+        total = sum(size for path, size, atime in entries)
+        for path, size, atime in entries:
+            expired = now - os.path.getmtime(path) > self.__ttl_secs \
+                      if os.path.exists(path) else True
+            if not expired and (target_bytes <= 0 or total <= target_bytes):
+                continue
+            if self.__remove(path):
+                total -= size
+                self.__count('evicted')
+        with self.__lock:
+            self.__total_bytes = total
+        logging.info("PageCache: Evicted down to %d bytes." % total)
+
+    def stats(self):
+        with self.__lock:
+            stats = dict(self.__stats)
+            stats['bytes'] = self.__total_bytes
+        return stats
+
+    def __write(self, url, meta, compressed_body):
+        path = self.__path(url)
+        directory = os.path.dirname(path)
+        try:
+            os.makedirs(directory)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+        old_size = os.path.getsize(path) if os.path.exists(path) else 0
+        # Write to a temporary file first, so readers never see a half
+        # written page, even if we are killed.
+        tmp_path = "%s.%d.%d.tmp" % (path, os.getpid(), \
+                                     threading.current_thread().ident)
+        with open(tmp_path, 'wb') as f:
+            f.write(json.dumps(meta).encode('utf-8'))
+            f.write(b'\n')
+            f.write(compressed_body)
+        new_size = os.path.getsize(tmp_path)
+        os.rename(tmp_path, path)
+        with self.__lock:
+            self.__total_bytes += new_size - old_size
+            over_limit = self.__max_bytes > 0 and \
+                         self.__total_bytes > self.__max_bytes
+        if over_limit:
+            # Leave some room so we don't evict on every store.
+            self.evict(int(self.__max_bytes * 0.9))
+
+    def __path(self, url):
+        key = hashlib.sha1(url.encode('utf-8')).hexdigest()
+        return os.path.join(self.__cache_dir, key[:2], key)
+
+    def __entries(self):
+        # Modification time is the fetch time. Access time is updated
+        # by us on each hit, so it's good for LRU.
+        for root, dirs, files in os.walk(self.__cache_dir):
+            for name in files:
+                if name.endswith('.tmp'):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    st = os.stat(path)
+                except OSError as e:
+                    continue
+                yield path, st.st_size, st.st_atime
+
+    def __touch_file(self, path):
+        try:
+            st = os.stat(path)
+            os.utime(path, (time.time(), st.st_mtime))
+        except OSError as e:
+            pass
+
+    def __remove(self, path):
+        try:
+            os.remove(path)
+            return True
+        except OSError as e:
+            return False
+
+    def __count(self, name):
+        with self.__lock:
+            self.__stats[name] += 1
@@ -0,0 +1,108 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import logging
+import threading
+import multiprocessing
+
+class ParseException(Exception):
+    """
+    Parsing fails in a parse process. The message tells original
+    exception, which may not be sent between processes.
+    """
+    def __init__(self, message):
+        Exception.__init__(self, message)
+
+def _extract(kind, body, charset, selective):
+    # Runs in parse process. Import here so the module can be imported
+    # by douban without a loop.
+    import douban
+    try:
+        return True, douban.extractrecord(kind, body, charset, selective)
+    except Exception as e:
+        return False, "%s: %s" % (type(e).__name__, e)
+
+class ParsePool(object):
+    """
+    A parse stage in a pool of processes, so HTML tokenizing is not held
+    by the GIL of fetching threads. Raw page bytes go in, and records of
+    plain values come out, to be loaded into :Movie: and :Celebrity:.
+
+    Pages waiting for or being parsed are limited by max_pending. A
+    fetching thread blocks in extract() when the stage is full, so the
+    fetch stage never runs far ahead of parsing. Between parse and store
+    stage, spiders keep one result per fetch worker at most.
+
+    The pool must be started before any thread, as processes are forked
+    on some platforms.
+    """
+    def __init__(self, processes = 0, max_pending = 0, selective = True, \
+                 timeout_secs = 60):
+        """
+        ParsePool.__init__(self, processes = 0, max_pending = 0,
+                           selective = True, timeout_secs = 60)
+
+        Processes of 0 means one process per CPU, and max_pending of 0
+        means twice of processes. The selective is passed to
+        :MoviePageVisitor:. A page not parsed in timeout_secs fails.
+        """
+        if processes <= 0:
+            processes = multiprocessing.cpu_count()
+        if max_pending <= 0:
+            max_pending = processes * 2
+        self.__processes = processes
+        self.__max_pending = max_pending
+        self.__selective = selective
+        self.__timeout = timeout_secs
+        self.__slots = threading.BoundedSemaphore(max_pending)
+        self.__lock = threading.Lock()
+        self.__pool = None
+        self.__stats = {'pages': 0,
+                        'failures': 0,
+                        'waited_pages': 0}
+
+    def start(self):
+        if self.__pool is not None:
+            return
+        self.__pool = multiprocessing.Pool(self.__processes)
+        logging.info("ParsePool: %d processes started." % self.__processes)
+
+    def stop(self):
+        if self.__pool is None:
+            return
+        self.__pool.close()
+        self.__pool.join()
+        self.__pool = None
+        logging.info("ParsePool: Stopped.")
+
+    def processes(self):
+        return self.__processes
+
+    def extract(self, kind, body, charset):
+        """
+        ParsePool.extract(self, kind, body, charset) -> dict
+
+        Parse a page in pool, and wait for its record. See
+        douban.extractrecord() for kinds. Raise :ParseException: if
+        parsing fails.
+        """
+        if not self.__slots.acquire(False):
+            with self.__lock:
+                self.__stats['waited_pages'] += 1
+            self.__slots.acquire()
+        try:
+            result = self.__pool.apply_async(_extract, \
+                    (kind, body, charset, self.__selective))
+            succeeded, record = result.get(self.__timeout)
+        finally:
+            self.__slots.release()
+        with self.__lock:
+            self.__stats['pages'] += 1
+            if not succeeded:
+                self.__stats['failures'] += 1
+        if not succeeded:
+            raise ParseException(record)
+        return record
+
+    def stats(self):
+        with self.__lock:
+            return dict(self.__stats)
@@ -0,0 +1,170 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import time
+import logging
+import threading
+
+class TokenBucket(object):
+    """
+    A token bucket refilled at given rate, holding at most burst tokens.
+    It's not thread safe. Callers must take care of locking.
+    """
+    def __init__(self, rate, burst):
+        self.__rate = float(rate)
+        self.__burst = float(burst)
+        self.__tokens = float(burst)
+        self.__last = time.time()
+
+    def rate(self, new_rate = None):
+        if new_rate is not None:
+            old_rate = self.__rate
+            self.__refill(time.time())
+            self.__rate = float(new_rate)
+            return old_rate
+        return self.__rate
+
+    def reserve(self, now = None):
+        """
+        TokenBucket.reserve(self, now = None) -> Seconds to wait
+
+        Take a token. If no token is available, the token is borrowed
+        from future, and caller must wait for returned seconds before
+        using it.
+        """
+        if now is None:
+            now = time.time()
+        self.__refill(now)
+        self.__tokens -= 1.0
+        if self.__tokens >= 0:
+            return 0.0
+        return -self.__tokens / self.__rate
+
+    def drain(self):
+        """
+        TokenBucket.drain(self)
+
+        Drop all tokens, so next request waits for a full refill period.
+        """
+        self.__refill(time.time())
+        self.__tokens = min(self.__tokens, 0.0)
+
+    def __refill(self, now):
+        elapsed = max(0.0, now - self.__last)
+        self.__tokens = min(self.__burst, \
+                            self.__tokens + elapsed * self.__rate)
+        self.__last = now
+
+
+class HostRateLimiter(object):
+    """
+    Rate limiter with one token bucket per host. It's shared by all
+    threads fetching pages.
+
+    Rate of a host slows down when server says we are too fast (HTTP 403,
+    429 or 5xx), and recovers slowly on successful responses.
+    """
+    THROTTLE_STATUS = (403, 429)
+
+    def __init__(self, rate = 1.0, burst = 1, min_rate = None, \
+                 backoff = 0.5, recovery = 0.05):
+        """
+        HostRateLimiter.__init__(self, rate = 1.0, burst = 1,
+                                 min_rate = None, backoff = 0.5,
+                                 recovery = 0.05)
+
+        Requests to each host are limited to rate per second, allowing
+        burst requests at once. On throttling response the rate is
+        multiplied by backoff, but never below min_rate (rate / 16 by
+        default). Each successful response adds recovery * rate back.
+        """
+        self.__max_rate = float(rate)
+        self.__burst = burst
+        if min_rate is None:
+            min_rate = self.__max_rate / 16
+        self.__min_rate = float(min_rate)
+        self.__backoff = backoff
+        self.__recovery = recovery
+        self.__lock = threading.Lock()
+        self.__buckets = {}
+        self.__stats = {}
+
+    def acquire(self, host):
+        """
+        HostRateLimiter.acquire(self, host) -> Seconds waited
+
+        Block until a request to given host is allowed.
+        """
+        wait_secs = self.reserve(host)
+        if wait_secs > 0:
+            time.sleep(wait_secs)
+        return wait_secs
+
+    def reserve(self, host):
+        """
+        HostRateLimiter.reserve(self, host) -> Seconds to wait
+
+        Non-blocking version of acquire(). Caller must wait for returned
+        seconds before sending request, e.g. with asyncio.sleep().
+        """
+        with self.__lock:
+            bucket = self.__bucket(host)
+            wait_secs = bucket.reserve()
+            stats = self.__stats[host]
+            stats['requests'] += 1
+            if wait_secs > 0:
+                stats['waited_requests'] += 1
+                stats['total_wait_secs'] += wait_secs
+                stats['max_wait_secs'] = max(stats['max_wait_secs'], wait_secs)
+        return wait_secs
+
+    def report(self, host, status):
+        """
+        HostRateLimiter.report(self, host, status)
+
+        Report HTTP status of a response from given host, so the rate
+        can be adjusted.
+        """
+        throttled = status in HostRateLimiter.THROTTLE_STATUS or \
+                    500 <= status < 600
+        with self.__lock:
+            bucket = self.__bucket(host)
+            rate = bucket.rate()
+            if throttled:
+                new_rate = max(self.__min_rate, rate * self.__backoff)
+                bucket.rate(new_rate)
+                bucket.drain()
+                self.__stats[host]['throttled'] += 1
+            elif rate < self.__max_rate:
+                new_rate = min(self.__max_rate, \
+                               rate + self.__max_rate * self.__recovery)
+                bucket.rate(new_rate)
+            else:
+                return
+            self.__stats[host]['rate'] = new_rate
+        if throttled:
+            logging.warn("HostRateLimiter: HTTP %d from %s. Slow down to %.3f/s" \
+                    % (status, host, new_rate))
+
+    def stats(self):
+        """
+        HostRateLimiter.stats(self) -> dict
+
+        Return a copy of statistics per host: requests, waited_requests,
+        total_wait_secs, max_wait_secs, throttled, and current rate.
+        """
+        with self.__lock:
+            return dict((host, dict(each)) \
+                        for host, each in self.__stats.items())
+
+    def __bucket(self, host):
+        bucket = self.__buckets.get(host)
+        if bucket is None:
+            bucket = TokenBucket(self.__max_rate, self.__burst)
+            self.__buckets[host] = bucket
+            self.__stats[host] = {'requests': 0,
+                                  'waited_requests': 0,
+                                  'total_wait_secs': 0.0,
+                                  'max_wait_secs': 0.0,
+                                  'throttled': 0,
+                                  'rate': self.__max_rate}
+        return bucket
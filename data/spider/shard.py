@@ -0,0 +1,469 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import os
+import sys
+import json
+import time
+import zlib
+import errno
+import socket
+import logging
+import subprocess
+
+def shard_of(douban_id, shards):
+    """
+    shard_of(douban_id, shards) -> index of shard owning given Id
+
+    Ids are partitioned by CRC-32, which is the same on every machine
+    and Python version, unlike hash().
+    """
+    if not isinstance(douban_id, bytes):
+        douban_id = douban_id.encode('utf-8')
+    return (zlib.crc32(douban_id) & 0xffffffff) % shards
+
+class ShardMismatchException(Exception):
+    def __init__(self, spool_dir, shards):
+        Exception.__init__(self, "Spool %s is made for %d shards." % \
+                (spool_dir, shards))
+        self.__shards = shards
+    def shards(self):
+        return self.__shards
+
+class SpoolCoordinator(object):
+    """
+    Coordinates one shard of a crawl split across processes or machines,
+    through a spool directory they all can reach, e.g. a local disk or a
+    network file system. Movie Id space is partitioned by shard_of().
+    Each shard fetches only movies it owns and keeps them in its own
+    database, and forwards movies it finds for other shards to their
+    inboxes in the spool.
+
+    The spool holds:
+
+    - shards.json: Number of shards. A spool is never reused by a crawl
+      with another number, as owners of movies would change.
+    - inbox-<shard>/: Messages to a shard. Each one is a JSON file of
+      movie Ids, and celebrity Ids saved by sender. A message is written
+      to a temporary file, then renamed, so readers never see half of
+      it. It's removed after receiver commits what it brings, so a
+      killed shard gets it again on resume.
+    - status-<shard>.json: State of a shard, "busy", "idle" or
+      "stopped", with numbers of messages it has sent to each shard and
+      received.
+
+    Celebrities are fetched by the shard crawling a movie they appear
+    in. Saved ones are announced to other shards, so they are rarely
+    fetched twice, though a celebrity fetched at the same time by two
+    shards is saved by both.
+
+    A shard with an empty frontier is idle, but it's not done until all
+    shards are idle or stopped, and no message is on the way to an idle
+    shard. That holds when two scans of status in a row see the same
+    numbers, and each idle shard has received all messages sent to it.
+    Messages to a stopped shard, e.g. one reaching its movie limit, wait
+    in the spool for its next run.
+
+    Methods other than owns() must be called from worker thread of
+    :Spider:.
+    """
+    def __init__(self, spool_dir, shard, shards, poll_secs = 1, \
+                 batch_size = 500):
+        """
+        SpoolCoordinator.__init__(self, spool_dir, shard, shards,
+                                  poll_secs = 1, batch_size = 500)
+
+        Coordinate shard of given index, out of shards. Inbox is read and
+        forwarded Ids are sent every poll_secs, or as soon as batch_size
+        Ids wait for a shard.
+        """
+        if shards < 1 or shard < 0 or shard >= shards:
+            raise ValueError("Bad shard %d of %d." % (shard, shards))
+        self.__spool_dir = spool_dir
+        self.__shard = shard
+        self.__shards = shards
+        self.__poll_secs = poll_secs
+        self.__batch_size = batch_size
+        self.__state = None
+        # Messages sent to each shard, and received, in all runs.
+        self.__sent = [0] * shards
+        self.__received = 0
+        # Ids waiting to be sent, by shard.
+        self.__outbox = [[] for i in range(shards)]
+        self.__celebrity_outbox = []
+        self.__forwarded = set()
+        self.__sequence = 0
+        self.__last_poll = 0
+        # Messages received but not acknowledged yet.
+        self.__unacknowledged = []
+        self.__last_scan = None
+        self.__stats = {'forwarded_movies': 0,
+                        'announced_celebrities': 0,
+                        'received_movies': 0,
+                        'received_celebrities': 0,
+                        'sent_messages': 0,
+                        'received_messages': 0}
+
+    def shard(self):
+        return self.__shard
+
+    def shards(self):
+        return self.__shards
+
+    def poll_secs(self):
+        return self.__poll_secs
+
+    def start(self):
+        """
+        SpoolCoordinator.start(self)
+
+        Create spool if it's new, check its number of shards, and resume
+        message numbers of this shard from last run.
+        """
+        for each in range(self.__shards):
+            self.__makedirs(self.__inbox(each))
+        config = os.path.join(self.__spool_dir, "shards.json")
+        if not os.path.exists(config):
+            self.__write_json(config, {'shards': self.__shards})
+        with open(config, 'r') as f:
+            shards = json.load(f)['shards']
+        if shards != self.__shards:
+            raise ShardMismatchException(self.__spool_dir, shards)
+        status = self.__read_status(self.__shard)
+        if status is not None:
+            self.__sent = [status['sent'].get(str(each), 0) \
+                           for each in range(self.__shards)]
+            self.__received = status['received']
+        self.__last_scan = None
+        self.__set_state("busy")
+        logging.info("SpoolCoordinator: Shard %d of %d started in %s." % \
+                (self.__shard, self.__shards, self.__spool_dir))
+
+    def stop(self):
+        """
+        SpoolCoordinator.stop(self)
+
+        Send all forwarded Ids, and mark this shard stopped. Messages
+        received but not acknowledged stay in inbox.
+        """
+        self.flush()
+        self.__unacknowledged = []
+        self.__set_state("stopped")
+        logging.info("SpoolCoordinator: Shard %d stopped: %s" % \
+                (self.__shard, self.__stats))
+
+    def owns(self, douban_id):
+        return shard_of(douban_id, self.__shards) == self.__shard
+
+    def route(self, movie_ids):
+        """
+        SpoolCoordinator.route(self, movie_ids) -> list of Ids
+
+        Return movies owned by this shard, and forward others to their
+        owners. A movie is forwarded once per run.
+        """
+        owned = []
+        for each in movie_ids:
+            shard = shard_of(each, self.__shards)
+            if shard == self.__shard:
+                owned.append(each)
+            elif each not in self.__forwarded:
+                self.__forwarded.add(each)
+                self.__outbox[shard].append(each)
+                self.__stats['forwarded_movies'] += 1
+                if len(self.__outbox[shard]) >= self.__batch_size:
+                    self.__send(shard, [])
+        return owned
+
+    def announce_celebrities(self, celebrity_ids):
+        """
+        SpoolCoordinator.announce_celebrities(self, celebrity_ids)
+
+        Tell other shards that given celebrities are saved here.
+        """
+        if self.__shards == 1:
+            return
+        self.__celebrity_outbox.extend(celebrity_ids)
+        self.__stats['announced_celebrities'] += len(celebrity_ids)
+        if len(self.__celebrity_outbox) >= self.__batch_size:
+            self.flush()
+
+    def flush(self):
+        """
+        SpoolCoordinator.flush(self)
+
+        Send all Ids waiting in outbox.
+        """
+        sent = False
+        for each in range(self.__shards):
+            if each == self.__shard:
+                continue
+            if len(self.__outbox[each]) > 0 or \
+                    len(self.__celebrity_outbox) > 0:
+                self.__send(each, self.__celebrity_outbox, \
+                            write_status = False)
+                sent = True
+        self.__celebrity_outbox = []
+        if sent:
+            self.__write_status()
+
+    def receive(self, force = False):
+        """
+        SpoolCoordinator.receive(self, force = False)
+            -> (list of movie Ids, list of celebrity Ids)
+
+        Flush outbox and read messages in inbox, if poll_secs passed
+        since last call or force is True. Call acknowledge() when Ids
+        received are committed.
+        """
+        now = time.time()
+        if not force and now - self.__last_poll < self.__poll_secs:
+            return [], []
+        self.__last_poll = now
+        self.flush()
+        inbox = self.__inbox(self.__shard)
+        movie_ids = []
+        celebrity_ids = []
+        for name in sorted(os.listdir(inbox)):
+            if not name.endswith('.json'):
+                continue
+            path = os.path.join(inbox, name)
+            if path in self.__unacknowledged:
+                continue
+            try:
+                with open(path, 'r') as f:
+                    message = json.load(f)
+            except (IOError, OSError, ValueError) as e:
+                logging.error("SpoolCoordinator: Bad message %s: %s" % \
+                        (path, e))
+                continue
+            movie_ids.extend(message['movies'])
+            celebrity_ids.extend(message['celebrities'])
+            self.__unacknowledged.append(path)
+        self.__stats['received_movies'] += len(movie_ids)
+        self.__stats['received_celebrities'] += len(celebrity_ids)
+        return movie_ids, celebrity_ids
+
+    def acknowledge(self):
+        """
+        SpoolCoordinator.acknowledge(self)
+
+        Remove messages received, as what they bring is committed.
+        """
+        if len(self.__unacknowledged) == 0:
+            return
+        for each in self.__unacknowledged:
+            try:
+                os.remove(each)
+            except OSError as e:
+                logging.error("SpoolCoordinator: Can't remove %s: %s" % \
+                        (each, e))
+        self.__received += len(self.__unacknowledged)
+        self.__stats['received_messages'] += len(self.__unacknowledged)
+        self.__unacknowledged = []
+        self.__write_status()
+
+    def idle(self):
+        """
+        SpoolCoordinator.idle(self)
+
+        Mark this shard idle, as its frontier is empty. Ids waiting in
+        outbox are sent first.
+        """
+        self.flush()
+        if self.__state != "idle":
+            self.__set_state("idle")
+
+    def busy(self):
+        if self.__state != "busy":
+            self.__set_state("busy")
+
+    def is_done(self):
+        """
+        SpoolCoordinator.is_done(self) -> True if whole crawl is done
+
+        Scan status of all shards. Call it while this shard is idle,
+        every poll_secs.
+        """
+        scan = []
+        for each in range(self.__shards):
+            status = self.__read_status(each)
+            if status is None:
+                # Not started yet.
+                self.__last_scan = None
+                return False
+            scan.append((status['state'], \
+                         tuple(status['sent'].get(str(shard), 0) \
+                               for shard in range(self.__shards)), \
+                         status['received']))
+        last_scan = self.__last_scan
+        self.__last_scan = scan
+        for state, sent, received in scan:
+            if state == "busy":
+                return False
+        for shard, (state, sent, received) in enumerate(scan):
+            if state == "idle" and \
+                    received != sum(each[1][shard] for each in scan):
+                return False
+        return scan == last_scan
+
+    def stats(self):
+        return dict(self.__stats)
+
+    def __send(self, shard, celebrity_ids, write_status = True):
+        message = {'from': self.__shard,
+                   'movies': self.__outbox[shard],
+                   'celebrities': celebrity_ids}
+        self.__sequence += 1
+        # Names sort by time, so older messages are read first.
+        name = "%.6f-%d-%d-%d.json" % (time.time(), self.__shard, \
+                                       os.getpid(), self.__sequence)
+        self.__write_json(os.path.join(self.__inbox(shard), name), message)
+        self.__outbox[shard] = []
+        self.__sent[shard] += 1
+        self.__stats['sent_messages'] += 1
+        if write_status:
+            self.__write_status()
+
+    def __set_state(self, state):
+        self.__state = state
+        self.__write_status()
+        logging.info("SpoolCoordinator: Shard %d is %s." % \
+                (self.__shard, state))
+
+    def __write_status(self):
+        status = {'shard': self.__shard,
+                  'state': self.__state,
+                  'sent': dict((str(each), self.__sent[each]) \
+                               for each in range(self.__shards)),
+                  'received': self.__received,
+                  'host': socket.gethostname(),
+                  'pid': os.getpid(),
+                  'time': time.time()}
+        self.__write_json(self.__status_path(self.__shard), status)
+
+    def __read_status(self, shard):
+        try:
+            with open(self.__status_path(shard), 'r') as f:
+                return json.load(f)
+        except (IOError, OSError, ValueError) as e:
+            return None
+
+    def __status_path(self, shard):
+        return os.path.join(self.__spool_dir, "status-%d.json" % shard)
+
+    def __inbox(self, shard):
+        return os.path.join(self.__spool_dir, "inbox-%d" % shard)
+
+    def __write_json(self, path, value):
+        tmp_path = "%s.%d.tmp" % (path, os.getpid())
+        with open(tmp_path, 'w') as f:
+            json.dump(value, f, sort_keys = True)
+        os.rename(tmp_path, path)
+
+    def __makedirs(self, directory):
+        try:
+            os.makedirs(directory)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+
+def run_local_shards(shards, spool_dir, db_pattern, log_pattern, \
+                     spider_args = ()):
+    """
+    run_local_shards(shards, spool_dir, db_pattern, log_pattern,
+                     spider_args = ()) -> list of exit codes
+
+    Run a douban.py process for each shard on this machine, and wait for
+    all of them. Database and log of shard i are given by patterns like
+    "shard-%d.db". Other arguments of douban.py, e.g. seed URL, are the
+    same for all shards.
+    """
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), \
+                          "douban.py")
+    processes = []
+    for each in range(shards):
+        command = [sys.executable, script, \
+                   '--shards', str(shards), \
+                   '--shard', str(each), \
+                   '--spool', spool_dir, \
+                   '--db', db_pattern % each, \
+                   '--log', log_pattern % each] + list(spider_args)
+        logging.info("Shard %d: %s" % (each, " ".join(command)))
+        processes.append(subprocess.Popen(command))
+    return [each.wait() for each in processes]
+
+def merge_shards(output_path, shard_paths, costars = False):
+    """
+    merge_shards(output_path, shard_paths, costars = False)
+        -> dict of row numbers
+
+    Combine databases of shards into database of given path, created if
+    it doesn't exist. Return number of rows copied from each table.
+    """
+    from douban import Sqlite3Host
+    db = Sqlite3Host(output_path, costars = costars)
+    db.start()
+    totals = {}
+    try:
+        for each in shard_paths:
+            counts = db.merge(each)
+            for table, count in counts.items():
+                totals[table] = totals.get(table, 0) + count
+    finally:
+        db.stop()
+    return totals
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description="""
+    Run a sharded crawl on this machine, and merge databases of shards.
+    Arguments after "--" are passed to douban.py of each shard, for
+    example: shard.py -n 4 --merge merged.db -- -m 100 -s <seed URL>
+    """)
+    parser.add_argument('-n',\
+                        '--shards', \
+                        default="0", \
+                        help="Number of local shard processes to run. "
+                             "0 means merge only.")
+    parser.add_argument('--spool', \
+                        default="ruuxee_douban_spool", \
+                        help="Spool directory of shards.")
+    parser.add_argument('-d',\
+                        '--db', \
+                        default="ruuxee_douban_spider-%d.db", \
+                        help="Pattern of database path of each shard.")
+    parser.add_argument('-l',\
+                        '--log', \
+                        default="ruuxee_douban_spider-%d.log", \
+                        help="Pattern of log path of each shard.")
+    parser.add_argument('--merge', \
+                        default="", \
+                        help="Database to merge shards into. Empty means "
+                             "no merge.")
+    parser.add_argument('--costars', \
+                        action="store_true", \
+                        help="Keep a co-stars table in merged database.")
+    parser.add_argument('inputs', \
+                        nargs="*", \
+                        help="Databases of shards to merge, besides those "
+                             "run by --shards.")
+    argv = sys.argv[1:]
+    spider_args = []
+    if '--' in argv:
+        spider_args = argv[argv.index('--') + 1:]
+        argv = argv[:argv.index('--')]
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO)
+    shards = int(args.shards)
+    inputs = list(args.inputs)
+    if shards > 0:
+        codes = run_local_shards(shards, args.spool, args.db, args.log, \
+                                 spider_args)
+        print("Shards exited with %s." % codes)
+        if any(codes):
+            sys.exit(1)
+        inputs = [args.db % each for each in range(shards)] + inputs
+    if args.merge:
+        counts = merge_shards(args.merge, inputs, costars = args.costars)
+        for table in sorted(counts):
+            print("%-30s %8d rows" % (table, counts[table]))
@@ -0,0 +1,360 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import io
+import sys
+import re
+import time
+import gzip
+import socket
+import hashlib
+import logging
+import threading
+
+# Python 2/3 compatibility hack: Import correct libraries
+ver = sys.version[0]
+if ver == '2':
+    import BaseHTTPServer as HS
+    import SocketServer as SS
+elif ver == '3':
+    import http.server as HS
+    import socketserver as SS
+else:
+    raise Exception("Support Python runtime version")
+
+class DoubanStandin(object):
+    """
+    A local HTTP server serving canned Douban pages. It's used to
+    benchmark spiders without touching movie.douban.com.
+
+    The server works as an HTTP proxy: requests like
+    "GET http://movie.douban.com/subject/1/" are answered from canned
+    pages, so spiders don't need to rewrite any URL. Plain paths like
+    "/subject/1/" are accepted as well.
+
+    Canned pages form a closed graph: movie Ids are in range
+    [1, movies], and each movie links to related movies and
+    celebrities inside the graph.
+    """
+    __movie_path = re.compile(r'^(?:http:\/\/[^\/]+)?\/subject\/([0-9]+)\/')
+    __celebrity_path = re.compile(r'^(?:http:\/\/[^\/]+)?\/celebrity\/([0-9]+)\/')
+    __search_path = re.compile(r'^(?:http:\/\/[^\/]+)?\/search\/(.+)$')
+
+    def __init__(self, port = 0, latency_secs = 0, movies = 1000, \
+                 celebrities = 3000, related_movies = 10, actors = 8):
+        """
+        DoubanStandin.__init__(self, port = 0, latency_secs = 0,
+                               movies = 1000, celebrities = 3000,
+                               related_movies = 10, actors = 8)
+
+        Create a stand-in server. Port 0 means any free port. Each
+        response is delayed by latency_secs to simulate network.
+        """
+        self.__port = port
+        self.__latency = latency_secs
+        self.__movies = movies
+        self.__celebrities = celebrities
+        self.__related_movies = related_movies
+        self.__actors = actors
+        self.__server = None
+        self.__thread = None
+        self.__lock = threading.Lock()
+        self.__served_pages = 0
+        self.__served_bytes = 0
+        self.__connections = set()
+
+    def start(self):
+        if self.__server is not None:
+            return
+        standin = self
+        class Handler(HS.BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            # Headers and body are written separately. Don't let them
+            # wait for delayed ACK of keep-alive clients.
+            disable_nagle_algorithm = True
+            def setup(self):
+                HS.BaseHTTPRequestHandler.setup(self)
+                standin._track(self.connection, True)
+            def finish(self):
+                standin._track(self.connection, False)
+                HS.BaseHTTPRequestHandler.finish(self)
+            def do_GET(self):
+                standin._handle(self)
+            def log_message(self, format, *args):
+                logging.debug("DoubanStandin: " + format, *args)
+        class Server(SS.ThreadingMixIn, HS.HTTPServer):
+            daemon_threads = True
+            allow_reuse_address = True
+            request_queue_size = 128
+            def handle_error(self, request, client_address):
+                # Spiders may drop connections on stop. It's expected.
+                logging.debug("DoubanStandin: Connection from %s:%d lost." \
+                        % client_address)
+        self.__server = Server(('127.0.0.1', self.__port), Handler)
+        self.__thread = threading.Thread(target=self.__server.serve_forever)
+        self.__thread.daemon = True
+        self.__thread.start()
+        logging.info("DoubanStandin: Listen on %s:%d" % self.address())
+
+    def stop(self):
+        if self.__server is None:
+            return
+        self.__server.shutdown()
+        self.__server.server_close()
+        # Keep-alive clients may still hold connections. Close them so
+        # handler threads exit.
+        with self.__lock:
+            connections = list(self.__connections)
+        for each in connections:
+            try:
+                each.shutdown(socket.SHUT_RDWR)
+            except socket.error as e:
+                pass
+        self.__thread.join()
+        self.__server = None
+        self.__thread = None
+
+    def address(self):
+        return self.__server.server_address
+
+    def proxy_url(self):
+        return "http://%s:%d" % self.address()
+
+    def served_pages(self):
+        return self.__served_pages
+
+    def served_bytes(self):
+        return self.__served_bytes
+
+    def page(self, path):
+        """
+        DoubanStandin.page(self, path) -> (status, HTML content)
+
+        Return canned page for given path or full URL.
+        """
+        matched = DoubanStandin.__movie_path.match(path)
+        if matched is not None:
+            movie_id = int(matched.group(1))
+            if 1 <= movie_id <= self.__movies:
+                return 200, self.movie_page(movie_id)
+            return 404, u"<html><body>Not found</body></html>"
+        matched = DoubanStandin.__celebrity_path.match(path)
+        if matched is not None:
+            return 200, self.celebrity_page(int(matched.group(1)))
+        matched = DoubanStandin.__search_path.match(path)
+        if matched is not None:
+            return 200, self.search_page(matched.group(1))
+        return 404, u"<html><body>Not found</body></html>"
+
+    def movie_page(self, movie_id):
+        related = []
+        for i in range(self.__related_movies):
+            related_id = (movie_id * 7 + i * 13) % self.__movies + 1
+            related.append(u'<dl><dt><a href="http://movie.douban.com/'
+                           u'subject/%d/?from=subject-page">'
+                           u'<img src="x.jpg" alt="Movie %d"/></a></dt>'
+                           u'<dd><a href="http://movie.douban.com/subject/'
+                           u'%d/?from=subject-page">Movie %d</a></dd></dl>' \
+                           % (related_id, related_id, related_id, related_id))
+        actors = []
+        for i in range(self.__actors):
+            celebrity_id = self.__celebrity_id(movie_id * 5 + i)
+            actors.append(u'<a href="/celebrity/%d/" rel="v:starring">'
+                          u'Actor %d</a>' % (celebrity_id, celebrity_id))
+        # Every tenth movie has an actor known by name only.
+        if movie_id % 10 == 0:
+            actors.append(u'<a href="/search/Someone%d">Someone %d</a>' \
+                          % (movie_id, movie_id))
+        director_id = self.__celebrity_id(movie_id)
+        writer_id = self.__celebrity_id(movie_id * 3)
+        return u'''<!DOCTYPE html>
+<html lang="zh-cmn-Hans">
+<head><meta charset="utf-8"><title>Movie %(id)d (豆瓣)</title></head>
+<body>
+<div id="wrapper">
+<div id="content">
+<h1>
+  <span property="v:itemreviewed">Movie %(id)d</span>
+  <span class="year">(%(year)d)</span>
+</h1>
+<div class="grid-16-8 clearfix">
+<div class="article">
+<div id="info">
+  <span ><span class='pl'>导演</span>: <span class='attrs'><a href="/celebrity/%(director)d/" rel="v:directedBy">Director %(director)d</a></span></span><br/>
+  <span ><span class='pl'>编剧</span>: <span class='attrs'><a href="/celebrity/%(writer)d/">Writer %(writer)d</a></span></span><br/>
+  <span class="actor"><span class='pl'>主演</span>: <span class='attrs'>%(actors)s</span></span><br/>
+  <span class="pl">类型:</span> <span property="v:genre">剧情</span><br/>
+  <span class="pl">制片国家/地区:</span> 美国<br/>
+  <span class="pl">语言:</span> 英语<br/>
+  <span class="pl">上映日期:</span> <span property="v:initialReleaseDate" content="%(year)d-05-01(美国)">%(year)d-05-01(美国)</span><br/>
+  <span class="pl">片长:</span> <span property="v:runtime" content="120">120分钟</span><br/>
+</div>
+<div class="related-info">
+  <span property="v:summary">%(summary)s</span>
+</div>
+<div id="recommendations">
+  <h2><i>喜欢这部电影的人也喜欢</i></h2>
+  <div class="recommendations-bd">
+  %(related)s
+  </div>
+</div>
+<div id="comments">%(comments)s</div>
+</div>
+</div>
+</div>
+</div>
+</body>
+</html>
+''' % {'id': movie_id,
+       'year': 1950 + movie_id % 65,
+       'director': director_id,
+       'writer': writer_id,
+       'actors': u' / '.join(actors),
+       'related': u'\n'.join(related),
+       'summary': u'一个关于电影的故事。' * 40,
+       'comments': u'<div class="comment"><p>不错的电影。</p></div>' * 60}
+
+    def celebrity_page(self, celebrity_id):
+        return u'''<!DOCTYPE html>
+<html lang="zh-cmn-Hans">
+<head><meta charset="utf-8"><title>Actor %(id)d (豆瓣)</title></head>
+<body>
+<div id="content">
+<h1>Actor %(id)d</h1>
+<div class="info">
+  <ul>
+    <li><span>性别</span>: %(gender)s</li>
+    <li><span>星座</span>: 天秤座</li>
+    <li><span>出生日期</span>: %(year)d-10-%(day)02d</li>
+    <li><span>出生地</span>: 中国,北京</li>
+    <li><span>imdb编号</span>: <a href="http://www.imdb.com/name/nm%(id)07d" target="_blank">nm%(id)07d</a></li>
+  </ul>
+</div>
+<div id="intro">%(intro)s</div>
+</div>
+</body>
+</html>
+''' % {'id': celebrity_id,
+       'gender': u'男' if celebrity_id % 2 else u'女',
+       'year': 1920 + celebrity_id % 80,
+       'day': celebrity_id % 28 + 1,
+       'intro': u'演员简介。' * 60}
+
+    def search_page(self, name):
+        # Some searches give nothing, which makes a dead link.
+        if sum(ord(c) for c in name) % 3 == 0:
+            return u'''<html><head><meta charset="utf-8"></head><body>
+<div id="content"><p>没有找到相关结果</p></div></body></html>'''
+        celebrity_id = self.__celebrity_id(len(name) * 31)
+        return u'''<html><head><meta charset="utf-8"></head><body>
+<div id="content"><div class="result">
+<h3><a href="http://movie.douban.com/celebrity/%d/">%s</a></h3>
+</div></div></body></html>''' % (celebrity_id, name)
+
+    def __gzip(self, body):
+        buf = io.BytesIO()
+        with gzip.GzipFile(fileobj=buf, mode='wb') as f:
+            f.write(body)
+        return buf.getvalue()
+
+    def __celebrity_id(self, seed):
+        return 1000000 + seed % self.__celebrities
+
+    def _track(self, connection, opened):
+        with self.__lock:
+            if opened:
+                self.__connections.add(connection)
+            else:
+                self.__connections.discard(connection)
+
+    def _handle(self, handler):
+        if self.__latency > 0:
+            time.sleep(self.__latency)
+        status, content = self.page(handler.path)
+        body = content.encode('utf-8')
+        # Canned pages never change, so a digest is a good ETag.
+        etag = '"%s"' % hashlib.md5(body).hexdigest()
+        if status == 200 and \
+                handler.headers.get('If-None-Match', '') == etag:
+            handler.send_response(304)
+            handler.send_header("ETag", etag)
+            handler.send_header("Content-Length", "0")
+            handler.end_headers()
+            with self.__lock:
+                self.__served_pages += 1
+            return
+        handler.send_response(status)
+        handler.send_header("Content-Type", "text/html; charset=utf-8")
+        handler.send_header("ETag", etag)
+        if 'gzip' in handler.headers.get('Accept-Encoding', ''):
+            body = self.__gzip(body)
+            handler.send_header("Content-Encoding", "gzip")
+        handler.send_header("Content-Length", str(len(body)))
+        handler.end_headers()
+        handler.wfile.write(body)
+        with self.__lock:
+            self.__served_pages += 1
+            self.__served_bytes += len(body)
+
+
+class ReplayStandin(DoubanStandin):
+    """
+    A stand-in server replaying pages of a :PageCorpus:, recorded from
+    Douban or another stand-in. Unlike canned pages, recorded pages
+    don't change when code of this module changes, so results of
+    benchmarks against them can be compared over time.
+
+    Pages not in corpus are answered with 404, and counted.
+    """
+    def __init__(self, corpus, port = 0, latency_secs = 0):
+        """
+        ReplayStandin.__init__(self, corpus, port = 0, latency_secs = 0)
+        """
+        DoubanStandin.__init__(self, port = port, \
+                               latency_secs = latency_secs)
+        self.__corpus = corpus
+        self.__lock = threading.Lock()
+        self.__missed_pages = 0
+
+    def missed_pages(self):
+        return self.__missed_pages
+
+    def page(self, path):
+        if path.startswith("/"):
+            path = "http://movie.douban.com" + path
+        content = self.__corpus.page(path)
+        if content is None:
+            with self.__lock:
+                self.__missed_pages += 1
+            return 404, u"<html><body>Not found</body></html>"
+        return 200, content
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description="""
+    Serve canned Douban pages on local port. Use it as HTTP proxy of
+    spider, for example: http_proxy=http://127.0.0.1:8000
+    """)
+    parser.add_argument('-p',\
+                        '--port', \
+                        default="8000", \
+                        help="Port to listen.")
+    parser.add_argument('-l',\
+                        '--latency', \
+                        default="0", \
+                        help="Latency of each response in seconds.")
+    parser.add_argument('-m',\
+                        '--movies', \
+                        default="1000", \
+                        help="Number of movies in canned graph.")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    standin = DoubanStandin(port = int(args.port), \
+                            latency_secs = float(args.latency), \
+                            movies = int(args.movies))
+    standin.start()
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        standin.stop()
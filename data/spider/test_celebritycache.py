@@ -0,0 +1,117 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import os
+import sys
+import shutil
+import tempfile
+import threading
+import unittest
+
+# Spider modules import each other without package.
+_SPIDER_DIR = os.path.dirname(os.path.abspath(__file__))
+if _SPIDER_DIR not in sys.path:
+    sys.path.insert(0, _SPIDER_DIR)
+from douban import Celebrity, Sqlite3Host, Spider
+from celebritycache import CelebrityCache
+from standin import DoubanStandin
+
+class FakeHost(object):
+    def load_celebrity_ids(self):
+        return []
+    def load_celebrity_aliases(self):
+        return {}
+    def save_celebrity_aliases(self, aliases, commit = True):
+        pass
+
+class FlakyStandin(DoubanStandin):
+    """
+    A stand-in failing the first request of each celebrity page.
+    """
+    def __init__(self, **kwargs):
+        DoubanStandin.__init__(self, **kwargs)
+        self.failed_paths = set()
+        self.__lock = threading.Lock()
+
+    def page(self, path):
+        if '/celebrity/' in path:
+            with self.__lock:
+                if path not in self.failed_paths:
+                    self.failed_paths.add(path)
+                    return 503, u"<html><body>Busy</body></html>"
+        return DoubanStandin.page(self, path)
+
+class CelebrityCacheTest(unittest.TestCase):
+    def test_failed_fetch_is_released(self):
+        cache = CelebrityCache(FakeHost())
+        celebrity = Celebrity('1000001')
+        self.assertTrue(cache.resolve(celebrity))
+        cache.fetched(celebrity, '1000001', failed = True)
+        self.assertFalse(cache.owns(celebrity))
+        self.assertEqual(cache.saved_count(), 0)
+        # The next movie claims it again.
+        retry = Celebrity('1000001')
+        self.assertTrue(cache.resolve(retry))
+        cache.fetched(retry, '1000001')
+        self.assertTrue(cache.owns(retry))
+
+    def test_fetched_celebrity_is_owned_once(self):
+        cache = CelebrityCache(FakeHost())
+        celebrity = Celebrity('1000002')
+        self.assertTrue(cache.resolve(celebrity))
+        cache.fetched(celebrity, '1000002')
+        self.assertTrue(cache.owns(celebrity))
+        cache.saved(celebrity)
+        self.assertFalse(cache.resolve(Celebrity('1000002')))
+
+class FailedCelebrityTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.db_path = os.path.join(self.directory, 'crawl.db')
+        self.standin = FlakyStandin(movies = 20)
+        self.standin.start()
+        self.proxy = os.environ.get('http_proxy')
+        os.environ['http_proxy'] = self.standin.proxy_url()
+
+    def tearDown(self):
+        if self.proxy is None:
+            del os.environ['http_proxy']
+        else:
+            os.environ['http_proxy'] = self.proxy
+        self.standin.stop()
+        shutil.rmtree(self.directory)
+
+    def crawl(self, spider):
+        done = threading.Event()
+        spider.set_complete_callback(done.set)
+        spider.set_movie_seed('1')
+        spider.start()
+        self.assertTrue(done.wait(60))
+
+    def check_failed_celebrities(self):
+        failed = set(path.rstrip('/').rsplit('/', 1)[-1] \
+                     for path in self.standin.failed_paths)
+        self.assertTrue(len(failed) > 0)
+        db = Sqlite3Host(self.db_path)
+        db.start()
+        try:
+            saved = set(db.load_celebrity_ids())
+        finally:
+            db.stop()
+        # Failed in the only movie they appear in: neither saved nor
+        # taken as seen by next run.
+        self.assertEqual(failed & saved, set())
+
+    def test_spider(self):
+        self.crawl(Spider(Sqlite3Host(self.db_path), max_movies = 1, \
+                          fetch_gap_in_secs = 0))
+        self.check_failed_celebrities()
+
+    @unittest.skipIf(sys.version_info < (3, 5), "Requires asyncio.")
+    def test_async_spider(self):
+        from asyncspider import AsyncSpider
+        self.crawl(AsyncSpider(Sqlite3Host(self.db_path), max_movies = 1, \
+                               proxy = self.standin.address()))
+        self.check_failed_celebrities()
+
+if __name__ == '__main__':
+    unittest.main()
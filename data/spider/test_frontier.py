@@ -0,0 +1,68 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import os
+import sys
+import time
+import unittest
+
+# Spider modules import each other without package.
+_SPIDER_DIR = os.path.dirname(os.path.abspath(__file__))
+if _SPIDER_DIR not in sys.path:
+    sys.path.insert(0, _SPIDER_DIR)
+from frontier import CrawlFrontier
+
+class FakeHost(object):
+    def load_movie_ids(self):
+        return []
+    def load_partial_movie_ids(self):
+        return []
+    def save_partial_movie_ids(self, douban_ids, commit = True):
+        pass
+
+class CrawlFrontierTest(unittest.TestCase):
+    def test_failed_movie_waits_for_retry(self):
+        for strategy in CrawlFrontier.STRATEGIES:
+            frontier = CrawlFrontier(FakeHost(), strategy, \
+                                     max_attempts = 3, \
+                                     retry_delay_secs = 0.05)
+            frontier.push('1')
+            self.assertEqual(frontier.pop(), '1')
+            self.assertTrue(frontier.fail('1'))
+            # Pending, but not before its delay is over.
+            self.assertEqual(frontier.pending_count(), 1)
+            self.assertEqual(frontier.pop(), None)
+            self.assertTrue(0 < frontier.retry_wait_secs() <= 0.05)
+            time.sleep(0.06)
+            self.assertEqual(frontier.pop(), '1')
+            # Delay doubles.
+            self.assertTrue(frontier.fail('1'))
+            self.assertTrue(frontier.retry_wait_secs() > 0.05)
+
+    def test_movie_failing_too_many_times_is_dropped(self):
+        frontier = CrawlFrontier(FakeHost(), max_attempts = 2, \
+                                 retry_delay_secs = 0)
+        frontier.push('1')
+        self.assertEqual(frontier.pop(), '1')
+        self.assertTrue(frontier.fail('1'))
+        self.assertEqual(frontier.pop(), '1')
+        self.assertFalse(frontier.fail('1'))
+        self.assertEqual(frontier.pending_count(), 0)
+        self.assertEqual(frontier.retry_wait_secs(), None)
+        self.assertEqual(frontier.dropped_movie_count(), 1)
+        # Still seen, so it's not queued again in this run.
+        self.assertFalse(frontier.push('1'))
+
+    def test_done_movie_resets_attempts(self):
+        frontier = CrawlFrontier(FakeHost(), max_attempts = 2, \
+                                 retry_delay_secs = 0)
+        frontier.push('1')
+        frontier.pop()
+        frontier.fail('1')
+        frontier.pop()
+        frontier.movie_done('1')
+        frontier.revisit(['1'])
+        self.assertEqual(frontier.pop(), '1')
+        self.assertTrue(frontier.fail('1'))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,218 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import os
+import sys
+import ssl
+import select
+import socket
+import threading
+import unittest
+
+# Spider modules import each other without package.
+_SPIDER_DIR = os.path.dirname(os.path.abspath(__file__))
+if _SPIDER_DIR not in sys.path:
+    sys.path.insert(0, _SPIDER_DIR)
+from httpclient import HttpConnectionPool
+
+# Python 2/3 compatibility hack: Import correct libraries
+ver = sys.version[0]
+if ver == '2':
+    import BaseHTTPServer as HS
+    import SocketServer as SS
+elif ver == '3':
+    import http.server as HS
+    import socketserver as SS
+else:
+    raise Exception("Support Python runtime version")
+
+# Self-signed key and certificate of localhost and 127.0.0.1.
+CERTIFICATE = os.path.join(_SPIDER_DIR, "fixtures", "localhost_test.pem")
+
+class ThreadingServer(SS.ThreadingMixIn, HS.HTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # Clients refusing certificate drop connection in handshake.
+        pass
+
+class RedirectHandler(HS.BaseHTTPRequestHandler):
+    """
+    Serve /page, and redirect other paths to the target of server.
+    """
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        if self.path == "/page":
+            self.reply(200, {}, b"page of %s" % \
+                       self.server.scheme.encode('ascii'))
+        else:
+            self.reply(301, {'Location': self.server.target}, b"")
+
+    def reply(self, status, headers, body):
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+class TunnelHandler(SS.BaseRequestHandler):
+    """
+    A proxy taking CONNECT only.
+    """
+    def handle(self):
+        request = b""
+        while b"\r\n\r\n" not in request:
+            data = self.request.recv(4096)
+            if not data:
+                return
+            request += data
+        method, target = request.split(b" ")[:2]
+        if method != b"CONNECT":
+            self.request.sendall(b"HTTP/1.1 405 Not Allowed\r\n\r\n")
+            return
+        host, port = target.decode('ascii').rsplit(":", 1)
+        self.server.tunnels.append(target)
+        upstream = socket.create_connection((host, int(port)))
+        self.request.sendall(b"HTTP/1.1 200 Connection established\r\n\r\n")
+        try:
+            sockets = [self.request, upstream]
+            while True:
+                readable = select.select(sockets, [], [], 5)[0]
+                if len(readable) == 0:
+                    break
+                for each in readable:
+                    data = each.recv(16384)
+                    if not data:
+                        return
+                    other = upstream if each is self.request else self.request
+                    other.sendall(data)
+        finally:
+            upstream.close()
+
+class ServerTestCase(unittest.TestCase):
+    """
+    An https server serving /page, and an http server redirecting to
+    /moved of https server, which redirects to /page.
+    """
+    def setUp(self):
+        self.proxies = dict((name, os.environ.pop(name)) \
+                            for name in ('http_proxy', 'HTTP_PROXY', \
+                                         'https_proxy', 'HTTPS_PROXY') \
+                            if name in os.environ)
+        self.servers = []
+        self.https = self.serve("https")
+        self.https.target = "/page"
+        context = ssl.SSLContext(getattr(ssl, 'PROTOCOL_TLS_SERVER', \
+                                         ssl.PROTOCOL_SSLv23))
+        context.load_cert_chain(CERTIFICATE)
+        self.https.socket = context.wrap_socket(self.https.socket, \
+                                                server_side = True)
+        self.http = self.serve("http")
+        self.http.target = "https://localhost:%d/moved" % \
+                self.https.server_address[1]
+
+    def tearDown(self):
+        for each in self.servers:
+            each.shutdown()
+            each.server_close()
+        os.environ.update(self.proxies)
+
+    def serve(self, scheme):
+        server = ThreadingServer(("127.0.0.1", 0), RedirectHandler)
+        server.scheme = scheme
+        thread = threading.Thread(target = server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        self.servers.append(server)
+        return server
+
+    def serve_proxy(self):
+        proxy = SS.ThreadingTCPServer(("127.0.0.1", 0), TunnelHandler)
+        proxy.daemon_threads = True
+        proxy.tunnels = []
+        thread = threading.Thread(target = proxy.serve_forever)
+        thread.daemon = True
+        thread.start()
+        self.servers.append(proxy)
+        return proxy
+
+class HttpConnectionPoolTest(ServerTestCase):
+    def setUp(self):
+        ServerTestCase.setUp(self)
+        self.pool = HttpConnectionPool( \
+                ssl_context = ssl.create_default_context(cafile = CERTIFICATE))
+
+    def tearDown(self):
+        self.pool.close()
+        ServerTestCase.tearDown(self)
+
+    def test_redirect_to_https(self):
+        url = "http://127.0.0.1:%d/subject/1/" % self.http.server_address[1]
+        response = self.pool.get(url)
+        self.assertEqual(response.status(), 200)
+        self.assertEqual(response.url(), "https://localhost:%d/page" % \
+                         self.https.server_address[1])
+        self.assertEqual(response.body(), b"page of https")
+        # Connection is kept for next request.
+        response = self.pool.get(url)
+        self.assertEqual(response.body(), b"page of https")
+
+    def test_https_through_proxy(self):
+        proxy = self.serve_proxy()
+        os.environ['https_proxy'] = "http://127.0.0.1:%d" % \
+                proxy.server_address[1]
+        url = "https://localhost:%d/moved" % self.https.server_address[1]
+        response = self.pool.get(url)
+        self.assertEqual(response.body(), b"page of https")
+        self.assertEqual(proxy.tunnels, \
+                         [("localhost:%d" % self.https.server_address[1]) \
+                          .encode('ascii')])
+
+    def test_unverified_https_fails(self):
+        pool = HttpConnectionPool()
+        url = "https://localhost:%d/page" % self.https.server_address[1]
+        self.assertRaises(ssl.SSLError, pool.get, url)
+
+@unittest.skipIf(sys.version_info < (3, 5), "Requires asyncio.")
+class AsyncSpiderRedirectTest(ServerTestCase):
+    """
+    Redirects followed by :AsyncSpider:, with the same servers.
+    """
+    def get(self, url, proxy = None):
+        import asyncio
+        from asyncspider import AsyncSpider
+        context = ssl.create_default_context(cafile = CERTIFICATE)
+        spider = AsyncSpider(None, proxy = proxy, ssl_context = context)
+        loop = asyncio.new_event_loop()
+        try:
+            return loop.run_until_complete( \
+                    spider._AsyncSpider__get_follow(url))
+        finally:
+            loop.close()
+
+    def test_redirect_to_https(self):
+        url = "http://127.0.0.1:%d/subject/1/" % self.http.server_address[1]
+        body, charset = self.get(url)
+        self.assertEqual(body, b"page of https")
+
+    def test_https_through_proxy(self):
+        if sys.version_info < (3, 11):
+            self.skipTest("Requires StreamWriter.start_tls().")
+        proxy = self.serve_proxy()
+        url = "https://localhost:%d/moved" % self.https.server_address[1]
+        body, charset = self.get(url, proxy = proxy.server_address)
+        self.assertEqual(body, b"page of https")
+        # A tunnel for each request, as connections are not kept.
+        self.assertEqual(len(proxy.tunnels), 2)
+
+    def test_relative_redirect(self):
+        url = "https://localhost:%d/moved" % self.https.server_address[1]
+        body, charset = self.get(url)
+        self.assertEqual(body, b"page of https")
+
+if __name__ == '__main__':
+    unittest.main()
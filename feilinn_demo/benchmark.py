@@ -0,0 +1,118 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+'''
+  Copyright (c) 2014 Present Inc.
+
+  Benchmark of startup and template rendering of views under settings
+  profiles. Each profile runs in its own process, which imports wsgi.py
+  like a server does. Views are rendered with canned data, so neither
+  MongoDB nor crawl database is needed.
+'''
+
+import os
+import sys
+import json
+import time
+import subprocess
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def sample_views():
+    '''
+    sample_views() -> dict from view name to (path, template, context)
+    '''
+    cast = [{'douban_id': str(1000000 + i), 'name': u'演员 %d' % i, \
+             'profession': 3} for i in range(3)]
+    questions = [{'douban_id': str(i), 'title': u'电影 %d' % i, \
+                  'year': '2014', 'region': u'中国大陆', 'cast': cast} \
+                 for i in range(10)]
+    domain = {'title': u'领域',
+              'domain_list': [{'name': u'领域 %d' % i} for i in range(8)],
+              'question_list': questions,
+              'people_list': [{'username': u'用户 %d' % i} \
+                              for i in range(10)]}
+    return {'domain': ('/domain/', 'domain.html', domain),
+            'topic': ('/topic/', 'topic.html', {'title': u'话题'})}
+
+def bench_profile(settings_module, rounds):
+    '''
+    bench_profile(settings_module, rounds) -> dict
+
+    Run in a process of its own. Import wsgi.py with given settings,
+    then render each view once, and rounds times more. Fragment caches
+    are cleared before each rendering, so they don't hide its cost.
+    '''
+    os.environ['DJANGO_SETTINGS_MODULE'] = settings_module
+    begin = time.time()
+    import feilinn_demo.wsgi
+    startup = time.time() - begin
+    from django.conf import settings
+    from django.core.cache import caches
+    from django.contrib.auth.models import AnonymousUser
+    from django.template import RequestContext
+    from django.template.loader import render_to_string
+    from django.test import RequestFactory
+    host = 'localhost'
+    if settings.ALLOWED_HOSTS and settings.ALLOWED_HOSTS[0] != '*':
+        host = settings.ALLOWED_HOSTS[0].lstrip('.')
+    factory = RequestFactory(HTTP_HOST = host)
+    result = {'settings': settings_module, 'startup': startup, 'views': {}}
+    for name, (path, template, context) in sample_views().items():
+        request = factory.get(path)
+        request.user = AnonymousUser()
+        elapsed = []
+        for i in range(rounds + 1):
+            caches['template_fragments'].clear()
+            begin = time.time()
+            render_to_string(template, context, \
+                             context_instance = RequestContext(request))
+            elapsed.append(time.time() - begin)
+        result['views'][name] = {'first': elapsed[0],
+                                 'mean': sum(elapsed[1:]) / rounds}
+    return result
+
+def run_profile(settings_module, rounds):
+    '''
+    run_profile(settings_module, rounds) -> dict
+
+    Run bench_profile() in a new process.
+    '''
+    output = subprocess.check_output([sys.executable, \
+                                      os.path.abspath(__file__), \
+                                      '--child', settings_module, \
+                                      '--rounds', str(rounds)])
+    return json.loads(output.decode('utf-8').splitlines()[-1])
+
+def print_result(result):
+    for name, times in sorted(result['views'].items()):
+        print("%-34s %9.1f ms %-8s %9.2f ms %9.2f ms" % \
+                (result['settings'], result['startup'] * 1000, name, \
+                 times['first'] * 1000, times['mean'] * 1000))
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description="""
+    Benchmark startup and rendering of views under settings profiles.
+    """)
+    parser.add_argument('-s',\
+                        '--settings', \
+                        default="feilinn_demo.settings,"
+                                "feilinn_demo.settings_production", \
+                        help="Comma separated settings modules.")
+    parser.add_argument('-r',\
+                        '--rounds', \
+                        default="200", \
+                        help="Times to render each view after first.")
+    parser.add_argument('--child', \
+                        default="", \
+                        help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if BASE_DIR not in sys.path:
+        sys.path.insert(0, BASE_DIR)
+    if args.child:
+        print(json.dumps(bench_profile(args.child, int(args.rounds))))
+        sys.exit(0)
+    print("%-34s %12s %-8s %12s %12s" % \
+            ("settings", "startup", "view", "first", "mean"))
+    for each in args.settings.split(","):
+        print_result(run_profile(each, int(args.rounds)))
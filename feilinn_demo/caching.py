@@ -0,0 +1,106 @@
+# -*- coding: UTF-8 -*-
+'''
+  Copyright (c) 2014 Present Inc.
+'''
+
+import hashlib
+import threading
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends import locmem, filebased
+from django.utils import translation
+
+# Backends are created per thread, so counters are kept here by cache
+# location.
+_stats_lock = threading.Lock()
+_stats = {}
+_missing = object()
+
+def _count(location, hit):
+    with _stats_lock:
+        counters = _stats.setdefault(location, {'hits': 0, 'misses': 0})
+        counters['hits' if hit else 'misses'] += 1
+
+def stats():
+    '''
+    stats() -> dict
+
+    Return hits, misses and hit rate of get() of each counting cache in
+    this process, by location.
+    '''
+    with _stats_lock:
+        result = {}
+        for location, counters in _stats.items():
+            total = counters['hits'] + counters['misses']
+            result[location] = dict(counters)
+            result[location]['hit_rate'] = \
+                    float(counters['hits']) / total if total else 0.0
+        return result
+
+class CountingCacheMixin(object):
+    '''
+    Count hits and misses of get() of a cache backend.
+    '''
+    def __init__(self, location, params):
+        super(CountingCacheMixin, self).__init__(location, params)
+        self.__location = location
+
+    def get(self, key, default = None, version = None):
+        value = super(CountingCacheMixin, self).get(key, _missing, version)
+        _count(self.__location, value is not _missing)
+        if value is _missing:
+            return default
+        return value
+
+class LocMemCache(CountingCacheMixin, locmem.LocMemCache):
+    pass
+
+class FileBasedCache(CountingCacheMixin, filebased.FileBasedCache):
+    pass
+
+def _response_key(request):
+    raw = u'%s|%s|%s' % (request.get_host(), translation.get_language(), \
+                         request.get_full_path())
+    return 'response:%s' % hashlib.md5(raw.encode('utf-8')).hexdigest()
+
+def cache_anonymous(timeout = None):
+    '''
+    cache_anonymous(timeout = None) -> decorator
+
+    Cache whole responses of a view for anonymous users, keyed on host,
+    language and full path, in default cache. Only GET and HEAD
+    responses of status 200 setting no cookie are kept. Timeout defaults
+    to RESPONSE_CACHE_TIMEOUT.
+
+    Responses are pickled by cache, so changes of middlewares on a
+    served response never go back to cache.
+    '''
+    if timeout is None:
+        timeout = settings.RESPONSE_CACHE_TIMEOUT
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if request.method not in ('GET', 'HEAD') or \
+                    request.user.is_authenticated():
+                return view(request, *args, **kwargs)
+            cache = caches['default']
+            key = _response_key(request)
+            response = cache.get(key)
+            if response is not None:
+                return response
+            response = view(request, *args, **kwargs)
+            if response.status_code == 200 and not response.cookies and \
+                    not response.streaming:
+                cache.set(key, response, timeout)
+            return response
+        return wrapper
+    return decorator
+
+def fragment_timeouts(request):
+    '''
+    A context processor giving timeouts to {% cache %} tags of templates.
+    '''
+    return {'fragment_cache_timeout': settings.FRAGMENT_CACHE_TIMEOUT,
+            'list_cache_timeout': settings.DATA_CACHE_TTL}
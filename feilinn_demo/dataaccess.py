@@ -0,0 +1,190 @@
+# -*- coding: UTF-8 -*-
+'''
+  Copyright (c) 2014 Present Inc.
+'''
+
+import os
+import sys
+import time
+import logging
+import threading
+
+from django.conf import settings
+from mongoengine import signals
+from feilinn_demo.models import User, Domain
+
+# Spider modules import each other without package.
+_SPIDER_DIR = os.path.join(settings.BASE_DIR, 'data', 'spider')
+if _SPIDER_DIR not in sys.path:
+    sys.path.append(_SPIDER_DIR)
+from douban import Sqlite3Host
+
+DOMAIN_LIST_SIZE = 8
+QUESTION_LIST_SIZE = 10
+PEOPLE_LIST_SIZE = 10
+# Celebrities shown with each movie of question list.
+QUESTION_CAST_SIZE = 3
+
+class TTLCache(object):
+    '''
+    Values loaded by data access functions, kept for ttl_secs in this
+    process. Cached values are shared by all requests, and must not be
+    changed by callers.
+
+    A value is loaded by one thread at a time. Other threads asking for
+    it meanwhile get the expired value if there is one, or wait for it.
+    A value being loaded when it's invalidated is not kept.
+    '''
+    def __init__(self, ttl_secs):
+        self.__ttl = ttl_secs
+        self.__condition = threading.Condition()
+        # Key to (expiry time, value).
+        self.__entries = {}
+        self.__loading = set()
+        self.__generation = 0
+        self.__stats = {'hits': 0,
+                        'misses': 0,
+                        'invalidations': 0}
+
+    def get(self, key, loader):
+        '''
+        TTLCache.get(self, key, loader) -> value
+
+        Return cached value of key, or call loader() to load it.
+        '''
+        with self.__condition:
+            while True:
+                entry = self.__entries.get(key)
+                if entry is not None and \
+                        (entry[0] > time.time() or key in self.__loading):
+                    self.__stats['hits'] += 1
+                    return entry[1]
+                if key not in self.__loading:
+                    break
+                self.__condition.wait()
+            self.__loading.add(key)
+            self.__stats['misses'] += 1
+            generation = self.__generation
+        value = None
+        loaded = False
+        try:
+            value = loader()
+            loaded = True
+        finally:
+            with self.__condition:
+                self.__loading.discard(key)
+                if loaded and generation == self.__generation:
+                    self.__entries[key] = (time.time() + self.__ttl, value)
+                self.__condition.notify_all()
+        return value
+
+    def invalidate(self, key = None):
+        '''
+        TTLCache.invalidate(self, key = None)
+
+        Drop cached value of key, or all values if key is None.
+        '''
+        with self.__condition:
+            if key is None:
+                self.__entries.clear()
+            else:
+                self.__entries.pop(key, None)
+            self.__generation += 1
+            self.__stats['invalidations'] += 1
+
+    def stats(self):
+        with self.__condition:
+            return dict(self.__stats)
+
+_cache = TTLCache(settings.DATA_CACHE_TTL)
+# Connections of SQLite can't be shared between threads.
+_local = threading.local()
+
+def _crawl_db():
+    db = getattr(_local, 'crawl_db', None)
+    if db is None:
+        if not os.path.isfile(settings.CRAWL_DB):
+            # Nothing crawled yet.
+            return None
+        # Spider may be writing it. Never create tables or take a lock.
+        db = Sqlite3Host(settings.CRAWL_DB, read_only = True)
+        db.start()
+        _local.crawl_db = db
+    return db
+
+def domain_list():
+    '''
+    domain_list() -> list of dict
+
+    Return domains for domain page, with key name.
+    '''
+    return _cache.get('domain_list', _load_domains)
+
+def question_list():
+    '''
+    question_list() -> list of dict
+
+    Return latest movies of crawl database for domain page, with keys of
+    Sqlite3Host.latest_movies(), and cast for first celebrities of each.
+    '''
+    return _cache.get('question_list', _load_questions)
+
+def people_list():
+    '''
+    people_list() -> list of dict
+
+    Return users for domain page, with key username.
+    '''
+    return _cache.get('people_list', _load_people)
+
+def invalidate(name = None):
+    '''
+    invalidate(name = None)
+
+    Drop cached list of given name, e.g. "domain_list", or all lists if
+    name is None. Lists of Domain and User are dropped when a document
+    is saved or deleted in this process. Others expire in
+    DATA_CACHE_TTL seconds.
+    '''
+    _cache.invalidate(name)
+
+def cache_stats():
+    return _cache.stats()
+
+def _load_domains():
+    domains = Domain.objects.only('name').limit(DOMAIN_LIST_SIZE)
+    return [{'name': each.name} for each in domains]
+
+def _load_questions():
+    db = _crawl_db()
+    if db is None:
+        return []
+    movies = db.latest_movies(0, QUESTION_LIST_SIZE)
+    # One query for casts of all movies.
+    casts = db.movie_casts([each['douban_id'] for each in movies], \
+                           QUESTION_CAST_SIZE)
+    for each in movies:
+        each['cast'] = casts[each['douban_id']]
+    return movies
+
+def _load_people():
+    # Never load other fields, password among them.
+    users = User.objects.only('username').limit(PEOPLE_LIST_SIZE)
+    return [{'username': each.username} for each in users]
+
+def _on_domain_change(sender, document, **kwargs):
+    invalidate('domain_list')
+
+def _on_user_change(sender, document, **kwargs):
+    invalidate('people_list')
+
+# Signals of mongoengine need blinker. Without it, User and Domain
+# invalidate lists from save() and delete(), but not from bulk updates
+# or deletes of a queryset.
+if signals.signals_available:
+    for each_signal in (signals.post_save, signals.post_delete):
+        each_signal.connect(_on_domain_change, sender = Domain)
+        each_signal.connect(_on_user_change, sender = User)
+else:
+    logging.warning("dataaccess: blinker is not installed. Cached lists "
+                    "are not invalidated by bulk queryset changes.")
@@ -4,14 +4,54 @@
 '''
 
 from mongoengine import *
-from feilinn_demo.settings import DBNAME
+from mongoengine import signals
+from feilinn_demo import mongo
 
-connect(DBNAME)
+# Connected on first query.
+mongo.register()
+
+def _invalidate(name):
+    # Cached lists of dataaccess are dropped by signals, which need
+    # blinker. Without it, documents drop them on save() and delete().
+    if not signals.signals_available:
+        from feilinn_demo import dataaccess
+        dataaccess.invalidate(name)
 
 class User(Document):
     email       = StringField(max_length=120, required=True)
     username    = StringField(max_length=120, required=True)
     password    = StringField(max_length=120, required=True)
 
+    meta = {
+        'indexes': [
+            {'fields': ['email'], 'unique': True},
+            {'fields': ['username'], 'unique': True},
+        ]
+    }
+
+    def save(self, *args, **kwargs):
+        result = super(User, self).save(*args, **kwargs)
+        _invalidate('people_list')
+        return result
+
+    def delete(self, *args, **kwargs):
+        super(User, self).delete(*args, **kwargs)
+        _invalidate('people_list')
+
 class Domain(Document):
     name = StringField(max_length=120, required=True)
+
+    meta = {
+        'indexes': [
+            {'fields': ['name'], 'unique': True},
+        ]
+    }
+
+    def save(self, *args, **kwargs):
+        result = super(Domain, self).save(*args, **kwargs)
+        _invalidate('domain_list')
+        return result
+
+    def delete(self, *args, **kwargs):
+        super(Domain, self).delete(*args, **kwargs)
+        _invalidate('domain_list')
@@ -0,0 +1,66 @@
+# -*- coding: UTF-8 -*-
+'''
+  Copyright (c) 2014 Present Inc.
+'''
+
+import os
+import threading
+
+from django.conf import settings
+from mongoengine.connection import register_connection, disconnect, \
+                                   DEFAULT_CONNECTION_NAME
+from mongoengine.base.common import _document_registry
+
+# Process registering the connection. A forked child finds another pid
+# here, and drops the connection copied from its parent.
+_pid = None
+_lock = threading.Lock()
+
+def register():
+    '''
+    register()
+
+    Register connection of mongoengine documents from settings. Nothing
+    is connected until first query, which opens a pool of at most
+    MONGO_POOL_SIZE sockets.
+    '''
+    global _pid
+    _pid = os.getpid()
+    register_connection(DEFAULT_CONNECTION_NAME, settings.DBNAME, \
+                        host = settings.MONGO_HOST, \
+                        port = settings.MONGO_PORT, \
+                        max_pool_size = settings.MONGO_POOL_SIZE, \
+                        connectTimeoutMS = settings.MONGO_CONNECT_TIMEOUT_MS, \
+                        socketTimeoutMS = settings.MONGO_SOCKET_TIMEOUT_MS, \
+                        waitQueueTimeoutMS = \
+                                settings.MONGO_WAIT_QUEUE_TIMEOUT_MS)
+
+def ensure_process():
+    '''
+    ensure_process()
+
+    Make sure connection of this process is not shared with parent
+    process, e.g. a worker forked by a pre-fork server after the master
+    has queried. It's cheap, and called by :MongoForkMiddleware: on
+    every request.
+    '''
+    pid = os.getpid()
+    if _pid == pid:
+        return
+    with _lock:
+        if _pid == pid:
+            return
+        # Sockets are closed in this process only. Collections keep the
+        # client they are got from, so they are dropped too.
+        disconnect(DEFAULT_CONNECTION_NAME)
+        for each in _document_registry.values():
+            each._collection = None
+        register()
+
+class MongoForkMiddleware(object):
+    '''
+    Check connection of mongoengine before any view queries.
+    '''
+    def process_request(self, request):
+        ensure_process()
+        return None
@@ -23,6 +23,42 @@ ALLOWED_HOSTS = []
 
 DBNAME = 'feilinn_demo'
 
+# MongoDB of mongoengine documents, connected on first query of each
+# process. Set FEILINN_MONGO_HOST to mongomock://localhost to run
+# against an in-process mock.
+MONGO_HOST = os.environ.get('FEILINN_MONGO_HOST', 'localhost')
+MONGO_PORT = 27017
+MONGO_POOL_SIZE = 10
+MONGO_CONNECT_TIMEOUT_MS = 2000
+MONGO_SOCKET_TIMEOUT_MS = 5000
+# Maximum wait of a query for a socket when pool is exhausted.
+MONGO_WAIT_QUEUE_TIMEOUT_MS = 1000
+
+# Crawl database written by data/spider/douban.py.
+CRAWL_DB = os.path.join(BASE_DIR, 'ruuxee_douban_spider.db')
+
+# Seconds lists of pages are cached in each process.
+DATA_CACHE_TTL = 60
+
+# Caches count hits and misses, see feilinn_demo.caching.stats(). Use
+# feilinn_demo.caching.FileBasedCache with a directory as LOCATION to
+# share a cache between processes.
+CACHES = {
+    # Whole responses for anonymous users.
+    'default': {
+        'BACKEND': 'feilinn_demo.caching.LocMemCache',
+        'LOCATION': 'responses',
+    },
+    # Used by {% cache %} tags.
+    'template_fragments': {
+        'BACKEND': 'feilinn_demo.caching.LocMemCache',
+        'LOCATION': 'fragments',
+    },
+}
+
+RESPONSE_CACHE_TIMEOUT = 60
+FRAGMENT_CACHE_TIMEOUT = 600
+
 # Application definition
 
 INSTALLED_APPS = (
@@ -39,6 +75,7 @@ INSTALLED_APPS = (
 #MONGOENGINE_USER_DOCUMENT = 'mongoengine.django.auth.User'
 
 MIDDLEWARE_CLASSES = (
+    'feilinn_demo.mongo.MongoForkMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -90,6 +127,19 @@ USE_TZ = True
 STATIC_URL  = '/static/'
 STATIC_ROOT = '/var/www/feilinn.com/static'
 
+TEMPLATE_CONTEXT_PROCESSORS = (
+    'django.contrib.auth.context_processors.auth',
+    'django.core.context_processors.debug',
+    'django.core.context_processors.i18n',
+    'django.core.context_processors.media',
+    'django.core.context_processors.static',
+    'django.core.context_processors.tz',
+    'django.contrib.messages.context_processors.messages',
+    # Fragment caches are keyed on request.get_host.
+    'django.core.context_processors.request',
+    'feilinn_demo.caching.fragment_timeouts',
+)
+
 TEMPLATE_DIRS = (
     os.path.join(BASE_DIR, 'feilinn_demo/templates'),
 )
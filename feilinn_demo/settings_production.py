@@ -0,0 +1,26 @@
+# -*- coding: UTF-8 -*-
+'''
+  Copyright (c) 2014 Present Inc.
+
+  Settings for production. Use it with
+  DJANGO_SETTINGS_MODULE=feilinn_demo.settings_production.
+'''
+
+import os
+from feilinn_demo.settings import *
+
+DEBUG = False
+
+TEMPLATE_DEBUG = False
+
+ALLOWED_HOSTS = os.environ.get('FEILINN_ALLOWED_HOSTS', \
+                               'feilinn.com,.feilinn.com').split(',')
+
+# Templates are read and compiled once per process. wsgi.py compiles
+# all of them at startup.
+TEMPLATE_LOADERS = (
+    ('django.template.loaders.cached.Loader', (
+        'django.template.loaders.filesystem.Loader',
+        'django.template.loaders.app_directories.Loader',
+    )),
+)
@@ -10,4 +10,5 @@ urlpatterns = patterns('',
     url(r'^$',          'feilinn_demo.views.domain'),
     url(r'^domain/$',   'feilinn_demo.views.domain'),
     url(r'^topic/$',    'feilinn_demo.views.topic'),
+    url(r'^cache/stats/$', 'feilinn_demo.views.cache_stats'),
 )
@@ -5,21 +5,34 @@
 
 from django.template.loader import get_template
 from django.template import Context, Template, RequestContext
-from django.http import HttpResponse
+from django.http import HttpResponse, Http404
 from django.shortcuts import render, render_to_response
-from feilinn_demo.models import User, Domain
+from django.conf import settings
+from feilinn_demo import dataaccess, caching
 import datetime
+import json
 
+@caching.cache_anonymous()
 def domain(request):
-    dom_list = {'1', '2', '3', '4', '5', '6', '7', '8'}
-    tri_list = {'q 1', 'q 2', 'q 3'}
-    ship_list = {'title': '领域', 'domain_list' : dom_list, 'question_list': tri_list, 'people_list': tri_list}
+    # Question list is passed as function, so it's not loaded when its
+    # fragment is cached.
+    ship_list = {'title': '领域',
+                 'domain_list': dataaccess.domain_list(),
+                 'question_list': dataaccess.question_list,
+                 'people_list': dataaccess.people_list()}
     return render_to_response('domain.html', ship_list, context_instance=RequestContext(request))
 
+@caching.cache_anonymous()
 def topic(request):
     ship_list = {'title': '话题'}
     return render_to_response('topic.html', ship_list,context_instance=RequestContext(request))
 
+def cache_stats(request):
+    if not settings.DEBUG and not request.user.is_staff:
+        raise Http404
+    stats = {'caches': caching.stats(), 'data': dataaccess.cache_stats()}
+    return HttpResponse(json.dumps(stats), content_type='application/json')
+
 '''
 TODO:
 
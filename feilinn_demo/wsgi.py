@@ -12,3 +12,24 @@ os.environ.setdefault("DJANGO_SETTINGS_MODULE", "feilinn_demo.settings")
 
 from django.core.wsgi import get_wsgi_application
 application = get_wsgi_application()
+
+def warm_templates():
+    """
+    Compile all templates of TEMPLATE_DIRS, if they are kept by cached
+    template loader, so no request pays for it. A broken template fails
+    startup.
+    """
+    from django.conf import settings
+    from django.template.loader import get_template
+    loaders = [each[0] if isinstance(each, (list, tuple)) else each \
+               for each in settings.TEMPLATE_LOADERS]
+    if 'django.template.loaders.cached.Loader' not in loaders:
+        return
+    for each_dir in settings.TEMPLATE_DIRS:
+        for root, dirs, files in os.walk(each_dir):
+            for name in files:
+                if name.endswith('.html'):
+                    path = os.path.relpath(os.path.join(root, name), each_dir)
+                    get_template(path.replace(os.sep, '/'))
+
+warm_templates()